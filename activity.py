@@ -0,0 +1,91 @@
+"""
+Последняя активность пользователей и спящие анкеты
+
+Каждое обновление от пользователя только отмечается в памяти (track_update,
+группа -2): словарь telegram_id -> время, без запроса к БД. Раз в
+ACTIVITY_FLUSH_INTERVAL сек накопленное записывается в users.last_seen_at
+пачками по ACTIVITY_BATCH_SIZE строк в отдельном потоке, при остановке
+бота - ещё раз. Сколько бы обновлений ни прислал пользователь за интервал,
+в БД уходит одна строка.
+
+Пользователи, которые не заходили DORMANT_AFTER_DAYS дней, становятся
+спящими (users.is_dormant, задача dormant_job первого воркера): их анкет
+нет в ленте, и они не считаются в активных пользователях. Вернувшийся
+пользователь перестаёт быть спящим при ближайшей записи активности.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import config
+import database as db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# telegram_id -> время последнего обновления, ещё не записанное в БД
+_seen = {}
+
+
+def seen(telegram_id: int):
+    """Отметить активность пользователя (в БД попадёт при следующей записи)"""
+    _seen[telegram_id] = datetime.now()
+
+
+async def track_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Любое обновление от пользователя, кроме блокировки бота, - активность (группа -2)"""
+    if update.my_chat_member or not update.effective_user:
+        return
+    seen(update.effective_user.id)
+
+
+async def flush() -> int:
+    """Записать накопленную активность в БД; вернуть число пользователей"""
+    if not _seen:
+        return 0
+    items = list(_seen.items())
+    _seen.clear()
+
+    started = time.perf_counter()
+    restored = []
+    for start in range(0, len(items), config.ACTIVITY_BATCH_SIZE):
+        batch = dict(items[start:start + config.ACTIVITY_BATCH_SIZE])
+        try:
+            restored += await asyncio.to_thread(db.touch_users, batch)
+        except Exception as e:
+            # Незаписанное вернётся в следующую запись, если пользователь с тех пор не заходил
+            for telegram_id, last_seen_at in items[start:]:
+                _seen.setdefault(telegram_id, last_seen_at)
+            logger.error(f"Не удалось записать активность {len(items) - start} пользователей: {e}")
+            return start
+    metrics.activity_flush_seconds.observe(time.perf_counter() - started)
+
+    if restored:
+        metrics.dormant_restored.inc(amount=len(restored))
+        logger.info(f"Вернулись спящие пользователи: {len(restored)}")
+    return len(items)
+
+
+async def flush_job(context):
+    """Периодическая задача записи активности"""
+    await flush()
+
+
+async def mark_dormant() -> int:
+    """Перевести в спящие пользователей, не заходивших DORMANT_AFTER_DAYS дней"""
+    inactive_since = datetime.now() - timedelta(days=config.DORMANT_AFTER_DAYS)
+    marked = await asyncio.to_thread(db.mark_dormant_users, inactive_since)
+    if marked:
+        metrics.dormant_marked.inc(amount=marked)
+        logger.info(f"Переведены в спящие (не заходили {config.DORMANT_AFTER_DAYS} дн.): {marked}")
+    metrics.dormant_users.set(await asyncio.to_thread(db.count_dormant_users))
+    return marked
+
+
+async def dormant_job(context):
+    """Периодическая задача поиска уснувших пользователей"""
+    await mark_dormant()
@@ -2,7 +2,6 @@
 Админ панель для управления анкетами
 """
 import logging
-import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     CommandHandler,
@@ -15,13 +14,24 @@ from telegram.ext import (
 
 import config
 import database as db
+import operator_inbox
 import payments
+import photos
+import sqlprofile
 
 logger = logging.getLogger(__name__)
 
 # Состояния для добавления анкеты админом
 ADMIN_NAME, ADMIN_AGE, ADMIN_CITY, ADMIN_DESCRIPTION, ADMIN_PHOTO = range(5)
 
+# Анкет на странице списка (не больше 10 - ограничение альбома Telegram)
+PROFILES_PAGE_SIZE = 10
+# Анкет на странице выбора для ссылки на оплату
+PAYMENT_LINK_PAGE_SIZE = 20
+# Ограничения Telegram на длину подписи к фото и текста сообщения
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
 
 def is_admin(user_id: int) -> bool:
     """Проверка является ли пользователь админом"""
@@ -40,13 +50,15 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         female_count = session.query(db.User).filter_by(gender='female', is_active=True).count()
     finally:
         session.close()
+    inbox_count = db.count_operator_conversations()
     
     keyboard = [
         [InlineKeyboardButton("➕ Добавить женскую анкету", callback_data='admin_add_female')],
         [InlineKeyboardButton("📊 Статистика", callback_data='admin_stats')],
         [InlineKeyboardButton("❤️ Статистика лайков", callback_data='admin_likes_stats')],
         [InlineKeyboardButton(f"👥 Список анкет (👨 {male_count} | 👩 {female_count})", callback_data='admin_list_profiles')],
-        [InlineKeyboardButton("🔗 Ссылка для оплаты", callback_data='admin_payment_link')]
+        [InlineKeyboardButton("🔗 Ссылка для оплаты", callback_data='admin_payment_link')],
+        [InlineKeyboardButton(f"📥 Входящие анкет ({inbox_count})", callback_data='admin_operator_inbox')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -151,11 +163,10 @@ async def admin_photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     fake_telegram_id = random.randint(1000000000, 9999999999)
     
     # Сохраняем фото
-    file = await context.bot.get_file(photo.file_id)
-    file_path = os.path.join(config.PHOTOS_DIR, f"admin_{fake_telegram_id}.jpg")
-    await file.download_to_drive(file_path)
+    stored = await photos.ingest_telegram_photo(context.bot, photo)
+    file_path = stored['path']
     
-    # Создаем пользователя в БД
+    # Создаем пользователя в БД: анкету ведут админы, её входящие приходят в админ панель
     user = db.create_user(
         telegram_id=fake_telegram_id,
         username="Анкета от админа",
@@ -164,8 +175,10 @@ async def admin_photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         age=context.user_data['age'],
         city=context.user_data['city'],
         description=context.user_data['description'],
-        photo_path=file_path
+        photo_path=file_path,
+        operator_managed=True
     )
+    operator_inbox.register_profile(fake_telegram_id)
     
     # Показываем созданную анкету
     hashtag_str = user.hashtag if user.hashtag else "—"
@@ -178,11 +191,7 @@ async def admin_photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     
     try:
-        with open(user.photo_path, 'rb') as photo_file:
-            await update.message.reply_photo(
-                photo=photo_file,
-                caption=text
-            )
+        await photos.reply_profile_photo(update.message, user, text)
     except:
         await update.message.reply_text(text)
     
@@ -207,14 +216,22 @@ async def admin_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         male_users = session.query(db.User).filter_by(gender='male').count()
         female_users = session.query(db.User).filter_by(gender='female').count()
         
-        active_male = session.query(db.User).filter_by(gender='male', is_active=True).count()
-        active_female = session.query(db.User).filter_by(gender='female', is_active=True).count()
+        active_male = session.query(db.User).filter_by(
+            gender='male', is_active=True, is_unreachable=False, is_dormant=False
+        ).count()
+        active_female = session.query(db.User).filter_by(
+            gender='female', is_active=True, is_unreachable=False, is_dormant=False
+        ).count()
+        unreachable = session.query(db.User).filter_by(is_unreachable=True).count()
+        dormant = session.query(db.User).filter_by(is_dormant=True).count()
         
         text = (
             f"📊 Статистика бота\n\n"
             f"👥 Всего пользователей: {total_users}\n"
             f"   👨 Мужчин: {male_users} (активных: {active_male})\n"
-            f"   👩 Женщин: {female_users} (активных: {active_female})"
+            f"   👩 Женщин: {female_users} (активных: {active_female})\n"
+            f"🚫 Недоступны (заблокировали бота, чат не найден): {unreachable}\n"
+            f"💤 Спящие (не заходили {config.DORMANT_AFTER_DAYS} дн.): {dormant}"
         )
         
         await query.message.reply_text(text)
@@ -268,6 +285,8 @@ async def admin_list_profiles_callback(update: Update, context: ContextTypes.DEF
     keyboard = [
         [InlineKeyboardButton("👩 Все женские анкеты", callback_data='admin_list_female')],
         [InlineKeyboardButton("👨 Все мужские анкеты", callback_data='admin_list_male')],
+        [InlineKeyboardButton("🖼 Обзор женских анкет", callback_data='admin_sheet_female')],
+        [InlineKeyboardButton("🖼 Обзор мужских анкет", callback_data='admin_sheet_male')],
         [InlineKeyboardButton("🔙 Назад", callback_data='admin_back_to_menu')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -279,8 +298,79 @@ async def admin_list_profiles_callback(update: Update, context: ContextTypes.DEF
     )
 
 
+def _profile_caption(profile) -> str:
+    """Подпись к фото анкеты в списке"""
+    if profile.gender == 'female':
+        hashtag_str = profile.hashtag if profile.hashtag else "—"
+        profile_type = "🤖 Фейк" if profile.username == 'Анкета от админа' else "👤 Реальная"
+        text = (
+            f"{profile_type}\n"
+            f"👩 {profile.name}, {profile.age}\n"
+            f"🏷 Код: {hashtag_str}\n"
+            f"ID: {profile.id}\n"
+            f"📍 {profile.city}\n\n"
+            f"{profile.description}"
+        )
+    else:
+        text = (
+            f"👨 {profile.name}, {profile.age}\n"
+            f"ID: {profile.id}\n"
+            f"📍 {profile.city}\n\n"
+            f"{profile.description}"
+        )
+    return text[:CAPTION_LIMIT]
+
+
+async def _send_profiles_page(message, gender: str, after_id: int = 0, before_id: int = None):
+    """
+    Показать страницу анкет: один альбом с фото и одно сообщение с кнопками
+    
+    Args:
+        message: сообщение, в ответ на которое отправляется страница
+        gender: 'male' или 'female'
+        after_id: показать анкеты после этого id (следующая страница)
+        before_id: показать анкеты до этого id (предыдущая страница)
+    """
+    title = "👩 Женские анкеты" if gender == 'female' else "👨 Мужские анкеты"
+    empty_text = "Нет активных женских анкет." if gender == 'female' else "Нет активных мужских анкет."
+    
+    profiles, has_prev, has_next = db.get_profiles_page(
+        gender, after_id=after_id, before_id=before_id, limit=PROFILES_PAGE_SIZE
+    )
+    if not profiles:
+        await message.reply_text(f"{title}: 0\n\n{empty_text}")
+        return
+    
+    captions = [_profile_caption(profile) for profile in profiles]
+    try:
+        await photos.reply_profiles_album(message, profiles, captions)
+    except Exception as e:
+        logger.error(f"Ошибка при отправке альбома анкет: {e}")
+        await message.reply_text("\n\n".join(captions)[:MESSAGE_LIMIT])
+    
+    keyboard = [
+        [InlineKeyboardButton(f"🗑 Удалить: {profile.name} (ID {profile.id})",
+                              callback_data=f'admin_delete_{profile.id}')]
+        for profile in profiles
+    ]
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f'admin_page_{gender}_prev_{profiles[0].id}'))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f'admin_page_{gender}_next_{profiles[-1].id}'))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("🔙 К категориям", callback_data='admin_list_profiles')])
+    
+    await message.reply_text(
+        f"{title}: {db.count_active_profiles(gender)}\n"
+        f"Показаны ID {profiles[0].id}–{profiles[-1].id}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
 async def admin_list_female_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать список всех женских анкет"""
+    """Показать первую страницу женских анкет"""
     query = update.callback_query
     await query.answer()
     
@@ -288,59 +378,11 @@ async def admin_list_female_callback(update: Update, context: ContextTypes.DEFAU
         await query.message.reply_text("У вас нет прав доступа.")
         return
     
-    session = db.get_session()
-    try:
-        # Получаем все женские анкеты
-        profiles = session.query(db.User).filter(
-            db.User.gender == 'female',
-            db.User.is_active == True
-        ).all()
-        
-        if not profiles:
-            await query.message.reply_text(
-                "👩 Женские анкеты: 0\n\n"
-                "Нет активных женских анкет."
-            )
-            return
-        
-        await query.message.reply_text(
-            f"👩 Женские анкеты: {len(profiles)}"
-        )
-        
-        # Показываем все анкеты
-        for profile in profiles:
-            hashtag_str = profile.hashtag if profile.hashtag else "—"
-            profile_type = "🤖 Фейк" if profile.username == 'Анкета от админа' else "👤 Реальная"
-            text = (
-                f"{profile_type}\n"
-                f"👩 {profile.name}, {profile.age}\n"
-                f"🏷 Код: {hashtag_str}\n"
-                f"ID: {profile.id}\n"
-                f"📍 {profile.city}\n\n"
-                f"{profile.description}"
-            )
-            
-            keyboard = [
-                [InlineKeyboardButton("🗑 Удалить", callback_data=f'admin_delete_{profile.id}')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            try:
-                with open(profile.photo_path, 'rb') as photo:
-                    await query.message.reply_photo(
-                        photo=photo,
-                        caption=text,
-                        reply_markup=reply_markup
-                    )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке фото: {e}")
-                await query.message.reply_text(text, reply_markup=reply_markup)
-    finally:
-        session.close()
+    await _send_profiles_page(query.message, 'female')
 
 
 async def admin_list_male_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать список всех мужских анкет"""
+    """Показать первую страницу мужских анкет"""
     query = update.callback_query
     await query.answer()
     
@@ -348,51 +390,83 @@ async def admin_list_male_callback(update: Update, context: ContextTypes.DEFAULT
         await query.message.reply_text("У вас нет прав доступа.")
         return
     
-    session = db.get_session()
+    await _send_profiles_page(query.message, 'male')
+
+
+async def admin_profiles_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перелистнуть страницу списка анкет"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_admin(update.effective_user.id):
+        await query.message.reply_text("У вас нет прав доступа.")
+        return
+    
+    # admin_page_<gender>_<next|prev>_<id>
+    _, _, gender, direction, cursor = query.data.split('_')
+    if direction == 'next':
+        await _send_profiles_page(query.message, gender, after_id=int(cursor))
+    else:
+        await _send_profiles_page(query.message, gender, before_id=int(cursor))
+
+
+async def admin_contact_sheet_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обзор анкет: одна картинка-сетка с миниатюрами на страницу"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_admin(update.effective_user.id):
+        await query.message.reply_text("У вас нет прав доступа.")
+        return
+    
+    # admin_sheet_<gender>[_<next|prev>_<id>]
+    parts = query.data.split('_')
+    gender = parts[2]
+    after_id, before_id = 0, None
+    if len(parts) == 5:
+        if parts[3] == 'next':
+            after_id = int(parts[4])
+        else:
+            before_id = int(parts[4])
+    
+    title = "👩 Женские анкеты" if gender == 'female' else "👨 Мужские анкеты"
+    profiles, has_prev, has_next = db.get_profiles_page(
+        gender, after_id=after_id, before_id=before_id, limit=config.CONTACT_SHEET_PAGE_SIZE
+    )
+    if not profiles:
+        await query.message.reply_text(f"{title}: 0")
+        return
+    
+    labels = []
+    for profile in profiles:
+        hashtag_str = profile.hashtag if profile.hashtag else f"ID {profile.id}"
+        labels.append(f"{profile.name}, {profile.age}\n{hashtag_str}")
+    
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f'admin_sheet_{gender}_prev_{profiles[0].id}'))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f'admin_sheet_{gender}_next_{profiles[-1].id}'))
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("🔙 К категориям", callback_data='admin_list_profiles')])
+    
+    caption = (
+        f"{title}: {db.count_active_profiles(gender)}\n"
+        f"На картинке ID {profiles[0].id}–{profiles[-1].id}"
+    )
     try:
-        # Получаем все мужские анкеты
-        profiles = session.query(db.User).filter(
-            db.User.gender == 'male',
-            db.User.is_active == True
-        ).all()
-        
-        if not profiles:
-            await query.message.reply_text(
-                "👨 Мужские анкеты: 0\n\n"
-                "Нет активных мужских анкет."
-            )
-            return
-        
+        sheet = await photos.build_contact_sheet(profiles, labels)
+        await query.message.reply_photo(
+            photo=sheet,
+            caption=caption,
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при построении обзора анкет: {e}")
         await query.message.reply_text(
-            f"👨 Мужские анкеты: {len(profiles)}"
+            caption + "\n\n❌ Не удалось собрать картинку.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        
-        # Показываем все анкеты
-        for profile in profiles:
-            text = (
-                f"👨 {profile.name}, {profile.age}\n"
-                f"ID: {profile.id}\n"
-                f"📍 {profile.city}\n\n"
-                f"{profile.description}"
-            )
-            
-            keyboard = [
-                [InlineKeyboardButton("🗑 Удалить", callback_data=f'admin_delete_{profile.id}')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            try:
-                with open(profile.photo_path, 'rb') as photo:
-                    await query.message.reply_photo(
-                        photo=photo,
-                        caption=text,
-                        reply_markup=reply_markup
-                    )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке фото: {e}")
-                await query.message.reply_text(text, reply_markup=reply_markup)
-    finally:
-        session.close()
 
 
 async def admin_back_to_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -430,9 +504,20 @@ async def admin_delete_profile_callback(update: Update, context: ContextTypes.DE
     success = db.delete_user_profile(profile_id)
     
     if success:
-        await query.edit_message_caption(
-            caption=query.message.caption + "\n\n🗑 Анкета полностью удалена из базы данных"
-        )
+        if query.message.caption:
+            await query.edit_message_caption(
+                caption=query.message.caption + "\n\n🗑 Анкета полностью удалена из базы данных"
+            )
+        else:
+            # Сообщение со списком: убираем кнопку удалённой анкеты
+            keyboard = [
+                row for row in query.message.reply_markup.inline_keyboard
+                if not any(button.callback_data == query.data for button in row)
+            ]
+            await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
+            await query.message.reply_text(
+                f"🗑 Анкета {profile_name} (ID {profile_id}) полностью удалена из базы данных"
+            )
         logger.info(f"Админ {update.effective_user.id} удалил анкету {profile_name} (ID: {profile_id})")
     else:
         await query.message.reply_text("❌ Ошибка при удалении анкеты.")
@@ -445,6 +530,32 @@ async def admin_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+def _payment_link_keyboard(after_id: int = 0, before_id: int = None):
+    """Страница кнопок выбора анкеты для ссылки на оплату (None, если анкет нет)"""
+    profiles, has_prev, has_next = db.get_profiles_page(
+        'female', after_id=after_id, before_id=before_id, limit=PAYMENT_LINK_PAGE_SIZE
+    )
+    if not profiles:
+        return None
+    
+    keyboard = []
+    for profile in profiles:
+        hashtag_str = profile.hashtag if profile.hashtag else "—"
+        button_text = f"👩 {profile.name}, {profile.age} ({hashtag_str})"
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=f'gen_link_{profile.id}')])
+    
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f'admin_pay_page_prev_{profiles[0].id}'))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f'admin_pay_page_next_{profiles[-1].id}'))
+    if navigation:
+        keyboard.append(navigation)
+    
+    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data='admin_cancel_link')])
+    return InlineKeyboardMarkup(keyboard)
+
+
 async def admin_payment_link_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать выбор анкеты для генерации ссылки на оплату"""
     query = update.callback_query
@@ -454,38 +565,40 @@ async def admin_payment_link_callback(update: Update, context: ContextTypes.DEFA
         await query.message.reply_text("У вас нет прав доступа.")
         return
     
-    session = db.get_session()
-    try:
-        # Получаем все женские анкеты (созданные админом)
-        female_profiles = session.query(db.User).filter(
-            db.User.gender == 'female',
-            db.User.is_active == True
-        ).all()
-        
-        if not female_profiles:
-            await query.message.reply_text(
-                "🔗 Генерация ссылки для оплаты\n\n"
-                "❌ Нет доступных анкет."
-            )
-            return
-        
-        keyboard = []
-        for profile in female_profiles:
-            hashtag_str = profile.hashtag if profile.hashtag else "—"
-            button_text = f"👩 {profile.name}, {profile.age} ({hashtag_str})"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f'gen_link_{profile.id}')])
-        
-        keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data='admin_cancel_link')])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+    reply_markup = _payment_link_keyboard()
+    if not reply_markup:
         await query.message.reply_text(
             "🔗 Генерация ссылки для оплаты\n\n"
-            "Выберите анкету, для которой нужно создать ссылку:\n\n"
-            "💡 Эту ссылку можно отправить клиенту, чтобы он сам указал сумму и оплатил.",
-            reply_markup=reply_markup
+            "❌ Нет доступных анкет."
         )
-    finally:
-        session.close()
+        return
+    
+    await query.message.reply_text(
+        "🔗 Генерация ссылки для оплаты\n\n"
+        "Выберите анкету, для которой нужно создать ссылку:\n\n"
+        "💡 Эту ссылку можно отправить клиенту, чтобы он сам указал сумму и оплатил.",
+        reply_markup=reply_markup
+    )
+
+
+async def admin_payment_link_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перелистнуть страницу выбора анкеты для ссылки на оплату"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_admin(update.effective_user.id):
+        await query.message.reply_text("У вас нет прав доступа.")
+        return
+    
+    # admin_pay_page_<next|prev>_<id>
+    direction, cursor = query.data.split('_')[3:]
+    if direction == 'next':
+        reply_markup = _payment_link_keyboard(after_id=int(cursor))
+    else:
+        reply_markup = _payment_link_keyboard(before_id=int(cursor))
+    
+    if reply_markup:
+        await query.edit_message_reply_markup(reply_markup=reply_markup)
 
 
 async def generate_payment_link_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -536,6 +649,70 @@ async def admin_cancel_link_callback(update: Update, context: ContextTypes.DEFAU
     await query.edit_message_text("❌ Генерация ссылки отменена.")
 
 
+async def sql_profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчики с наибольшим числом SQL-запросов (/sqlprofile, /sqlprofile reset - сбросить)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    if context.args and context.args[0] == 'reset':
+        sqlprofile.reset()
+        await update.message.reply_text("Статистика SQL сброшена.")
+        return
+    
+    report = sqlprofile.format_report()
+    if len(report) > MESSAGE_LIMIT:
+        report = report[:MESSAGE_LIMIT - 1] + '…'
+    await update.message.reply_text(report)
+
+
+async def admin_operator_inbox_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Неотвеченные диалоги анкет, которые ведут админы"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_admin(update.effective_user.id):
+        await query.message.reply_text("У вас нет прав доступа.")
+        return
+    
+    text, reply_markup = operator_inbox.conversations_page()
+    await query.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def operator_reply_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ответить пользователю от имени анкеты оператора"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_admin(update.effective_user.id):
+        await query.message.reply_text("У вас нет прав доступа.")
+        return
+    
+    # op_reply_<id анкеты>_<id пользователя>
+    _, _, profile_id, user_id = query.data.split('_')
+    profile = db.get_user_by_id(int(profile_id))
+    user = db.get_user_by_id(int(user_id))
+    if not profile or not user:
+        await query.message.reply_text("❌ Анкета или пользователь удалены.")
+        return
+    if not profile.is_operator_managed:
+        # От имени настоящих пользователей админы не пишут
+        await query.message.reply_text("❌ Эту анкету не ведут админы.")
+        return
+    
+    text, reply_markup = operator_inbox.start_reply(update.effective_user.id, profile, user)
+    await query.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def operator_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выйти из режима ответа от имени анкеты"""
+    query = update.callback_query
+    await query.answer()
+    
+    operator_inbox.replying.pop(update.effective_user.id, None)
+    await query.edit_message_reply_markup(reply_markup=None)
+    await query.message.reply_text("✅ Режим ответа от имени анкеты завершён.")
+
+
 def setup_admin_handlers(application):
     """Настройка обработчиков админ панели"""
     
@@ -550,20 +727,38 @@ def setup_admin_handlers(application):
             ADMIN_PHOTO: [MessageHandler(filters.PHOTO, admin_photo_handler)],
         },
         fallbacks=[CommandHandler('cancel', admin_cancel)],
+        name='admin_add_profile',
+        persistent=True,
+        conversation_timeout=config.CONVERSATION_TIMEOUT,
     )
     
     application.add_handler(CommandHandler('admin', admin_menu))
+    application.add_handler(CommandHandler('sqlprofile', sql_profile_command))
     application.add_handler(admin_conv_handler)
     application.add_handler(CallbackQueryHandler(admin_stats_callback, pattern='^admin_stats$'))
     application.add_handler(CallbackQueryHandler(admin_likes_stats_callback, pattern='^admin_likes_stats$'))
     application.add_handler(CallbackQueryHandler(admin_list_profiles_callback, pattern='^admin_list_profiles$'))
     application.add_handler(CallbackQueryHandler(admin_list_female_callback, pattern='^admin_list_female$'))
     application.add_handler(CallbackQueryHandler(admin_list_male_callback, pattern='^admin_list_male$'))
+    application.add_handler(CallbackQueryHandler(
+        admin_profiles_page_callback, pattern=r'^admin_page_(female|male)_(next|prev)_\d+$'
+    ))
+    application.add_handler(CallbackQueryHandler(
+        admin_contact_sheet_callback, pattern=r'^admin_sheet_(female|male)(_(next|prev)_\d+)?$'
+    ))
     application.add_handler(CallbackQueryHandler(admin_back_to_menu_callback, pattern='^admin_back_to_menu$'))
     application.add_handler(CallbackQueryHandler(admin_delete_profile_callback, pattern='^admin_delete_'))
     
+    # Входящие анкет, которые ведут админы
+    application.add_handler(CallbackQueryHandler(admin_operator_inbox_callback, pattern='^admin_operator_inbox$'))
+    application.add_handler(CallbackQueryHandler(operator_reply_callback, pattern=r'^op_reply_\d+_\d+$'))
+    application.add_handler(CallbackQueryHandler(operator_done_callback, pattern='^op_done$'))
+    
     # Обработчики для генерации ссылок на оплату
     application.add_handler(CallbackQueryHandler(admin_payment_link_callback, pattern='^admin_payment_link$'))
+    application.add_handler(CallbackQueryHandler(
+        admin_payment_link_page_callback, pattern=r'^admin_pay_page_(next|prev)_\d+$'
+    ))
     application.add_handler(CallbackQueryHandler(generate_payment_link_callback, pattern='^gen_link_'))
     application.add_handler(CallbackQueryHandler(admin_cancel_link_callback, pattern='^admin_cancel_link$'))
 
@@ -0,0 +1,32 @@
+"""
+Нагрузочные замеры функций database.py на синтетической базе большого размера
+
+Заполнить базу (по умолчанию 10% от «продакшен-масштаба»: 100 тыс.
+пользователей, 2 млн просмотров, 5 млн сообщений; --scale 1 - 1 млн / 20 млн / 50 млн):
+
+    python -m benchmarks.seed --database-url sqlite:///benchmarks/bench.db --reset
+    python -m benchmarks.seed --database-url postgresql://localhost/dating_bench --reset --scale 1
+
+Замерить функции и записать результат в benchmarks/results/<СУБД>-<коммит>-<время>.json:
+
+    python -m benchmarks.run --database-url sqlite:///benchmarks/bench.db
+
+Сравнить два прогона (например, до и после изменения):
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import os
+
+DEFAULT_DATABASE_URL = 'sqlite:///benchmarks/bench.db'
+
+
+def load_database(database_url: str):
+    """
+    Импортировать database.py, подключённый к указанной базе
+
+    database.py создаёт движок при импорте по config.DATABASE_URL, поэтому
+    адрес нужно выставить в окружение до первого импорта.
+    """
+    os.environ['DATABASE_URL'] = database_url
+    import database
+    return database
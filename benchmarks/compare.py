@@ -0,0 +1,57 @@
+"""
+Сравнение двух прогонов benchmarks.run
+
+Печатает медианы по каждому случаю и их отношение; код выхода 1, если
+какой-либо случай замедлился больше, чем в --threshold раз.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнить два результата benchmarks.run")
+    parser.add_argument('base', help="результат до изменения")
+    parser.add_argument('new', help="результат после изменения")
+    parser.add_argument('--threshold', type=float, default=1.2, help="допустимое замедление (во сколько раз)")
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    for label, run in (('до', base), ('после', new)):
+        meta = run['meta']
+        print(f"{label}: {meta['git_commit'] or '?'}{' (изменён)' if meta['git_dirty'] else ''}, "
+              f"{meta['dialect']}, {meta['timestamp']}")
+    if base['meta']['row_counts'] != new['meta']['row_counts']:
+        print("⚠️  Прогоны сделаны на базах разного размера, сравнение неточное")
+    print()
+
+    base_results = {(r['function'], r['case']): r for r in base['results']}
+    regressions = 0
+    print(f"{'функция':28} {'случай':18} {'до, мс':>10} {'после, мс':>10} {'отношение':>10}")
+    for result in new['results']:
+        key = (result['function'], result['case'])
+        old = base_results.get(key)
+        if old is None:
+            print(f"{key[0]:28} {key[1]:18} {'-':>10} {result['median_ms']:10.2f} {'новый':>10}")
+            continue
+        ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+        mark = ''
+        if ratio > args.threshold:
+            mark = '  ❌'
+            regressions += 1
+        elif ratio < 1 / args.threshold:
+            mark = '  ✅'
+        print(f"{key[0]:28} {key[1]:18} {old['median_ms']:10.2f} {result['median_ms']:10.2f} {ratio:10.2f}{mark}")
+
+    if regressions:
+        print(f"\nЗамедлилось случаев: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
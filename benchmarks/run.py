@@ -0,0 +1,165 @@
+"""
+Замер времени горячих функций database.py на заполненной базе (см. benchmarks.seed)
+
+Каждая функция вызывается на нескольких характерных наборах аргументов:
+самый активный пользователь (худший случай из-за перекоса данных) и
+типичный (медианный). Результат пишется в JSON для сравнения между коммитами.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import sqlalchemy
+from sqlalchemy import func
+
+from benchmarks import DEFAULT_DATABASE_URL, load_database
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def _ranked(session, column, filters=()):
+    """Значения column по убыванию числа строк: (самое частое, медианное)"""
+    rows = (session.query(column, func.count().label('n'))
+            .filter(*filters).group_by(column).order_by(func.count().desc()).all())
+    if not rows:
+        return None, None
+    return rows[0][0], rows[len(rows) // 2][0]
+
+
+def build_cases(db) -> list:
+    """[(функция, название случая, аргументы)]"""
+    session = db.get_session()
+    try:
+        heavy_viewer, typical_viewer = _ranked(session, db.ViewedProfile.user_id)
+        heavy_chatter, typical_chatter = _ranked(session, db.Like.from_user_id, [db.Like.chat_started == True])
+        heavy_recipient, typical_recipient = _ranked(session, db.Like.to_user_id, [db.Like.is_viewed == False])
+        pairs = (session.query(db.Message.to_user_id, db.Message.from_user_id, func.count().label('n'))
+                 .group_by(db.Message.to_user_id, db.Message.from_user_id)
+                 .order_by(func.count().desc()).all())
+        city = session.query(db.User.city).filter_by(id=heavy_viewer).scalar() if heavy_viewer else None
+    finally:
+        session.close()
+
+    cases = []
+    if heavy_viewer:
+        cases.append(('get_profiles_for_user', 'heaviest_viewer', (heavy_viewer, city)))
+        cases.append(('get_profiles_for_user', 'typical_viewer', (typical_viewer, city)))
+    if heavy_chatter:
+        cases.append(('get_active_chats', 'heaviest_chatter', (heavy_chatter,)))
+        cases.append(('get_active_chats', 'typical_chatter', (typical_chatter,)))
+    if heavy_recipient:
+        cases.append(('get_likes_inbox', 'most_liked', (heavy_recipient,)))
+        cases.append(('get_likes_inbox', 'typical_liked', (typical_recipient,)))
+    if pairs:
+        busiest, typical = pairs[0][:2], pairs[len(pairs) // 2][:2]
+        cases.append(('get_unread_count', 'busiest_chat', busiest))
+        cases.append(('get_unread_count', 'typical_chat', typical))
+        cases.append(('get_last_message', 'busiest_chat', busiest))
+        cases.append(('get_last_message', 'typical_chat', typical))
+    cases.append(('get_likes_stats_by_female', 'all', ()))
+    return cases
+
+
+def _result_size(result):
+    if result is None:
+        return 0
+    if isinstance(result, int):
+        return 1
+    try:
+        return len(result)
+    except TypeError:
+        return 1
+
+
+def time_case(function, args, repeats: int, max_seconds: float) -> dict:
+    """Прогрев + до repeats вызовов (не дольше max_seconds, но не меньше трёх)"""
+    result = function(*args)
+    timings = []
+    budget_end = time.perf_counter() + max_seconds
+    while len(timings) < repeats and (len(timings) < 3 or time.perf_counter() < budget_end):
+        start = time.perf_counter()
+        function(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        'runs': len(timings),
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'max_ms': round(timings[-1], 3),
+        'result_size': _result_size(result),
+    }
+
+
+def row_counts(db) -> dict:
+    session = db.get_session()
+    try:
+        return {model.__tablename__: session.query(func.count()).select_from(model).scalar()
+                for model in (db.User, db.ViewedProfile, db.Like, db.Message)}
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замерить функции database.py")
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--repeats', type=int, default=20, help="вызовов на случай")
+    parser.add_argument('--max-seconds', type=float, default=10, help="ограничение времени на случай")
+    parser.add_argument('--only', action='append', help="замерить только эту функцию (можно несколько раз)")
+    parser.add_argument('--output', help="файл результата (по умолчанию benchmarks/results/...)")
+    args = parser.parse_args()
+
+    db = load_database(args.database_url)
+    dialect = db.engine.dialect.name
+    commit = _git('rev-parse', '--short', 'HEAD')
+
+    meta = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'git_dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'dialect': dialect,
+        'server_version': '.'.join(map(str, db.engine.dialect.server_version_info or ()))
+                          if db.engine.dialect.server_version_info else None,
+        'database': db.engine.url.render_as_string(hide_password=True),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'row_counts': row_counts(db),
+    }
+    print(f"{meta['database']} ({dialect}), коммит {commit or '?'}: " +
+          ', '.join(f"{table} {count:,}" for table, count in meta['row_counts'].items()))
+
+    results = []
+    for name, case, case_args in build_cases(db):
+        if args.only and name not in args.only:
+            continue
+        timing = time_case(getattr(db, name), case_args, args.repeats, args.max_seconds)
+        results.append({'function': name, 'case': case, 'args': list(case_args), **timing})
+        print(f"  {name:28} {case:18} медиана {timing['median_ms']:10.2f} мс  "
+              f"p95 {timing['p95_ms']:10.2f} мс  ({timing['runs']} вызовов)")
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{dialect}-{commit or 'nogit'}-{stamp}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результат: {output}")
+
+
+if __name__ == '__main__':
+    main()
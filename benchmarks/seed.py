@@ -0,0 +1,295 @@
+"""
+Быстрое заполнение базы синтетическими данными с реалистичным перекосом
+
+- мужчин больше, чем женщин (FEMALE_SHARE);
+- популярность анкет и активность пользователей распределены по Ципфу:
+  немного популярных анкет собирают большую часть просмотров и лайков,
+  немного активных пользователей делают большую часть действий;
+- сообщения распределены по чатам с тяжёлым хвостом (несколько очень
+  длинных переписок и много коротких), старые почти все прочитаны.
+
+Строки пишутся напрямую через DB-API пачками (в PostgreSQL - через COPY),
+вторичные индексы на время загрузки удаляются и строятся заново в конце.
+"""
+import argparse
+import io
+import itertools
+import random
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+import migrations
+from benchmarks import DEFAULT_DATABASE_URL, load_database
+
+# Объёмы при --scale 1
+PRODUCTION_SCALE = {
+    'users': 1_000_000,
+    'viewed': 20_000_000,
+    'likes': 2_000_000,
+    'messages': 50_000_000,
+}
+
+FEMALE_SHARE = 0.35
+INACTIVE_SHARE = 0.03
+CHAT_SHARE = 0.25  # доля лайков, по которым начат чат
+BATCH_SIZE = 50_000
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань', 'Нижний Новгород',
+          'Челябинск', 'Самара', 'Омск', 'Ростов-на-Дону', 'Уфа', 'Красноярск', 'Воронеж', 'Пермь']
+MALE_NAMES = ['Алексей', 'Дмитрий', 'Иван', 'Максим', 'Сергей', 'Андрей', 'Павел', 'Никита']
+FEMALE_NAMES = ['Анна', 'Мария', 'Елена', 'Ольга', 'Дарья', 'Екатерина', 'Алина', 'Софья']
+PHRASES = ['Привет!', 'Как дела?', 'Чем занимаешься?', 'Давай встретимся', 'Хорошего дня :)',
+           'Спасибо за лайк', 'Я тоже люблю путешествовать', 'Во сколько тебе удобно?']
+
+
+def zipf_cum_weights(n: int, exponent: float) -> list:
+    """Накопленные веса рангов 1..n, вес ранга k пропорционален 1/k^exponent"""
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+class SkewedSampler:
+    """Случайный выбор элемента с весами по Ципфу (порядок рангов перемешан)"""
+
+    def __init__(self, items: list, exponent: float, rng: random.Random):
+        self.items = items[:]
+        rng.shuffle(self.items)
+        self.cum_weights = zipf_cum_weights(len(self.items), exponent)
+        self.total = self.cum_weights[-1]
+        self.rng = rng
+
+    def sample(self):
+        return self.items[bisect_left(self.cum_weights, self.rng.random() * self.total)]
+
+
+def _format_datetime(value: datetime) -> str:
+    # Формат, в котором SQLAlchemy хранит DateTime в SQLite (и который понимает COPY в PostgreSQL)
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def bulk_insert(engine, table: str, columns: tuple, rows) -> int:
+    """Записать строки (кортежи значений columns) пачками по BATCH_SIZE"""
+    total = 0
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        if engine.dialect.name == 'postgresql':
+            column_list = ', '.join(columns)
+            for batch in _batches(rows):
+                buffer = io.StringIO()
+                for row in batch:
+                    buffer.write('\t'.join(_copy_value(value) for value in row))
+                    buffer.write('\n')
+                buffer.seek(0)
+                cursor.copy_expert(f'COPY {table} ({column_list}) FROM STDIN', buffer)
+                total += len(batch)
+        else:
+            if engine.dialect.name == 'sqlite':
+                # База одноразовая: журнал и fsync при загрузке не нужны
+                cursor.execute('PRAGMA journal_mode=OFF')
+                cursor.execute('PRAGMA synchronous=OFF')
+            placeholder = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+            sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([placeholder] * len(columns))})"
+            for batch in _batches(rows):
+                cursor.executemany(sql, [
+                    tuple(int(value) if isinstance(value, bool) else value for value in row) for row in batch
+                ])
+                total += len(batch)
+        raw.commit()
+    finally:
+        raw.close()
+    return total
+
+
+def _batches(rows):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+class Seeder:
+    """Генерация связанных таблиц users, viewed_profiles, likes, messages"""
+
+    def __init__(self, db, counts: dict, seed: int):
+        self.db = db
+        self.counts = counts
+        self.rng = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+        self.men = []
+        self.women = []
+        self.chats = []
+
+    def _log(self, table: str, count: int, started: float):
+        elapsed = time.perf_counter() - started
+        print(f"  {table}: {count:,} строк за {elapsed:.1f} с ({count / max(elapsed, 1e-9):,.0f} строк/с)")
+
+    def users(self):
+        rng = self.rng
+        city_sampler = SkewedSampler(CITIES, 1.0, rng)
+        for user_id in range(1, self.counts['users'] + 1):
+            female = rng.random() < FEMALE_SHARE
+            (self.women if female else self.men).append(user_id)
+            registered = self.now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+            yield (
+                user_id,
+                10_000_000 + user_id,
+                f'user{user_id}',
+                rng.choice(FEMALE_NAMES if female else MALE_NAMES),
+                'female' if female else 'male',
+                rng.randint(18, 50),
+                city_sampler.sample(),
+                'Синтетическая анкета для замеров производительности',
+                f'bench/{user_id}.jpg',
+                f'#B{user_id:07d}' if female else None,
+                _format_datetime(registered),
+                rng.random() >= INACTIVE_SHARE,
+            )
+
+    def viewed_profiles(self):
+        rng = self.rng
+        viewers = SkewedSampler(self.men, 0.8, rng)
+        profiles = SkewedSampler(self.women, 1.0, rng)
+        for row_id in range(1, self.counts['viewed'] + 1):
+            created = self.now - timedelta(seconds=rng.randrange(180 * 24 * 3600))
+            yield row_id, viewers.sample(), profiles.sample(), _format_datetime(created)
+
+    def likes(self):
+        rng = self.rng
+        likers = SkewedSampler(self.men, 0.8, rng)
+        profiles = SkewedSampler(self.women, 1.0, rng)
+        seen = set()
+        row_id = 0
+        while row_id < self.counts['likes']:
+            pair = (likers.sample(), profiles.sample())
+            # Один мужчина ставит одной анкете не больше одного лайка
+            if pair in seen:
+                if len(seen) >= len(self.men) * len(self.women):
+                    break
+                continue
+            seen.add(pair)
+            row_id += 1
+            chat_started = rng.random() < CHAT_SHARE
+            if chat_started:
+                self.chats.append(pair)
+            created = self.now - timedelta(seconds=rng.randrange(180 * 24 * 3600))
+            yield row_id, pair[0], pair[1], _format_datetime(created), chat_started or rng.random() < 0.7, chat_started
+
+    def messages(self):
+        rng = self.rng
+        if not self.chats:
+            return
+        chats = SkewedSampler(self.chats, 1.1, rng)
+        total = self.counts['messages']
+        period = 90 * 24 * 3600
+        start = self.now - timedelta(seconds=period)
+        for row_id in range(1, total + 1):
+            man, woman = chats.sample()
+            sender, receiver = (man, woman) if rng.random() < 0.55 else (woman, man)
+            # Сообщения идут по времени; непрочитанные - в основном последние
+            position = row_id / total
+            created = start + timedelta(seconds=period * position)
+            is_read = position < 0.98 or rng.random() < 0.5
+            yield row_id, sender, receiver, rng.choice(PHRASES), _format_datetime(created), is_read
+
+    def run(self):
+        db = self.db
+        engine = db.engine
+        tables = [db.User.__table__, db.ViewedProfile.__table__, db.Like.__table__, db.Message.__table__]
+        indexes = [index for table in tables for index in table.indexes]
+
+        print("Удаление вторичных индексов на время загрузки...")
+        for index in indexes:
+            index.drop(engine, checkfirst=True)
+
+        print("Загрузка данных:")
+        started = time.perf_counter()
+        count = bulk_insert(engine, 'users', (
+            'id', 'telegram_id', 'username', 'name', 'gender', 'age', 'city', 'description',
+            'photo_path', 'hashtag', 'registered_at', 'is_active'
+        ), self.users())
+        self._log('users', count, started)
+
+        started = time.perf_counter()
+        count = bulk_insert(engine, 'viewed_profiles', ('id', 'user_id', 'viewed_user_id', 'created_at'),
+                            self.viewed_profiles())
+        self._log('viewed_profiles', count, started)
+
+        started = time.perf_counter()
+        count = bulk_insert(engine, 'likes', ('id', 'from_user_id', 'to_user_id', 'created_at', 'is_viewed',
+                                              'chat_started'), self.likes())
+        self._log('likes', count, started)
+
+        started = time.perf_counter()
+        count = bulk_insert(engine, 'messages', ('id', 'from_user_id', 'to_user_id', 'text', 'created_at',
+                                                 'is_read'), self.messages())
+        self._log('messages', count, started)
+
+        print("Построение индексов...")
+        started = time.perf_counter()
+        for index in indexes:
+            index.create(engine)
+        print(f"  {len(indexes)} индексов за {time.perf_counter() - started:.1f} с")
+
+        # Счётчики непросмотренных лайков при загрузке в обход add_like не ведутся
+        db.recount_unviewed_likes()
+
+        with engine.begin() as conn:
+            if engine.dialect.name == 'postgresql':
+                # id задавались явно - сдвигаем последовательности за максимальный id
+                for table in tables:
+                    conn.exec_driver_sql(
+                        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                        f"(SELECT COALESCE(MAX(id), 1) FROM {table.name}))"
+                    )
+            conn.exec_driver_sql('ANALYZE')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заполнить базу синтетическими данными для замеров")
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--scale', type=float, default=0.1, help="доля от 1 млн пользователей / 20 млн просмотров / "
+                                                                 "2 млн лайков / 50 млн сообщений")
+    for name in PRODUCTION_SCALE:
+        parser.add_argument(f'--{name}', type=int, help=f"задать число строк ({name}) явно")
+    parser.add_argument('--seed', type=int, default=42, help="зерно генератора (одинаковые данные между прогонами)")
+    parser.add_argument('--reset', action='store_true', help="удалить существующие таблицы перед загрузкой")
+    args = parser.parse_args()
+
+    counts = {name: getattr(args, name) or max(1, int(total * args.scale)) for name, total in PRODUCTION_SCALE.items()}
+
+    db = load_database(args.database_url)
+    if args.reset:
+        db.Base.metadata.drop_all(db.engine)
+        migrations.schema_version.drop(db.engine, checkfirst=True)
+    db.init_db()
+
+    session = db.get_session()
+    try:
+        if session.query(db.User).first() is not None:
+            print("❌ В базе уже есть пользователи. Запустите с --reset, чтобы пересоздать таблицы.")
+            return
+    finally:
+        session.close()
+
+    print(f"Заполнение {db.engine.url.render_as_string(hide_password=True)}: " +
+          ', '.join(f"{name} {count:,}" for name, count in counts.items()))
+    started = time.perf_counter()
+    Seeder(db, counts, args.seed).run()
+    print(f"✅ Готово за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
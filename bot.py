@@ -1,47 +1,45 @@
+import asyncio
 import logging
-import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton,
+    InputMediaPhoto, InputMediaVideo, InputMediaDocument
+)
 from telegram.ext import (
     Application, 
+    ChatMemberHandler,
     CommandHandler, 
     MessageHandler, 
     CallbackQueryHandler,
     ConversationHandler,
     filters,
-    ContextTypes
+    ContextTypes,
+    TypeHandler
 )
 from telegram.constants import ParseMode
 
+import activity
 import config
 import database as db
+import delivery
 import admin
+import logconfig
+import metrics
+import notifications
+import operator_inbox
 import payments
+import outbound
+import persistence
+import photos
+import recorder
+import sqlprofile
+import state
+import storage
+import relay
+import tasks
 from admin import is_admin
 
-# Настройка логирования
-import logging.handlers
-
-# Создаем директорию для логов
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-# Настройка логирования в файл и консоль
-log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-file_handler = logging.handlers.RotatingFileHandler(
-    'logs/bot.log',
-    maxBytes=10*1024*1024,  # 10MB
-    backupCount=5,
-    encoding='utf-8'
-)
-file_handler.setFormatter(logging.Formatter(log_format))
-
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter(log_format))
-
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[file_handler, console_handler]
-)
+# Настройка логирования (запись в файл и консоль в отдельном потоке)
+logconfig.setup()
 logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler
@@ -53,14 +51,11 @@ DONATION_AMOUNT = 102  # Состояние для ввода суммы дон
 # Состояния для редактирования профиля
 EDIT_NAME, EDIT_AGE, EDIT_CITY, EDIT_DESCRIPTION, EDIT_PHOTO = range(200, 205)
 
-# Словарь для хранения получателя доната {telegram_id: recipient_user_id}
-pending_donations = {}
-
-# Словарь для хранения активных чатов {telegram_id: chat_user_id}
-user_chats = {}
+# Получатель доната {telegram_id: recipient_user_id}
+pending_donations = state.StateStore('pending_donations', ttl=config.STATE_INPUT_TTL)
 
-# Словарь для хранения информации о текущем собеседнике {telegram_id: partner_user_object}
-active_chat_info = {}
+# Активные чаты {telegram_id: chat_user_id}
+user_chats = state.StateStore('user_chats', ttl=config.STATE_CHAT_TTL)
 
 
 async def check_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -242,9 +237,8 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     photo = update.message.photo[-1]
     
     # Сохраняем фото
-    file = await context.bot.get_file(photo.file_id)
-    file_path = os.path.join(config.PHOTOS_DIR, f"{update.effective_user.id}.jpg")
-    await file.download_to_drive(file_path)
+    stored = await photos.ingest_telegram_photo(context.bot, photo)
+    file_path = stored['path']
     
     # Создаем пользователя в БД
     user = db.create_user(
@@ -377,12 +371,7 @@ async def browse_profiles(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Отправляем фото с описанием
     try:
-        with open(profile.photo_path, 'rb') as photo:
-            await update.message.reply_photo(
-                photo=photo,
-                caption=text,
-                reply_markup=reply_markup
-            )
+        await photos.reply_profile_photo(update.message, profile, text, reply_markup)
     except Exception as e:
         logger.error(f"Ошибка при отправке фото: {e}")
         await update.message.reply_text(text, reply_markup=reply_markup)
@@ -402,30 +391,14 @@ async def like_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Добавляем лайк в БД
         like = db.add_like(user.id, profile_id)
         
-        # Получаем профиль девушки
-        session = db.get_session()
-        try:
-            profile = session.query(db.User).filter_by(id=profile_id).first()
-            
-            # Отправляем уведомление девушке
-            keyboard = [
-                [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f'view_like_{like.id}')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            try:
-                logger.info(f"Отправка уведомления о симпатии: от {user.name} (TG: {user.telegram_id}) к {profile.name} (TG: {profile.telegram_id})")
-                await context.bot.send_message(
-                    chat_id=profile.telegram_id,
-                    text=f"❤️ У вас новая симпатия!\n\nКто-то проявил к вам интерес.",
-                    reply_markup=reply_markup
-                )
-                logger.info(f"Уведомление о симпатии успешно отправлено {profile.name} (TG: {profile.telegram_id})")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления о симпатии к {profile.name} (TG: {profile.telegram_id}): {e}")
-                # Не показываем ошибку отправителю, просто логируем
-        finally:
-            session.close()
+        # Уведомление девушке уйдёт в сводке вместе с другими лайками
+        profile = db.get_user_by_id(profile_id)
+        if profile and profile.is_operator_managed:
+            # Анкету ведут админы - симпатия попадает во входящие операторов
+            operator_inbox.like_received(like.id, user, profile)
+        elif profile:
+            notifications.like_received(profile.telegram_id)
+            logger.info(f"Симпатия от {user.name} (TG: {user.telegram_id}) к {profile.name} (TG: {profile.telegram_id}) добавлена в сводку")
         
         await query.edit_message_caption(
             caption="❤️ Симпатия отправлена!\n\nНажмите '🔍 Смотреть анкеты' для продолжения."
@@ -444,46 +417,44 @@ async def view_like_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     
-    like_id = int(query.data.split('_')[2])
+    # view_like_<id>[_<начало страницы списка>]
+    parts = query.data.split('_')
+    like_id = int(parts[2])
     
-    # Отмечаем лайк как просмотренный
-    db.mark_like_as_viewed(like_id)
+    # Отмечаем лайк как просмотренный и получаем обе анкеты одним запросом
+    user = db.get_user_by_telegram_id(update.effective_user.id)
+    like = db.open_like(like_id, user.id) if user else None
+    if like is None:
+        await query.message.reply_text("❌ Симпатия не найдена.")
+        return
+    from_user, to_user = like.from_user, like.to_user
     
-    # Получаем информацию о лайке
-    session = db.get_session()
+    # Формируем текст анкеты
+    text = (
+        f"👨 {from_user.name}, {from_user.age}\n"
+        f"📍 {to_user.city}\n\n"  # Показываем город девушки
+        f"{from_user.description}"
+    )
+    
+    # Кнопка начать диалог
+    keyboard = [
+        [InlineKeyboardButton("💬 Начать диалог", callback_data=f'start_chat_{like_id}')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    # Отправляем фото с описанием
     try:
-        like = session.query(db.Like).filter_by(id=like_id).first()
-        from_user = session.query(db.User).filter_by(id=like.from_user_id).first()
-        to_user = session.query(db.User).filter_by(id=like.to_user_id).first()
-        
-        # Формируем текст анкеты
-        text = (
-            f"👨 {from_user.name}, {from_user.age}\n"
-            f"📍 {to_user.city}\n\n"  # Показываем город девушки
-            f"{from_user.description}"
-        )
-        
-        # Кнопка начать диалог
-        keyboard = [
-            [InlineKeyboardButton("💬 Начать диалог", callback_data=f'start_chat_{like_id}')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Отправляем фото с описанием
-        try:
-            with open(from_user.photo_path, 'rb') as photo:
-                await query.message.reply_photo(
-                    photo=photo,
-                    caption=text,
-                    reply_markup=reply_markup
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке фото: {e}")
-            await query.message.reply_text(text, reply_markup=reply_markup)
-        
+        await photos.reply_profile_photo(query.message, from_user, text, reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка при отправке фото: {e}")
+        await query.message.reply_text(text, reply_markup=reply_markup)
+    
+    if len(parts) == 4:
+        # Анкета открыта из списка симпатий - обновляем список без неё
+        page_text, page_markup = notifications.likes_page(to_user.id, after_id=int(parts[3]))
+        await query.edit_message_text(page_text, reply_markup=page_markup)
+    else:
         await query.edit_message_reply_markup(reply_markup=None)
-    finally:
-        session.close()
 
 
 async def start_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -503,59 +474,122 @@ async def start_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         from_user = session.query(db.User).filter_by(id=like.from_user_id).first()
         to_user = session.query(db.User).filter_by(id=like.to_user_id).first()
         
-        # Уведомляем мужчину - проверяем подписку
-        try:
-            logger.info(f"Отправка уведомления о начале чата: от девушки {to_user.name} (TG: {to_user.telegram_id}) к мужчине {from_user.name} (TG: {from_user.telegram_id})")
-            
-            # Проверяем подписку мужчины
-            has_subscription = db.has_active_subscription(from_user.id)
-            
-            if has_subscription:
-                # С подпиской - полный доступ
-                await context.bot.send_message(
-                    chat_id=from_user.telegram_id,
-                    text=f"💬 Отличные новости!\n\nДевушка хочет начать с вами диалог.\n"
-                         f"Перейдите в '💬 Мои чаты' чтобы начать общение."
-                )
-            else:
-                # Без подписки - показываем уведомление с предложением купить
-                keyboard = [
-                    [InlineKeyboardButton("💎 Получить Premium доступ", callback_data='buy_subscription')]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await context.bot.send_message(
-                    chat_id=from_user.telegram_id,
-                    text=f"💕 У вас взаимная симпатия!\n\n"
-                         f"Девушка хочет начать с вами диалог, но чтобы "
-                         f"узнать кто это и начать общение, нужен Premium доступ.\n\n"
-                         f"💎 Откройте возможности Premium!",
-                    reply_markup=reply_markup
-                )
-            
-            logger.info(f"Уведомление успешно отправлено мужчине {from_user.name} (TG: {from_user.telegram_id})")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления мужчине {from_user.name} (TG: {from_user.telegram_id}): {e}")
-        
-        # Уведомляем девушку, что чат начат
-        try:
-            logger.info(f"Отправка уведомления девушке {to_user.name} (TG: {to_user.telegram_id}) о начале чата")
-            await context.bot.send_message(
-                chat_id=to_user.telegram_id,
-                text=f"✅ Диалог начат!\n\nВы можете начать общение с {from_user.name}.\n"
-                     f"Перейдите в '💬 Мои чаты' чтобы начать переписку."
-            )
-            logger.info(f"Уведомление успешно отправлено девушке {to_user.name} (TG: {to_user.telegram_id})")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления девушке {to_user.name} (TG: {to_user.telegram_id}): {e}")
-        
+        # Сначала подтверждаем девушке, уведомления уходят в фоне
         await query.edit_message_caption(
             caption=query.message.caption + "\n\n✅ Диалог начат! Перейдите в '💬 Мои чаты'."
         )
+        tasks.spawn(_notify_chat_started_man(from_user, to_user), 'notify_chat_started')
+        tasks.spawn(_notify_chat_started_woman(from_user, to_user), 'notify_chat_started')
     finally:
         session.close()
 
 
+async def _notify_chat_started_man(from_user, to_user):
+    """Уведомить мужчину, что девушка начала диалог (с учётом подписки)"""
+    logger.info(f"Отправка уведомления о начале чата: от девушки {to_user.name} (TG: {to_user.telegram_id}) к мужчине {from_user.name} (TG: {from_user.telegram_id})")
+    
+    # Проверяем подписку мужчины
+    if db.has_active_subscription(from_user.id):
+        # С подпиской - полный доступ
+        await outbound.send_message(
+            chat_id=from_user.telegram_id,
+            text=f"💬 Отличные новости!\n\nДевушка хочет начать с вами диалог.\n"
+                 f"Перейдите в '💬 Мои чаты' чтобы начать общение.",
+            priority=outbound.PRIORITY_NOTIFICATION
+        )
+    else:
+        # Без подписки - показываем уведомление с предложением купить
+        keyboard = [
+            [InlineKeyboardButton("💎 Получить Premium доступ", callback_data='buy_subscription')]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await outbound.send_message(
+            chat_id=from_user.telegram_id,
+            text=f"💕 У вас взаимная симпатия!\n\n"
+                 f"Девушка хочет начать с вами диалог, но чтобы "
+                 f"узнать кто это и начать общение, нужен Premium доступ.\n\n"
+                 f"💎 Откройте возможности Premium!",
+            reply_markup=reply_markup,
+            priority=outbound.PRIORITY_NOTIFICATION
+        )
+    
+    logger.info(f"Уведомление успешно отправлено мужчине {from_user.name} (TG: {from_user.telegram_id})")
+
+
+async def _notify_chat_started_woman(from_user, to_user):
+    """Напомнить девушке, где продолжить переписку"""
+    await outbound.send_message(
+        chat_id=to_user.telegram_id,
+        text=f"✅ Диалог начат!\n\nВы можете начать общение с {from_user.name}.\n"
+             f"Перейдите в '💬 Мои чаты' чтобы начать переписку.",
+        priority=outbound.PRIORITY_NOTIFICATION
+    )
+    logger.info(f"Уведомление успешно отправлено девушке {to_user.name} (TG: {to_user.telegram_id})")
+
+
+async def operator_start_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начать диалог от имени анкеты оператора в ответ на симпатию"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_admin(update.effective_user.id):
+        await query.message.reply_text("У вас нет прав доступа.")
+        return
+    
+    like_id = int(query.data.split('_')[2])
+    
+    session = db.get_session()
+    try:
+        like = session.query(db.Like).filter_by(id=like_id).first()
+        from_user = session.query(db.User).filter_by(id=like.from_user_id).first() if like else None
+        to_user = session.query(db.User).filter_by(id=like.to_user_id).first() if like else None
+    finally:
+        session.close()
+    if not from_user or not to_user:
+        await query.message.reply_text("❌ Симпатия не найдена.")
+        return
+    if not to_user.is_operator_managed:
+        # От имени настоящих пользователей админы не пишут
+        await query.message.reply_text("❌ Эту анкету не ведут админы.")
+        return
+    
+    if not like.chat_started:
+        db.start_chat(like_id)
+        tasks.spawn(_notify_chat_started_man(from_user, to_user), 'notify_chat_started')
+    db.mark_operator_answered(to_user.id, from_user.id, update.effective_user.id)
+    
+    # Сразу включаем режим ответа - админ может написать первое сообщение
+    text, reply_markup = operator_inbox.start_reply(update.effective_user.id, to_user, from_user)
+    await query.message.reply_text(f"✅ Диалог начат!\n\n{text}", reply_markup=reply_markup)
+
+
+async def operator_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сообщение админа в режиме ответа от имени анкеты оператора"""
+    admin_id = update.effective_user.id
+    profile_id, user_id = operator_inbox.replying[admin_id]
+    profile = db.get_user_by_id(profile_id)
+    if profile and not profile.is_operator_managed:
+        profile = None
+    route = relay.engine.route(profile.telegram_id, user_id) if profile else None
+    if route is None:
+        operator_inbox.replying.pop(admin_id, None)
+        await update.message.reply_text("❌ Анкета или пользователь удалены. Режим ответа завершён.")
+        return
+    
+    text = update.message.text
+    relay.engine.forward(
+        profile, route, 'send_message', text,
+        text=f"👩 {profile.name}:\n\n{text}",
+        reply_markup=_relay_reply_markup(profile, route)
+    )
+    db.mark_operator_answered(profile_id, user_id, admin_id)
+    await update.message.reply_text(
+        f"✅ Отправлено от имени {profile.name}",
+        reply_markup=operator_inbox.finish_markup()
+    )
+
+
 async def show_notifications(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать уведомления о симпатиях"""
     user = db.get_user_by_telegram_id(update.effective_user.id)
@@ -564,29 +598,44 @@ async def show_notifications(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Эта функция доступна только для женщин.")
         return
     
-    likes = db.get_unviewed_likes(user.id)
+    text, reply_markup = notifications.likes_page(user.id)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def likes_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перелистнуть список симпатий (или открыть его из сводки)"""
+    query = update.callback_query
+    await query.answer()
     
-    if not likes:
-        await update.message.reply_text(
-            "У вас пока нет новых симпатий 😊"
-        )
+    user = db.get_user_by_telegram_id(update.effective_user.id)
+    if not user:
         return
     
-    await update.message.reply_text(
-        f"❤️ У вас {len(likes)} новых симпатий!\n"
-        f"Нажмите на кнопку ниже чтобы посмотреть анкеты:"
-    )
+    # likes_page_<next|prev>_<id>
+    _, _, direction, cursor = query.data.split('_')
+    if direction == 'next':
+        text, reply_markup = notifications.likes_page(user.id, after_id=int(cursor))
+    else:
+        text, reply_markup = notifications.likes_page(user.id, before_id=int(cursor))
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+async def likes_seen_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отметить просмотренными все симпатии на странице списка"""
+    query = update.callback_query
     
-    for like in likes:
-        keyboard = [
-            [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f'view_like_{like.id}')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            "Новая симпатия ждет вас!",
-            reply_markup=reply_markup
-        )
+    user = db.get_user_by_telegram_id(update.effective_user.id)
+    if not user:
+        await query.answer()
+        return
+    
+    # likes_seen_<первый id>_<последний id>
+    _, _, from_id, to_id = query.data.split('_')
+    marked = db.mark_likes_viewed(user.id, int(from_id), int(to_id))
+    await query.answer(f"Отмечено: {marked}")
+    
+    text, reply_markup = notifications.likes_page(user.id)
+    await query.edit_message_text(text, reply_markup=reply_markup)
 
 
 async def show_chats(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -712,24 +761,13 @@ async def open_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     # Сохраняем активный чат пользователя
     user_chats[update.effective_user.id] = chat_user_id
-    active_chat_info[update.effective_user.id] = chat_partner
+    relay.engine.connect(update.effective_user.id, chat_partner)
     
     logger.info(f"Чат открыт: пользователь {user.name} (ID: {user.id}, пол: {user.gender}, TG: {user.telegram_id}) открыл чат с {chat_partner.name} (ID: {chat_partner.id}, пол: {chat_partner.gender}, TG: {chat_partner.telegram_id})")
     
     # Отмечаем сообщения как прочитанные
     db.mark_messages_as_read(user.id, chat_user_id)
     
-    # Уведомляем собеседника, что пользователь подключился к чату
-    try:
-        gender_emoji = "👨" if user.gender == 'male' else "👩"
-        await context.bot.send_message(
-            chat_id=chat_partner.telegram_id,
-            text=f"💬 {gender_emoji} {user.name} подключился(ась) к чату.\n\nТеперь вы можете общаться!"
-        )
-        logger.info(f"Уведомление о подключении к чату отправлено {chat_partner.name} (TG: {chat_partner.telegram_id})")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления о подключении к чату {chat_partner.name} (TG: {chat_partner.telegram_id}): {e}")
-    
     gender_emoji = "👨" if chat_partner.gender == 'male' else "👩"
     
     # Кнопки управления чатом
@@ -755,15 +793,26 @@ async def open_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     # Отправляем аватарку собеседника с информацией
     try:
-        with open(chat_partner.photo_path, 'rb') as photo:
-            await query.message.reply_photo(
-                photo=photo,
-                caption=text,
-                reply_markup=reply_markup
-            )
+        await photos.reply_profile_photo(query.message, chat_partner, text, reply_markup)
     except Exception as e:
         logger.error(f"Ошибка при отправке фото: {e}")
         await query.message.reply_text(text, reply_markup=reply_markup)
+    
+    # Уведомляем собеседника, что пользователь подключился к чату
+    user_emoji = "👨" if user.gender == 'male' else "👩"
+    tasks.spawn(_notify_partner(
+        chat_partner, f"💬 {user_emoji} {user.name} подключился(ась) к чату.\n\nТеперь вы можете общаться!"
+    ), 'notify_chat_joined')
+
+
+async def _notify_partner(chat_partner, text: str):
+    """Служебное уведомление собеседнику (подключился к чату, вышел из чата)"""
+    await outbound.send_message(
+        chat_id=chat_partner.telegram_id,
+        text=text,
+        priority=outbound.PRIORITY_NOTIFICATION
+    )
+    logger.info(f"Уведомление отправлено {chat_partner.name} (TG: {chat_partner.telegram_id}): {text.splitlines()[0]}")
 
 
 async def exit_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -779,26 +828,17 @@ async def exit_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         chat_user_id = user_chats[update.effective_user.id]
         chat_partner = db.get_user_by_id(chat_user_id)
         del user_chats[update.effective_user.id]
-    
-    if update.effective_user.id in active_chat_info:
-        del active_chat_info[update.effective_user.id]
-    
-    # Уведомляем собеседника, что пользователь покинул чат
-    if chat_partner and user:
-        try:
-            gender_emoji = "👨" if user.gender == 'male' else "👩"
-            await context.bot.send_message(
-                chat_id=chat_partner.telegram_id,
-                text=f"🚪 {gender_emoji} {user.name} покинул(а) чат."
-            )
-            logger.info(f"Уведомление о выходе из чата отправлено {chat_partner.name} (TG: {chat_partner.telegram_id})")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления о выходе из чата {chat_partner.name} (TG: {chat_partner.telegram_id}): {e}")
+    relay.engine.disconnect(update.effective_user.id)
     
     await query.message.reply_text(
         "🚪 Вы вышли из чата.\n\n"
         "Нажмите '💬 Мои чаты' чтобы выбрать другой чат."
     )
+    
+    # Уведомляем собеседника, что пользователь покинул чат
+    if chat_partner and user:
+        gender_emoji = "👨" if user.gender == 'male' else "👩"
+        tasks.spawn(_notify_partner(chat_partner, f"🚪 {gender_emoji} {user.name} покинул(а) чат."), 'notify_chat_left')
 
 
 async def show_all_chats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -885,12 +925,7 @@ async def view_partner_callback(update: Update, context: ContextTypes.DEFAULT_TY
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     try:
-        with open(partner.photo_path, 'rb') as photo:
-            await query.message.reply_photo(
-                photo=photo,
-                caption=text,
-                reply_markup=reply_markup
-            )
+        await photos.reply_profile_photo(query.message, partner, text, reply_markup)
     except Exception as e:
         logger.error(f"Ошибка при отправке фото: {e}")
         await query.message.reply_text(text, reply_markup=reply_markup)
@@ -908,12 +943,85 @@ def get_chat_partner_telegram_id(chat_user_id: int):
         session.close()
 
 
+async def _chat_route(update: Update, chat_user_id: int):
+    """Маршрут к собеседнику открытого чата; если собеседника нет - выйти из чата"""
+    route = relay.engine.route(update.effective_user.id, chat_user_id)
+    if route is None:
+        logger.error(f"Собеседник с ID {chat_user_id} не найден в БД")
+        await update.message.reply_text(
+            "❌ Ошибка: собеседник не найден. Выйдите из чата и откройте его заново."
+        )
+        user_chats.pop(update.effective_user.id, None)
+        relay.engine.disconnect(update.effective_user.id)
+    return route
+
+
+def _relay_reply_markup(user, route):
+    """Кнопка перехода в чат, если получатель сейчас не в чате с отправителем"""
+    if user_chats.get(route.partner_telegram_id) == user.id:
+        return None
+    keyboard = [[InlineKeyboardButton("💬 Перейти в чат", callback_data=f'open_chat_{user.id}')]]
+    return InlineKeyboardMarkup(keyboard)
+
+
+def _relay_media(update: Update, user, route, media, emoji: str, record: str):
+    """
+    Переслать фото, видео или файл собеседнику
+    
+    Одиночное вложение копируется (copy_message) с подписью отправителя,
+    элемент альбома собирается в relay и уходит вместе с остальными.
+    """
+    message = update.message
+    caption = message.caption or ""
+    gender_emoji = "👨" if user.gender == 'male' else "👩"
+    reply_markup = _relay_reply_markup(user, route)
+    
+    if message.media_group_id:
+        relay.engine.forward_album_item(
+            user, route, message.media_group_id, media, caption,
+            header=f"🖼 {gender_emoji} {user.name}",
+            reply_markup=reply_markup
+        )
+        return
+    
+    media_caption = f"{emoji} {gender_emoji} {user.name}"
+    if caption:
+        media_caption += f":\n\n{caption}"
+    relay.engine.forward(
+        user, route, 'copy_message', record,
+        from_chat_id=message.chat_id,
+        message_id=message.message_id,
+        caption=media_caption,
+        reply_markup=reply_markup
+    )
+
+
+# Кнопки главного меню - такой текст обрабатывается как команда, а не отправляется в чат
+MENU_BUTTONS = [
+    "🔍 Смотреть анкеты",
+    "🔍 Поиск по коду",
+    "💬 Мои чаты",
+    "❤️ Уведомления о симпатиях",
+    "👤 Моя анкета",
+    "💎 Подписка",
+    "🔧 Админ панель"
+]
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
     text = update.message.text
+    
+    # Админ отвечает от имени анкеты оператора (сам админ может быть не зарегистрирован)
+    if update.effective_user.id in operator_inbox.replying:
+        if text not in MENU_BUTTONS:
+            await operator_reply(update, context)
+            return
+        operator_inbox.replying.pop(update.effective_user.id, None)
+    
     user = db.get_user_by_telegram_id(update.effective_user.id)
     
-    logger.info(f"Получено сообщение от пользователя: {update.effective_user.id}, текст: {text[:50]}")
+    logger.debug("Получено сообщение от пользователя: %s, текст: %.50s", update.effective_user.id, text)
     
     # Проверяем, зарегистрирован ли пользователь
     if not user:
@@ -923,22 +1031,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    logger.info(f"Пользователь найден: {user.name} (ID: {user.id}, пол: {user.gender}, TG: {user.telegram_id})")
-    
-    # Список кнопок меню - если текст является кнопкой меню, обрабатываем как команду, а не отправляем в чат
-    menu_buttons = [
-        "🔍 Смотреть анкеты",
-        "🔍 Поиск по коду",
-        "💬 Мои чаты",
-        "❤️ Уведомления о симпатиях",
-        "👤 Моя анкета",
-        "💎 Подписка",
-        "🔧 Админ панель"
-    ]
+    logger.debug("Пользователь найден: %s (ID: %s, пол: %s, TG: %s)", user.name, user.id, user.gender, user.telegram_id)
     
     # Если это кнопка меню - обрабатываем как команду меню, не отправляем в чат
-    if text in menu_buttons:
-        logger.info(f"Пользователь {user.name} нажал кнопку меню: {text}")
+    if text in MENU_BUTTONS:
+        logger.info("Пользователь %s нажал кнопку меню: %s", user.name, text)
         # Выходим из режима поиска по хэштэгу при нажатии любой кнопки меню
         hashtag_search_mode.pop(update.effective_user.id, None)
         
@@ -971,73 +1068,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Проверяем, находится ли пользователь в режиме чата
     if update.effective_user.id in user_chats:
-        chat_user_id = user_chats[update.effective_user.id]
-        
-        # Оптимизация: используем кэш для получения информации о партнере
-        # Проверяем active_chat_info для быстрого доступа
-        partner = active_chat_info.get(update.effective_user.id)
-        
-        # Если партнер не в кэше, получаем из БД
-        if not partner or partner.id != chat_user_id:
-            partner = db.get_user_by_id(chat_user_id)
-            if not partner:
-                logger.error(f"Собеседник с ID {chat_user_id} не найден в БД")
-                await update.message.reply_text(
-                    "❌ Ошибка: собеседник не найден. Выйдите из чата и откройте его заново."
-                )
-                del user_chats[update.effective_user.id]
-                active_chat_info.pop(update.effective_user.id, None)
-                return
-            # Сохраняем в кэш
-            active_chat_info[update.effective_user.id] = partner
-        
-        partner_telegram_id = partner.telegram_id
-        
-        # Сохраняем сообщение в БД (асинхронно, не блокируем отправку)
-        db.add_message(user.id, chat_user_id, text)
+        route = await _chat_route(update, user_chats[update.effective_user.id])
+        if route is None:
+            return
         
         # Формируем красивое сообщение для получателя
         gender_emoji = "👨" if user.gender == 'male' else "👩"
         message_text = f"{gender_emoji} {user.name}:\n\n{text}"
         
-        # Проверяем, находится ли получатель в чате с отправителем
-        # Если нет - добавляем кнопку для перехода в чат
-        receiver_in_chat = partner_telegram_id in user_chats and user_chats[partner_telegram_id] == user.id
-        reply_markup = None
-        
-        if not receiver_in_chat:
-            # Получатель не в чате с отправителем - добавляем кнопку
-            keyboard = [
-                [InlineKeyboardButton("💬 Перейти в чат", callback_data=f'open_chat_{user.id}')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Отправляем сообщение собеседнику
-        try:
-            await context.bot.send_message(
-                chat_id=partner_telegram_id,
-                text=message_text,
-                reply_markup=reply_markup
-            )
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f"Ошибка при отправке сообщения от {user.telegram_id} к {partner_telegram_id}: {error_msg}")
-            
-            # Показываем понятное сообщение об ошибке
-            if "chat not found" in error_msg.lower() or "user not found" in error_msg.lower() or "bot was blocked" in error_msg.lower():
-                await update.message.reply_text(
-                    f"❌ Не удалось отправить сообщение.\n"
-                    f"Пользователь не найден или заблокировал бота.\n\n"
-                    f"Попробуйте выйти из чата и открыть его заново."
-                )
-            else:
-                await update.message.reply_text(
-                    f"❌ Не удалось отправить сообщение.\n"
-                    f"Попробуйте выйти из чата и открыть его заново."
-                )
+        # Пересылка и запись в историю идут в relay, обработчик их не ждёт
+        relay.engine.forward(
+            user, route, 'send_message', text,
+            text=message_text,
+            reply_markup=_relay_reply_markup(user, route)
+        )
         return
     else:
-        logger.info(f"Пользователь {user.name} НЕ находится в режиме чата. user_chats keys: {list(user_chats.keys())}")
+        logger.info("Пользователь %s НЕ находится в режиме чата", user.name)
         # Если пользователь не в чате и это не кнопка меню - просто игнорируем или показываем подсказку
         await update.message.reply_text(
             "💡 Вы не находитесь в чате.\n\n"
@@ -1072,8 +1119,7 @@ async def show_my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     try:
-        with open(user.photo_path, 'rb') as photo:
-            await update.message.reply_photo(photo=photo, caption=text, reply_markup=reply_markup)
+        await photos.reply_profile_photo(update.message, user, text, reply_markup)
     except:
         await update.message.reply_text(text, reply_markup=reply_markup)
 
@@ -1088,25 +1134,17 @@ async def exit_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_user_id = user_chats[update.effective_user.id]
         chat_partner = db.get_user_by_id(chat_user_id)
         del user_chats[update.effective_user.id]
-        if update.effective_user.id in active_chat_info:
-            del active_chat_info[update.effective_user.id]
-        
-        # Уведомляем собеседника, что пользователь покинул чат
-        if chat_partner and user:
-            try:
-                gender_emoji = "👨" if user.gender == 'male' else "👩"
-                await context.bot.send_message(
-                    chat_id=chat_partner.telegram_id,
-                    text=f"🚪 {gender_emoji} {user.name} покинул(а) чат."
-                )
-                logger.info(f"Уведомление о выходе из чата отправлено {chat_partner.name} (TG: {chat_partner.telegram_id})")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления о выходе из чата {chat_partner.name} (TG: {chat_partner.telegram_id}): {e}")
+        relay.engine.disconnect(update.effective_user.id)
         
         await update.message.reply_text(
             "🚪 Вы вышли из чата.\n\n"
             "Нажмите '💬 Мои чаты' чтобы выбрать другой чат."
         )
+        
+        # Уведомляем собеседника, что пользователь покинул чат
+        if chat_partner and user:
+            gender_emoji = "👨" if user.gender == 'male' else "👩"
+            tasks.spawn(_notify_partner(chat_partner, f"🚪 {gender_emoji} {user.name} покинул(а) чат."), 'notify_chat_left')
     else:
         await update.message.reply_text("❓ Вы не находитесь в чате.")
 
@@ -1126,66 +1164,17 @@ async def handle_photo_in_chat(update: Update, context: ContextTypes.DEFAULT_TYP
     if update.effective_user.id not in user_chats:
         return  # Не в режиме чата, игнорируем
     
-    chat_user_id = user_chats[update.effective_user.id]
-    photo = update.message.photo[-1]  # Берем фото наибольшего размера
-    caption = update.message.caption or ""
-    
-    # Получаем информацию о собеседнике
-    partner = db.get_user_by_id(chat_user_id)
-    if not partner:
-        await update.message.reply_text(
-            "❌ Ошибка: собеседник не найден. Выйдите из чата и откройте его заново."
-        )
-        del user_chats[update.effective_user.id]
+    route = await _chat_route(update, user_chats[update.effective_user.id])
+    if route is None:
         return
     
-    # Сохраняем сообщение в БД
-    if caption:
-        db.add_message(user.id, chat_user_id, f"[Фото] {caption}")
-    else:
-        db.add_message(user.id, chat_user_id, "[Фото]")
-    
-    # Проверяем, находится ли получатель в чате с отправителем
-    receiver_in_chat = partner.telegram_id in user_chats and user_chats[partner.telegram_id] == user.id
-    reply_markup = None
+    photo = update.message.photo[-1]  # Берем фото наибольшего размера
+    caption = update.message.caption or ""
     
-    if not receiver_in_chat:
-        keyboard = [[InlineKeyboardButton("💬 Перейти в чат", callback_data=f'open_chat_{user.id}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    # Подпись для истории чата в БД
+    record = f"[Фото] {caption}" if caption else "[Фото]"
     
-    # Отправляем фото собеседнику
-    try:
-        gender_emoji = "👨" if user.gender == 'male' else "👩"
-        photo_caption = f"📷 {gender_emoji} {user.name}"
-        if caption:
-            photo_caption += f":\n\n{caption}"
-        
-        logger.info(f"Отправка фото: от {user.name} (TG: {user.telegram_id}) к {partner.name} (TG: {partner.telegram_id})")
-        await context.bot.send_photo(
-            chat_id=partner.telegram_id,
-            photo=photo.file_id,
-            caption=photo_caption,
-            reply_markup=reply_markup
-        )
-        logger.info(f"Фото успешно отправлено от {user.name} к {partner.name}")
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Ошибка при отправке фото от {user.name} (TG: {user.telegram_id}) к {partner.name} (TG: {partner.telegram_id}): {e}")
-        if "chat not found" in error_msg.lower() or "user not found" in error_msg.lower():
-            await update.message.reply_text(
-                f"❌ Не удалось отправить фото.\n"
-                f"Пользователь не найден или заблокировал бота."
-            )
-        else:
-            await update.message.reply_text(
-                f"❌ Не удалось отправить фото.\n"
-                f"Ошибка: {error_msg}"
-            )
-    except Exception as e:
-        logger.error(f"Ошибка при отправке фото: {e}")
-        await update.message.reply_text(
-            f"❌ Не удалось отправить фото. Ошибка: {str(e)}"
-        )
+    _relay_media(update, user, route, InputMediaPhoto(photo.file_id), "📷", record)
 
 
 async def handle_video_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1203,66 +1192,17 @@ async def handle_video_in_chat(update: Update, context: ContextTypes.DEFAULT_TYP
     if update.effective_user.id not in user_chats:
         return  # Не в режиме чата, игнорируем
     
-    chat_user_id = user_chats[update.effective_user.id]
-    video = update.message.video
-    caption = update.message.caption or ""
-    
-    # Получаем информацию о собеседнике
-    partner = db.get_user_by_id(chat_user_id)
-    if not partner:
-        await update.message.reply_text(
-            "❌ Ошибка: собеседник не найден. Выйдите из чата и откройте его заново."
-        )
-        del user_chats[update.effective_user.id]
+    route = await _chat_route(update, user_chats[update.effective_user.id])
+    if route is None:
         return
     
-    # Сохраняем сообщение в БД
-    if caption:
-        db.add_message(user.id, chat_user_id, f"[Видео] {caption}")
-    else:
-        db.add_message(user.id, chat_user_id, "[Видео]")
-    
-    # Проверяем, находится ли получатель в чате с отправителем
-    receiver_in_chat = partner.telegram_id in user_chats and user_chats[partner.telegram_id] == user.id
-    reply_markup = None
+    video = update.message.video
+    caption = update.message.caption or ""
     
-    if not receiver_in_chat:
-        keyboard = [[InlineKeyboardButton("💬 Перейти в чат", callback_data=f'open_chat_{user.id}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    # Подпись для истории чата в БД
+    record = f"[Видео] {caption}" if caption else "[Видео]"
     
-    # Отправляем видео собеседнику
-    try:
-        gender_emoji = "👨" if user.gender == 'male' else "👩"
-        video_caption = f"🎥 {gender_emoji} {user.name}"
-        if caption:
-            video_caption += f":\n\n{caption}"
-        
-        logger.info(f"Отправка видео: от {user.name} (TG: {user.telegram_id}) к {partner.name} (TG: {partner.telegram_id})")
-        await context.bot.send_video(
-            chat_id=partner.telegram_id,
-            video=video.file_id,
-            caption=video_caption,
-            reply_markup=reply_markup
-        )
-        logger.info(f"Видео успешно отправлено от {user.name} к {partner.name}")
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Ошибка при отправке видео от {user.name} (TG: {user.telegram_id}) к {partner.name} (TG: {partner.telegram_id}): {e}")
-        if "chat not found" in error_msg.lower() or "user not found" in error_msg.lower():
-            await update.message.reply_text(
-                f"❌ Не удалось отправить видео.\n"
-                f"Пользователь не найден или заблокировал бота."
-            )
-        else:
-            await update.message.reply_text(
-                f"❌ Не удалось отправить видео.\n"
-                f"Ошибка: {error_msg}"
-            )
-    except Exception as e:
-        logger.error(f"Ошибка при отправке видео: {e}")
-        await update.message.reply_text(
-            f"❌ Не удалось отправить видео. Ошибка: {str(e)}"
-        )
+    _relay_media(update, user, route, InputMediaVideo(video.file_id), "🎥", record)
 
 
 async def handle_document_in_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1280,67 +1220,18 @@ async def handle_document_in_chat(update: Update, context: ContextTypes.DEFAULT_
     if update.effective_user.id not in user_chats:
         return  # Не в режиме чата, игнорируем
     
-    chat_user_id = user_chats[update.effective_user.id]
+    route = await _chat_route(update, user_chats[update.effective_user.id])
+    if route is None:
+        return
+    
     document = update.message.document
     caption = update.message.caption or ""
     
-    # Получаем информацию о собеседнике
-    partner = db.get_user_by_id(chat_user_id)
-    if not partner:
-        await update.message.reply_text(
-            "❌ Ошибка: собеседник не найден. Выйдите из чата и откройте его заново."
-        )
-        del user_chats[update.effective_user.id]
-        return
-    
-    # Сохраняем сообщение в БД
+    # Подпись для истории чата в БД
     file_name = document.file_name or "файл"
-    if caption:
-        db.add_message(user.id, chat_user_id, f"[Файл: {file_name}] {caption}")
-    else:
-        db.add_message(user.id, chat_user_id, f"[Файл: {file_name}]")
+    record = f"[Файл: {file_name}] {caption}" if caption else f"[Файл: {file_name}]"
     
-    # Проверяем, находится ли получатель в чате с отправителем
-    receiver_in_chat = partner.telegram_id in user_chats and user_chats[partner.telegram_id] == user.id
-    reply_markup = None
-    
-    if not receiver_in_chat:
-        keyboard = [[InlineKeyboardButton("💬 Перейти в чат", callback_data=f'open_chat_{user.id}')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # Отправляем файл собеседнику
-    try:
-        gender_emoji = "👨" if user.gender == 'male' else "👩"
-        doc_caption = f"📎 {gender_emoji} {user.name}"
-        if caption:
-            doc_caption += f":\n\n{caption}"
-        
-        logger.info(f"Отправка файла: от {user.name} (TG: {user.telegram_id}) к {partner.name} (TG: {partner.telegram_id})")
-        await context.bot.send_document(
-            chat_id=partner.telegram_id,
-            document=document.file_id,
-            caption=doc_caption,
-            reply_markup=reply_markup
-        )
-        logger.info(f"Файл успешно отправлен от {user.name} к {partner.name}")
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Ошибка при отправке файла от {user.name} (TG: {user.telegram_id}) к {partner.name} (TG: {partner.telegram_id}): {e}")
-        if "chat not found" in error_msg.lower() or "user not found" in error_msg.lower():
-            await update.message.reply_text(
-                f"❌ Не удалось отправить файл.\n"
-                f"Пользователь не найден или заблокировал бота."
-            )
-        else:
-            await update.message.reply_text(
-                f"❌ Не удалось отправить файл.\n"
-                f"Ошибка: {error_msg}"
-            )
-    except Exception as e:
-        logger.error(f"Ошибка при отправке файла: {e}")
-        await update.message.reply_text(
-            f"❌ Не удалось отправить файл. Ошибка: {str(e)}"
-        )
+    _relay_media(update, user, route, InputMediaDocument(document.file_id), "📎", record)
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1351,8 +1242,8 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ========== Поиск по хэштэгу ==========
 
-# Словарь для хранения состояния поиска по хэштэгу
-hashtag_search_mode = {}
+# Пользователи в режиме поиска по хэштэгу {telegram_id: True}
+hashtag_search_mode = state.StateStore('hashtag_search_mode', ttl=config.STATE_INPUT_TTL)
 
 
 async def start_hashtag_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1448,12 +1339,7 @@ async def process_hashtag_search(update: Update, context: ContextTypes.DEFAULT_T
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     try:
-        with open(profile.photo_path, 'rb') as photo:
-            await update.message.reply_photo(
-                photo=photo,
-                caption=text,
-                reply_markup=reply_markup
-            )
+        await photos.reply_profile_photo(update.message, profile, text, reply_markup)
     except Exception as e:
         logger.error(f"Ошибка при отправке фото: {e}")
         await update.message.reply_text(text, reply_markup=reply_markup)
@@ -1691,13 +1577,14 @@ async def edit_photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = db.get_user_by_telegram_id(update.effective_user.id)
     
     # Сохраняем новое фото
-    file = await context.bot.get_file(photo.file_id)
-    file_path = os.path.join(config.PHOTOS_DIR, f"{update.effective_user.id}.jpg")
-    await file.download_to_drive(file_path)
+    stored = await photos.ingest_telegram_photo(context.bot, photo)
+    file_path = stored['path']
     
-    # Обновляем профиль
+    # Обновляем профиль и освобождаем прежнее фото
+    old_photo_path = user.photo_path
     db.update_user_profile(user.id, photo_path=file_path)
     db.invalidate_user_cache(update.effective_user.id)
+    photos.release_photo(old_photo_path)
     
     await update.message.reply_text(
         "✅ Фото обновлено!\n\n"
@@ -2069,25 +1956,14 @@ async def check_donation_callback(update: Update, context: ContextTypes.DEFAULT_
     if success:
         recipient = db.get_user_by_id(recipient_id)
         
-        # Уведомляем получателя
-        if recipient:
-            try:
-                payment_info = payments.check_payment_status(payment_id)
-                amount = int(payment_info.get('amount', 0))
-                
-                await context.bot.send_message(
-                    chat_id=recipient.telegram_id,
-                    text=f"💝 Вам пришёл подарок!\n\n"
-                         f"💰 Сумма: {amount}₽\n\n"
-                         f"Деньги поступят на ваш счёт."
-                )
-            except Exception as e:
-                logger.error(f"Ошибка уведомления о донате: {e}")
-        
         await query.message.reply_text(
             f"✅ Спасибо за подарок!\n\n"
             f"💝 {recipient.name if recipient else 'Получатель'} получит уведомление."
         )
+        
+        # Уведомляем получателя
+        if recipient:
+            tasks.spawn(_notify_donation(recipient, payment_id), 'notify_donation')
     else:
         payment_info = payments.check_payment_status(payment_id)
         
@@ -2103,28 +1979,169 @@ async def check_donation_callback(update: Update, context: ContextTypes.DEFAULT_
             )
 
 
-def main():
-    """Запуск бота"""
-    # Проверка токена
-    if not config.BOT_TOKEN:
-        logger.error("BOT_TOKEN не указан в .env файле!")
-        return
+async def _notify_donation(recipient, payment_id: str):
+    """Уведомить получателя о донате"""
+    # Запрос к ЮKassa синхронный - выполняем в потоке, чтобы не останавливать остальные обработчики
+    payment_info = await asyncio.to_thread(payments.check_payment_status, payment_id)
+    amount = int(payment_info.get('amount', 0))
     
-    # Инициализация БД
-    try:
-        db.init_db()
-        logger.info("База данных инициализирована")
-    except Exception as e:
-        logger.error(f"Ошибка инициализации БД: {e}")
+    await outbound.send_message(
+        chat_id=recipient.telegram_id,
+        text=f"💝 Вам пришёл подарок!\n\n"
+             f"💰 Сумма: {amount}₽\n\n"
+             f"Деньги поступят на ваш счёт.",
+        priority=outbound.PRIORITY_NOTIFICATION
+    )
+
+
+async def on_startup(application: Application):
+    """Действия после инициализации приложения"""
+    await outbound.dispatcher.start(application.bot)
+    metrics.outbound_pending.set_function(lambda: outbound.dispatcher.pending)
+    metrics.background_pending.set_function(lambda: tasks.supervisor.pending)
+    relay.engine.start()
+    delivery.install()
+    operator_inbox.install()
+    metrics.relay_pending.set_function(lambda: relay.engine.pending)
+    metrics.relay_unsaved.set_function(lambda: relay.engine.unsaved)
+    await metrics.start_server()
+    
+    if not application.job_queue:
+        logger.warning("JobQueue недоступна: периодические задачи отключены (pip install 'python-telegram-bot[job-queue]')")
         return
     
-    # Создание приложения
-    try:
-        application = Application.builder().token(config.BOT_TOKEN).build()
-        logger.info("Приложение создано")
-    except Exception as e:
-        logger.error(f"Ошибка создания приложения: {e}")
-        return
+    # Общие для всех процессов задачи в кластере выполняет только первый воркер
+    if config.CLUSTER_WORKER_INDEX == 0:
+        # Периодическая сборка мусора в хранилище фото
+        application.job_queue.run_repeating(
+            photos.collect_garbage_job,
+            interval=config.PHOTO_GC_INTERVAL,
+            first=60,
+            name='photo_gc'
+        )
+        
+        # Очистка заброшенных состояний пользователей
+        application.job_queue.run_repeating(
+            state.purge_expired_job,
+            interval=config.STATE_PURGE_INTERVAL,
+            first=config.STATE_PURGE_INTERVAL,
+            name='state_purge'
+        )
+        
+        # Сводки о новых симпатиях
+        application.job_queue.run_repeating(
+            notifications.likes_digest_job,
+            interval=config.LIKES_DIGEST_CHECK_INTERVAL,
+            first=config.LIKES_DIGEST_CHECK_INTERVAL,
+            name='likes_digest'
+        )
+        
+        # Входящие анкет, которые ведут админы
+        application.job_queue.run_repeating(
+            operator_inbox.operator_inbox_job,
+            interval=config.OPERATOR_INBOX_INTERVAL,
+            first=config.OPERATOR_INBOX_INTERVAL,
+            name='operator_inbox'
+        )
+        
+        # Перевод давно не заходивших пользователей в спящие
+        application.job_queue.run_repeating(
+            activity.dormant_job,
+            interval=config.DORMANT_CHECK_INTERVAL,
+            first=60,
+            name='dormant_users'
+        )
+    
+    # Запись изменённых состояний пользователей этого воркера
+    application.job_queue.run_repeating(
+        state.flush_job,
+        interval=config.STATE_FLUSH_INTERVAL,
+        first=config.STATE_FLUSH_INTERVAL,
+        name='state_flush'
+    )
+    
+    # Запись активности пользователей этого воркера
+    application.job_queue.run_repeating(
+        activity.flush_job,
+        interval=config.ACTIVITY_FLUSH_INTERVAL,
+        first=config.ACTIVITY_FLUSH_INTERVAL,
+        name='activity_flush'
+    )
+    
+    # Дописывание записанных обновлений в файл
+    if recorder.writer is not None:
+        application.job_queue.run_repeating(
+            recorder.flush_job,
+            interval=config.RECORD_FLUSH_INTERVAL,
+            first=config.RECORD_FLUSH_INTERVAL,
+            name='record_flush'
+        )
+    
+    # Анкеты операторов, добавленные в других воркерах
+    application.job_queue.run_repeating(
+        operator_inbox.refresh_profiles_job,
+        interval=config.OPERATOR_REFRESH_INTERVAL,
+        first=config.OPERATOR_REFRESH_INTERVAL,
+        name='operator_refresh'
+    )
+    
+    # Очистка брошенных диалогов и user_data неактивных пользователей
+    application.job_queue.run_repeating(
+        application.persistence.expire_job,
+        interval=config.STATE_PURGE_INTERVAL,
+        first=config.STATE_PURGE_INTERVAL,
+        name='persistence_expire'
+    )
+
+
+async def on_stop(application: Application):
+    """Досылка очередей после остановки приёма обновлений (бот ещё может отправлять)"""
+    # Очереди пересылки отправляют через диспетчер, а потом дописывают историю в БД
+    await relay.engine.stop(config.RELAY_DRAIN_TIMEOUT)
+    # Фоновые задачи отправляют через диспетчер - дожидаемся их до его остановки
+    await tasks.supervisor.drain(config.BACKGROUND_DRAIN_TIMEOUT)
+    await outbound.dispatcher.stop()
+    # Последняя запись активности (БД закрывается позже), записанных обновлений и состояний
+    await activity.flush()
+    await recorder.flush()
+    await state.flush()
+
+
+async def on_shutdown(application: Application):
+    """Действия при остановке приложения"""
+    await metrics.stop_server()
+    photos.shutdown()
+    await storage.backend.close()
+    state.close()
+
+
+def build_application(base_url: str = None, base_file_url: str = None) -> Application:
+    """
+    Создать приложение со всеми обработчиками
+
+    Args:
+        base_url: адрес Bot API вместо https://api.telegram.org/bot (например, локальный
+            сервер или тестовый стенд loadtest)
+        base_file_url: адрес скачивания файлов вместо https://api.telegram.org/file/bot
+    """
+    metrics.instrument_database(db)
+    sqlprofile.install(db.engine)
+    
+    # Один пул HTTP-соединений на все запросы к Bot API (с запасом под воркеры диспетчера)
+    builder = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .request(metrics.InstrumentedRequest(connection_pool_size=config.TELEGRAM_POOL_SIZE, pool_timeout=10))
+        .persistence(persistence.create_persistence())
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if base_url:
+        builder.base_url(base_url)
+    if base_file_url:
+        builder.base_file_url(base_file_url)
+    application = builder.build()
     
     # Обработчик регистрации
     conv_handler = ConversationHandler(
@@ -2141,8 +2158,21 @@ def main():
             CommandHandler('start', start),  # Позволяет сбросить регистрацию командой /start
             CommandHandler('cancel', cancel)
         ],
+        name='registration',
+        persistent=True,
+        conversation_timeout=config.CONVERSATION_TIMEOUT,
     )
     
+    # Запись обновлений для воспроизведения нагрузки (если задан RECORD_UPDATES_DIR)
+    recorder.install(application, kept_texts=MENU_BUTTONS)
+    
+    # Активность пользователей: только отметка в памяти, в БД пишется пачками
+    application.add_handler(TypeHandler(Update, activity.track_update), group=-2)
+    
+    # Недоступные пользователи: снимаем отметку при любом обновлении, следим за блокировкой бота
+    application.add_handler(TypeHandler(Update, delivery.track_update), group=-1)
+    application.add_handler(ChatMemberHandler(delivery.my_chat_member_handler, ChatMemberHandler.MY_CHAT_MEMBER))
+    
     application.add_handler(conv_handler)
     
     # Настройка админ обработчиков
@@ -2151,7 +2181,10 @@ def main():
     # Обработчики callback
     application.add_handler(CallbackQueryHandler(like_callback, pattern='^(like|dislike)_'))
     application.add_handler(CallbackQueryHandler(view_like_callback, pattern='^view_like_'))
+    application.add_handler(CallbackQueryHandler(likes_page_callback, pattern=r'^likes_page_(next|prev)_\d+$'))
+    application.add_handler(CallbackQueryHandler(likes_seen_callback, pattern=r'^likes_seen_\d+_\d+$'))
     application.add_handler(CallbackQueryHandler(start_chat_callback, pattern='^start_chat_'))
+    application.add_handler(CallbackQueryHandler(operator_start_chat_callback, pattern=r'^op_start_\d+$'))
     application.add_handler(CallbackQueryHandler(open_chat_callback, pattern='^open_chat_'))
     application.add_handler(CallbackQueryHandler(exit_chat_callback, pattern='^exit_current_chat$'))
     application.add_handler(CallbackQueryHandler(show_all_chats_callback, pattern='^show_all_chats$'))
@@ -2179,6 +2212,9 @@ def main():
             CallbackQueryHandler(cancel_edit_profile_callback, pattern='^cancel_edit_profile$'),
             CommandHandler('cancel', cancel_edit_profile_callback)
         ],
+        name='edit_profile',
+        persistent=True,
+        conversation_timeout=config.CONVERSATION_TIMEOUT,
     )
     
     application.add_handler(edit_profile_handler)
@@ -2214,6 +2250,35 @@ def main():
         handle_document_in_chat
     ))
     
+    # Замер времени всех обработчиков (после регистрации последнего)
+    metrics.instrument_application(application)
+    
+    return application
+
+
+def main():
+    """Запуск бота"""
+    # Проверка токена
+    if not config.BOT_TOKEN:
+        logger.error("BOT_TOKEN не указан в .env файле!")
+        return
+    
+    # Инициализация БД
+    try:
+        db.init_db()
+        logger.info("База данных инициализирована")
+    except Exception as e:
+        logger.error(f"Ошибка инициализации БД: {e}")
+        return
+    
+    # Создание приложения
+    try:
+        application = build_application()
+        logger.info("Приложение создано")
+    except Exception as e:
+        logger.error(f"Ошибка создания приложения: {e}")
+        return
+    
     # Запуск бота
     try:
         logger.info("Бот запущен!")
@@ -22,6 +22,7 @@ def check_dependencies():
     """Проверка установленных зависимостей"""
     required = {
         'telegram': 'python-telegram-bot',
+        'apscheduler': 'python-telegram-bot[job-queue]',
         'sqlalchemy': 'SQLAlchemy',
         'dotenv': 'python-dotenv',
         'PIL': 'Pillow'
@@ -0,0 +1,459 @@
+"""
+Запуск бота в несколько процессов (горизонтальное масштабирование)
+
+    python cluster.py
+
+Telegram --вебхук--> фронт (этот процесс) --шина--> воркеры 0..N-1
+
+Фронт принимает обновления по вебхуку и по telegram_id пользователя
+(консистентное хэширование) отдаёт каждое обновление одному и тому же
+воркеру, поэтому всё состояние пользователя (открытый чат, шаг регистрации)
+живёт в одном процессе. Через ту же шину (JSON-строки по TCP на localhost)
+воркеры сообщают друг другу об изменениях закэшированных данных и передают
+сообщения собеседникам, которых обслуживает другой воркер. Общий лимит
+отправки сообщений Telegram делится между воркерами поровну.
+
+Нужны настройки WEBHOOK_URL (публичный HTTPS-адрес) и CLUSTER_WORKERS.
+Фронт сам перезапускает упавшие воркеры.
+"""
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import os
+import signal
+import sys
+from collections import deque
+
+import config
+import httpserver
+
+logger = logging.getLogger(__name__)
+
+# Точек на кольце хэширования на каждый воркер (равномернее распределение)
+VIRTUAL_NODES = 160
+# Сколько сообщений держать для воркера, пока он перезапускается
+MAX_BUFFERED = 10000
+# Максимальный размер одного сообщения шины
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+# Сколько ждать отправки сообщения через другой воркер, сек
+REMOTE_SEND_TIMEOUT = 120
+
+
+class HashRing:
+    """Консистентное хэширование telegram_id по воркерам"""
+
+    def __init__(self, workers: int, virtual_nodes: int = VIRTUAL_NODES):
+        self.workers = workers
+        points = sorted(
+            (self._hash(f"worker-{worker}-{replica}"), worker)
+            for worker in range(workers)
+            for replica in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def owner(self, key) -> int:
+        """Номер воркера, который обслуживает ключ (telegram_id)"""
+        if self.workers <= 1 or key is None:
+            return 0
+        index = bisect.bisect(self._hashes, self._hash(str(key))) % len(self._hashes)
+        return self._owners[index]
+
+
+def update_user_id(update: dict):
+    """telegram_id пользователя, от которого пришло обновление (None, если пользователя нет)"""
+    for name, value in update.items():
+        if name == 'update_id' or not isinstance(value, dict):
+            continue
+        for field in ('from', 'user'):
+            if isinstance(value.get(field), dict) and 'id' in value[field]:
+                return value[field]['id']
+        if isinstance(value.get('chat'), dict):
+            return value['chat'].get('id')
+    return None
+
+
+def _encode_line(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+# ========== Фронт ==========
+
+class Front:
+    """Приём вебхука, маршрутизация обновлений по воркерам и шина между ними"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.ring = HashRing(workers)
+        self._writers = {}  # номер воркера -> StreamWriter
+        self._buffers = {worker: deque(maxlen=MAX_BUFFERED) for worker in range(workers)}
+        self._processes = {}
+        self._stopping = False
+        self.http = httpserver.HTTPServer(config.WEBHOOK_LISTEN, config.WEBHOOK_PORT)
+        self.http.route(config.WEBHOOK_PATH, self._webhook)
+
+    async def _deliver(self, worker: int, message: dict):
+        writer = self._writers.get(worker)
+        if writer is None or writer.is_closing():
+            # Воркер перезапускается - доставим, когда подключится
+            self._buffers[worker].append(message)
+            return
+        writer.write(_encode_line(message))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _webhook(self, request):
+        if request.method != 'POST':
+            return httpserver.Response(405, b'method not allowed')
+        if config.WEBHOOK_SECRET and request.headers.get('x-telegram-bot-api-secret-token') != config.WEBHOOK_SECRET:
+            return httpserver.Response(403, b'forbidden')
+        try:
+            update = json.loads(request.body)
+        except ValueError:
+            return httpserver.Response(400, b'bad json')
+
+        await self._deliver(self.ring.owner(update_user_id(update)), {'type': 'update', 'update': update})
+        return httpserver.Response(200, b'ok')
+
+    async def _route(self, sender: int, message: dict):
+        message['from'] = sender
+        if 'to' in message:
+            targets = [message['to']]
+        elif 'user_id' in message:
+            targets = [self.ring.owner(message['user_id'])]
+        else:
+            targets = [worker for worker in range(self.workers) if worker != sender]
+        for worker in targets:
+            await self._deliver(worker, message)
+
+    async def _handle_worker(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline())
+            worker = hello['worker']
+        except (ValueError, KeyError, TypeError):
+            writer.close()
+            return
+
+        self._writers[worker] = writer
+        logger.info(f"Воркер {worker} подключился к шине")
+        buffered = self._buffers[worker]
+        while buffered:
+            writer.write(_encode_line(buffered.popleft()))
+
+        try:
+            while line := await reader.readline():
+                await self._route(worker, json.loads(line))
+        except (ConnectionError, ValueError) as e:
+            logger.error(f"Ошибка шины воркера {worker}: {e}")
+        finally:
+            if self._writers.get(worker) is writer:
+                del self._writers[worker]
+            writer.close()
+            logger.info(f"Воркер {worker} отключился от шины")
+
+    async def _supervise(self, worker: int):
+        """Запустить воркер и перезапускать его при падении"""
+        loop = asyncio.get_running_loop()
+        env = dict(os.environ, CLUSTER_WORKER_INDEX=str(worker))
+        delay = 1
+        while not self._stopping:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), '--worker', str(worker), env=env
+            )
+            self._processes[worker] = process
+            started = loop.time()
+            code = await process.wait()
+            if self._stopping:
+                break
+            # Если воркер проработал долго, перезапускаем сразу, иначе - с нарастающей паузой
+            delay = 1 if loop.time() - started > 60 else min(delay * 2, 60)
+            logger.error(f"Воркер {worker} завершился с кодом {code}, перезапуск через {delay} сек")
+            await asyncio.sleep(delay)
+
+    async def _set_webhook(self):
+        from telegram import Bot, Update
+
+        async with Bot(config.BOT_TOKEN) as bot:
+            await bot.set_webhook(
+                url=config.WEBHOOK_URL,
+                secret_token=config.WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
+        logger.info(f"Вебхук установлен: {config.WEBHOOK_URL}")
+
+    async def run(self):
+        import database as db
+
+        # Схему БД создаём один раз здесь, а не в каждом воркере
+        db.init_db()
+
+        bus = await asyncio.start_server(
+            self._handle_worker, '127.0.0.1', config.CLUSTER_BUS_PORT, limit=MAX_MESSAGE_SIZE
+        )
+        supervisors = [asyncio.create_task(self._supervise(worker)) for worker in range(self.workers)]
+        await self.http.start()
+        await self._set_webhook()
+        logger.info(f"Кластер запущен: воркеров {self.workers}")
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows
+        try:
+            await stop.wait()
+        finally:
+            logger.info("Остановка кластера")
+            self._stopping = True
+            await self.http.stop()
+            for process in self._processes.values():
+                if process.returncode is None:
+                    process.terminate()
+            await asyncio.wait(supervisors, timeout=30)
+            bus.close()
+            await bus.wait_closed()
+
+
+# ========== Воркер ==========
+
+def _encode_value(value):
+    from telegram import TelegramObject
+
+    if isinstance(value, TelegramObject):
+        return {'__telegram__': type(value).__name__, 'data': value.to_dict()}
+    if isinstance(value, (list, tuple)):
+        # Например, media в send_media_group
+        return [_encode_value(item) for item in value]
+    return value
+
+
+def _decode_value(value, bot):
+    import telegram
+
+    if isinstance(value, dict) and '__telegram__' in value:
+        return getattr(telegram, value['__telegram__']).de_json(value['data'], bot)
+    if isinstance(value, list):
+        return [_decode_value(item, bot) for item in value]
+    return value
+
+
+def _encode_kwargs(kwargs: dict) -> dict:
+    return {name: _encode_value(value) for name, value in kwargs.items()}
+
+
+def _decode_kwargs(kwargs: dict, bot) -> dict:
+    return {name: _decode_value(value, bot) for name, value in kwargs.items()}
+
+
+def _rebuild_error(error: dict) -> Exception:
+    """Исключение отправки, случившееся в другом воркере"""
+    import telegram.error
+
+    import outbound
+
+    cls = getattr(telegram.error, error['class'], None) or getattr(outbound, error['class'], None)
+    if isinstance(cls, type) and issubclass(cls, telegram.error.TelegramError):
+        try:
+            return cls(error['message'])
+        except TypeError:
+            pass
+    return telegram.error.TelegramError(error['message'])
+
+
+class BusClient:
+    """Подключение воркера к шине фронта"""
+
+    def __init__(self, worker: int, ring: HashRing):
+        self.worker = worker
+        self.ring = ring
+        self._reader = None
+        self._writer = None
+        self._pending = {}  # id запроса на отправку -> Future
+        self._ids = itertools.count(1)
+        self._tasks = set()
+
+    async def connect(self, attempts: int = 50):
+        for _ in range(attempts):
+            try:
+                self._reader, self._writer = await asyncio.open_connection(
+                    '127.0.0.1', config.CLUSTER_BUS_PORT, limit=MAX_MESSAGE_SIZE
+                )
+                break
+            except OSError:
+                await asyncio.sleep(0.2)
+        else:
+            raise ConnectionError("Не удалось подключиться к шине кластера")
+        self._writer.write(_encode_line({'type': 'hello', 'worker': self.worker}))
+        await self._writer.drain()
+
+    def publish(self, message: dict):
+        """Отправить сообщение в шину (to - воркеру, user_id - владельцу пользователя, иначе всем)"""
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(_encode_line(message))
+
+    # Интерфейс outbound.router
+
+    def is_local(self, chat_id: int) -> bool:
+        return self.ring.owner(chat_id) == self.worker
+
+    async def send_remote(self, method: str, chat_id: int, priority: int, kwargs: dict):
+        import outbound
+
+        try:
+            encoded = _encode_kwargs(kwargs)
+            json.dumps(encoded)
+        except TypeError:
+            # Не сериализуется (например, файл в байтах) - отправляем сами
+            return await outbound.dispatcher.send(method, chat_id, priority, **kwargs)
+
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.publish({
+            'type': 'send',
+            'id': request_id,
+            'user_id': chat_id,
+            'method': method,
+            'chat_id': chat_id,
+            'priority': priority,
+            'kwargs': encoded,
+        })
+        try:
+            return await asyncio.wait_for(future, REMOTE_SEND_TIMEOUT)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _send_for(self, message: dict, bot):
+        """Отправить сообщение по просьбе другого воркера и вернуть ему результат"""
+        import outbound
+
+        error = None
+        try:
+            await outbound.dispatcher.send(
+                message['method'],
+                message['chat_id'],
+                message['priority'],
+                **_decode_kwargs(message['kwargs'], bot)
+            )
+        except Exception as e:
+            error = {'class': type(e).__name__, 'message': str(e)}
+        self.publish({'type': 'send_result', 'to': message['from'], 'id': message['id'], 'error': error})
+
+    async def run(self, application):
+        """Читать шину до её закрытия"""
+        import database as db
+        import operator_inbox
+        import state
+        from telegram import Update
+
+        while line := await self._reader.readline():
+            message = json.loads(line)
+            kind = message.get('type')
+            if kind == 'update':
+                await application.update_queue.put(Update.de_json(message['update'], application.bot))
+            elif kind == 'state':
+                state.forget(message['namespace'], message['key'])
+            elif kind == 'user':
+                db.invalidate_user_cache(message['telegram_id'])
+            elif kind == 'operator_profile':
+                operator_inbox.add_profile(message['telegram_id'])
+            elif kind == 'send':
+                task = asyncio.create_task(self._send_for(message, application.bot))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            elif kind == 'send_result':
+                future = self._pending.get(message['id'])
+                if future is not None and not future.done():
+                    if message['error']:
+                        future.set_exception(_rebuild_error(message['error']))
+                    else:
+                        future.set_result(None)
+        logger.warning("Шина кластера закрыта")
+
+
+async def run_worker(worker: int, workers: int):
+    """Процесс-воркер: обрабатывает обновления своей части пользователей"""
+    # Общий лимит Telegram делится между воркерами (до импорта outbound)
+    config.OUTBOUND_GLOBAL_RATE = config.OUTBOUND_GLOBAL_RATE / workers
+
+    import bot
+    import database as db
+    import operator_inbox
+    import outbound
+    import state
+
+    ring = HashRing(workers)
+    client = BusClient(worker, ring)
+    await client.connect()
+
+    state.changed_hook = lambda namespace, key: client.publish(
+        {'type': 'state', 'namespace': namespace, 'key': key}
+    )
+    db.user_changed_hook = lambda telegram_id: client.publish({'type': 'user', 'telegram_id': telegram_id})
+    operator_inbox.profile_added_hook = lambda telegram_id: client.publish(
+        {'type': 'operator_profile', 'telegram_id': telegram_id}
+    )
+    outbound.router = client
+
+    application = bot.build_application()
+    application.persistence.owns_user = lambda user_id: ring.owner(user_id) == worker
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"Воркер {worker}/{workers} запущен")
+
+        bus_task = asyncio.create_task(client.run(application))
+        stop_task = asyncio.create_task(stop.wait())
+        await asyncio.wait([bus_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        for task in (bus_task, stop_task):
+            task.cancel()
+    finally:
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def main():
+    if '--worker' in sys.argv:
+        worker = int(sys.argv[sys.argv.index('--worker') + 1])
+        asyncio.run(run_worker(worker, config.CLUSTER_WORKERS))
+        return
+
+    import logconfig
+    logconfig.setup(config.CLUSTER_LOG_FILE)
+    if not config.BOT_TOKEN:
+        logger.error("BOT_TOKEN не указан в .env файле!")
+        return
+    if not config.WEBHOOK_URL:
+        logger.error("WEBHOOK_URL не указан: для нескольких процессов нужен вебхук")
+        return
+    asyncio.run(Front(config.CLUSTER_WORKERS).run())
+
+
+if __name__ == '__main__':
+    main()
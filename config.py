@@ -40,3 +40,115 @@ PHOTOS_DIR = os.getenv('PHOTOS_DIR', 'photos')
 if not os.path.exists(PHOTOS_DIR):
     os.makedirs(PHOTOS_DIR)
 
+
+# Ограничения исходящих сообщений (лимиты Telegram Bot API)
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))  # сообщений в секунду на весь бот
+OUTBOUND_PER_CHAT_RATE = float(os.getenv('OUTBOUND_PER_CHAT_RATE', '1'))  # сообщений в секунду в один чат
+OUTBOUND_PER_CHAT_BURST = int(os.getenv('OUTBOUND_PER_CHAT_BURST', '3'))  # короткий всплеск в один чат
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '16'))  # одновременных запросов к API
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))  # повторов при сетевых ошибках
+OUTBOUND_MAX_PENDING = int(os.getenv('OUTBOUND_MAX_PENDING', '10000'))  # выше этого рассылки отклоняются
+
+# Фоновые задачи обработчиков (уведомления другим пользователям после ответа своему)
+BACKGROUND_CONCURRENCY = int(os.getenv('BACKGROUND_CONCURRENCY', '64'))  # одновременно выполняемых задач
+BACKGROUND_MAX_PENDING = int(os.getenv('BACKGROUND_MAX_PENDING', '10000'))  # выше этого новые задачи отбрасываются
+BACKGROUND_DRAIN_TIMEOUT = float(os.getenv('BACKGROUND_DRAIN_TIMEOUT', '10'))  # ожидание задач при остановке, сек
+
+# Пересылка сообщений в чатах (relay.py): сначала отправка собеседнику, потом запись в БД пачками
+RELAY_BATCH_SIZE = int(os.getenv('RELAY_BATCH_SIZE', '200'))  # сообщений в одном INSERT
+RELAY_FLUSH_INTERVAL = float(os.getenv('RELAY_FLUSH_INTERVAL', '1'))  # как часто записывать, сек
+RELAY_ROUTES_SIZE = int(os.getenv('RELAY_ROUTES_SIZE', '100000'))  # маршрутов (отправитель -> собеседник) в памяти
+RELAY_SPOOL_PATH = os.getenv('RELAY_SPOOL_PATH', 'relay_spool.jsonl')  # не записанные в БД при остановке
+RELAY_DRAIN_TIMEOUT = float(os.getenv('RELAY_DRAIN_TIMEOUT', '15'))  # ожидание очередей при остановке, сек
+RELAY_ALBUM_WINDOW = float(os.getenv('RELAY_ALBUM_WINDOW', '0.5'))  # ожидание следующего фото альбома, сек
+
+# Размер пула HTTP-соединений к Telegram (общий для всех запросов бота)
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '32'))
+
+# Обработка загружаемых фотографий анкет
+PHOTO_MAX_SIDE = int(os.getenv('PHOTO_MAX_SIDE', '1280'))  # максимальная сторона фото в пикселях
+PHOTO_JPEG_QUALITY = int(os.getenv('PHOTO_JPEG_QUALITY', '82'))  # качество JPEG при пересжатии
+PHOTO_THUMB_SIDE = int(os.getenv('PHOTO_THUMB_SIDE', '320'))  # сторона миниатюры
+PHOTO_WORKERS = int(os.getenv('PHOTO_WORKERS', '2'))  # процессов для обработки фото
+
+# Сборка мусора в хранилище фото (файлы, на которые не ссылается ни одна анкета)
+PHOTO_GC_INTERVAL = int(os.getenv('PHOTO_GC_INTERVAL', '3600'))  # как часто запускать, сек
+PHOTO_GC_GRACE = int(os.getenv('PHOTO_GC_GRACE', '3600'))  # сколько файл должен быть без ссылок, сек
+
+# Хранилище фото: 'local' (каталог PHOTOS_DIR) или 's3' (S3-совместимое, например MinIO)
+PHOTO_STORAGE = os.getenv('PHOTO_STORAGE', 'local')
+S3_ENDPOINT = os.getenv('S3_ENDPOINT', 'http://127.0.0.1:9000')
+S3_BUCKET = os.getenv('S3_BUCKET', 'dating-bot-photos')
+S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', '')
+S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', '')
+S3_REGION = os.getenv('S3_REGION', 'us-east-1')
+S3_PREFIX = os.getenv('S3_PREFIX', '')  # общий префикс ключей внутри бакета
+
+# Обзор анкет для админа: миниатюры складываются в одну картинку-сетку
+CONTACT_SHEET_PAGE_SIZE = int(os.getenv('CONTACT_SHEET_PAGE_SIZE', '24'))  # анкет на одной картинке
+CONTACT_SHEET_COLUMNS = int(os.getenv('CONTACT_SHEET_COLUMNS', '6'))  # анкет в ряду
+CONTACT_SHEET_TILE_SIDE = int(os.getenv('CONTACT_SHEET_TILE_SIDE', '240'))  # сторона миниатюры, px
+CONTACT_SHEET_FONT = os.getenv('CONTACT_SHEET_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')  # шрифт с кириллицей
+
+# Уведомления о симпатиях: вместо сообщения на каждый лайк - сводка
+LIKES_DIGEST_DELAY = int(os.getenv('LIKES_DIGEST_DELAY', '120'))  # сколько копить лайки после первого, сек
+LIKES_DIGEST_MIN_INTERVAL = int(os.getenv('LIKES_DIGEST_MIN_INTERVAL', '1800'))  # не чаще одной сводки за, сек
+LIKES_DIGEST_CHECK_INTERVAL = int(os.getenv('LIKES_DIGEST_CHECK_INTERVAL', '30'))  # как часто проверять, сек
+LIKES_PAGE_SIZE = int(os.getenv('LIKES_PAGE_SIZE', '8'))  # симпатий на одной странице списка
+
+# Входящие анкет, которые ведут админы (operator_inbox.py): сообщения и симпатии уходят админам пачками
+OPERATOR_INBOX_INTERVAL = int(os.getenv('OPERATOR_INBOX_INTERVAL', '30'))  # как часто рассылать админам, сек
+OPERATOR_BATCH_SIZE = int(os.getenv('OPERATOR_BATCH_SIZE', '200'))  # входящих за одну рассылку
+OPERATOR_REFRESH_INTERVAL = int(os.getenv('OPERATOR_REFRESH_INTERVAL', '300'))  # обновление списка анкет в воркерах, сек
+
+# Активность пользователей (activity.py): last_seen копится в памяти и пишется в БД пачками
+ACTIVITY_FLUSH_INTERVAL = int(os.getenv('ACTIVITY_FLUSH_INTERVAL', '60'))  # как часто записывать, сек
+ACTIVITY_BATCH_SIZE = int(os.getenv('ACTIVITY_BATCH_SIZE', '500'))  # пользователей в одном UPDATE
+DORMANT_AFTER_DAYS = int(os.getenv('DORMANT_AFTER_DAYS', '30'))  # через сколько дней без активности анкета засыпает
+DORMANT_CHECK_INTERVAL = int(os.getenv('DORMANT_CHECK_INTERVAL', '3600'))  # как часто искать уснувших, сек
+
+# Состояние пользователей между сообщениями (открытый чат, ожидание суммы доната и т.п.)
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'bot_state.db')  # файл SQLite, переживает перезапуск
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', '10000'))  # записей каждого состояния в памяти
+STATE_CHAT_TTL = int(os.getenv('STATE_CHAT_TTL', str(7 * 24 * 3600)))  # открытый чат без активности, сек
+STATE_INPUT_TTL = int(os.getenv('STATE_INPUT_TTL', '3600'))  # ожидание ввода (сумма доната, хэштэг), сек
+STATE_PURGE_INTERVAL = int(os.getenv('STATE_PURGE_INTERVAL', '3600'))  # очистка истёкших записей, сек
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '1'))  # как часто записывать изменения в SQLite, сек
+
+# Сохранение состояния диалогов (регистрация, редактирование анкеты) и user_data в STATE_DB_PATH
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '30'))  # как часто записывать, сек
+CONVERSATION_TIMEOUT = int(os.getenv('CONVERSATION_TIMEOUT', str(24 * 3600)))  # брошенный диалог сбрасывается, сек
+USER_DATA_TTL = int(os.getenv('USER_DATA_TTL', str(7 * 24 * 3600)))  # user_data неактивных пользователей, сек
+
+# Несколько процессов бота (python cluster.py): фронт принимает вебхук и раздаёт обновления воркерам
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 1)))  # процессов-воркеров
+CLUSTER_WORKER_INDEX = int(os.getenv('CLUSTER_WORKER_INDEX', '0'))  # номер воркера (выставляет cluster.py)
+CLUSTER_BUS_PORT = int(os.getenv('CLUSTER_BUS_PORT', '8790'))  # шина между процессами (только localhost)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # публичный HTTPS-адрес, например https://bot.example.com/telegram
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # проверяется заголовок X-Telegram-Bot-Api-Secret-Token
+
+# Логирование
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FILE = os.getenv('LOG_FILE', 'logs/bot.log')  # JSON, одна запись на строку
+CLUSTER_LOG_FILE = os.getenv('CLUSTER_LOG_FILE', 'logs/cluster.log')  # лог фронта cluster.py
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')  # доля записей ниже WARNING по логгерам: "__main__=0.1,outbound=0.5"
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (0 - отключены)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # в кластере воркер N слушает METRICS_PORT + N
+
+# Запись входящих обновлений для воспроизведения нагрузки (recorder.py, loadtest.replay); пусто - не писать
+RECORD_UPDATES_DIR = os.getenv('RECORD_UPDATES_DIR', '')  # каталог для updates-*.jsonl.gz
+RECORD_SALT = os.getenv('RECORD_SALT', '')  # ключ псевдонимов telegram_id (пусто - свой на каждый запуск)
+RECORD_FLUSH_INTERVAL = float(os.getenv('RECORD_FLUSH_INTERVAL', '5'))  # как часто дописывать файл, сек
+RECORD_MAX_BYTES = int(os.getenv('RECORD_MAX_BYTES', str(64 * 1024 * 1024)))  # размер файла до ротации
+RECORD_ROTATE_INTERVAL = int(os.getenv('RECORD_ROTATE_INTERVAL', '3600'))  # новый файл не реже чем раз в, сек
+RECORD_KEEP_FILES = int(os.getenv('RECORD_KEEP_FILES', '48'))  # сколько файлов хранить (старые удаляются)
+
+# Профилирование SQL по обработчикам (отчёт админу: /sqlprofile)
+SQL_PROFILE_ENABLED = os.getenv('SQL_PROFILE_ENABLED', 'true').lower() == 'true'
+SQL_PROFILE_MAX_QUERIES = int(os.getenv('SQL_PROFILE_MAX_QUERIES', '20'))  # больше запросов за обновление - в лог
+SQL_PROFILE_MAX_SECONDS = float(os.getenv('SQL_PROFILE_MAX_SECONDS', '0.5'))  # больше времени SQL за обновление - в лог
@@ -1,12 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Index, and_, or_, func
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Index, and_, bindparam, or_, case, func, insert, text, update
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, joinedload
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import config
+import metrics
+import migrations
 from functools import lru_cache
 import threading
 import random
 import string
+import hashlib
 
 Base = declarative_base()
 
@@ -14,6 +18,15 @@ Base = declarative_base()
 _user_cache = {}
 _cache_lock = threading.Lock()
 
+# В кластере (cluster.py): функция (telegram_id), которая сообщает другим
+# процессам, что данные пользователя изменились и его нужно убрать из кэша
+user_changed_hook = None
+
+
+def _user_changed(telegram_id: int):
+    if user_changed_hook and telegram_id:
+        user_changed_hook(telegram_id)
+
 
 class User(Base):
     """Модель пользователя"""
@@ -28,9 +41,15 @@ class User(Base):
     city = Column(String(100), nullable=False)
     description = Column(Text, nullable=False)
     photo_path = Column(String(500), nullable=False)
+    photo_file_id = Column(String(255), nullable=True)  # file_id фото в Telegram (после первой отправки)
     hashtag = Column(String(20), unique=True, nullable=True, index=True)  # Уникальный код для женских анкет
     registered_at = Column(DateTime, default=datetime.now)
     is_active = Column(Boolean, default=True, index=True)  # Индекс для фильтрации активных
+    unviewed_likes = Column(Integer, default=0, server_default='0', nullable=False)  # Счётчик непросмотренных лайков
+    is_unreachable = Column(Boolean, default=False, server_default='0', nullable=False)  # Бот не может писать (заблокирован, чата нет)
+    is_operator_managed = Column(Boolean, default=False, server_default='0', nullable=False)  # Анкету ведут админы (выдуманный telegram_id)
+    last_seen_at = Column(DateTime, default=datetime.now, nullable=True)  # Последнее обновление от пользователя (пишется пачками)
+    is_dormant = Column(Boolean, default=False, server_default='0', nullable=False)  # Давно не заходил: не показывается в ленте
     
     # Связи
     sent_likes = relationship('Like', foreign_keys='Like.from_user_id', back_populates='from_user')
@@ -42,6 +61,7 @@ class User(Base):
     __table_args__ = (
         Index('idx_gender_active', 'gender', 'is_active'),
         Index('idx_hashtag', 'hashtag'),
+        Index('idx_dormant_last_seen', 'is_dormant', 'last_seen_at'),
     )
     
 
@@ -144,6 +164,52 @@ class Payment(Base):
     # Связи
     user = relationship('User', foreign_keys=[user_id], backref='payments')
     recipient = relationship('User', foreign_keys=[recipient_user_id])
+    
+    __table_args__ = (
+        Index('idx_payment_recipient', 'recipient_user_id', 'status'),
+    )
+
+
+class PhotoBlob(Base):
+    """Файл фото в хранилище (адресуется хэшем содержимого)"""
+    __tablename__ = 'photo_blobs'
+    
+    hash = Column(String(64), primary_key=True)  # SHA-256 содержимого
+    path = Column(String(500), unique=True, nullable=False)
+    size = Column(Integer, nullable=False)  # Размер в байтах
+    ref_count = Column(Integer, default=0, nullable=False)  # Сколько анкет ссылается на файл (-1 - удаляется сборщиком мусора)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)  # Последнее изменение ref_count
+    
+    __table_args__ = (
+        Index('idx_blob_refs', 'ref_count', 'updated_at'),
+    )
+
+
+class OperatorInboxItem(Base):
+    """Входящее для анкеты, которую ведут админы: сообщение, симпатия или уведомление"""
+    __tablename__ = 'operator_inbox'
+    
+    id = Column(Integer, primary_key=True)
+    profile_id = Column(Integer, ForeignKey('users.id'), nullable=False)  # Анкета, которой написали
+    from_user_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Кто написал (None - уведомление бота)
+    kind = Column(String(20), nullable=False)  # message, like, notice
+    text = Column(Text, nullable=False)
+    payload = Column(Text, nullable=True)  # JSON вызова Bot API, которым вложение показывается админам
+    like_id = Column(Integer, ForeignKey('likes.id'), nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    delivered_at = Column(DateTime, nullable=True)  # Когда разослано админам
+    answered_at = Column(DateTime, nullable=True)  # Когда админ ответил (для уведомлений - сразу)
+    answered_by = Column(Integer, nullable=True)  # telegram_id ответившего админа
+    
+    # Связи
+    profile = relationship('User', foreign_keys=[profile_id])
+    from_user = relationship('User', foreign_keys=[from_user_id])
+    
+    __table_args__ = (
+        Index('idx_operator_undelivered', 'delivered_at', 'id'),
+        Index('idx_operator_conversation', 'profile_id', 'from_user_id', 'answered_at'),
+    )
 
 
 # Создание движка с оптимизацией для производительности
@@ -172,8 +238,8 @@ Session = sessionmaker(bind=engine)
 
 
 def init_db():
-    """Инициализация базы данных"""
-    Base.metadata.create_all(engine)
+    """Инициализация базы данных: применить недостающие миграции (см. migrations)"""
+    migrations.migrate(engine, Base.metadata)
 
 
 def get_session():
@@ -204,7 +270,9 @@ def get_user_by_telegram_id(telegram_id: int):
     # Проверяем кэш
     with _cache_lock:
         if telegram_id in _user_cache:
+            metrics.cache_hit('user')
             return _user_cache[telegram_id]
+    metrics.cache_miss('user')
     
     session = get_session()
     try:
@@ -218,6 +286,123 @@ def get_user_by_telegram_id(telegram_id: int):
         session.close()
 
 
+def set_user_unreachable(telegram_id: int, unreachable: bool) -> bool:
+    """
+    Пометить пользователя недоступным (или снова доступным); True - отметка изменилась
+    
+    Анкеты операторов недоступными не помечаются: "chat not found" для них
+    приходит, пока воркер ещё не знает о новой анкете.
+    """
+    session = get_session()
+    try:
+        criteria = [User.telegram_id == telegram_id, User.is_unreachable == (not unreachable)]
+        if unreachable:
+            criteria.append(User.is_operator_managed == False)
+        updated = session.query(User).filter(*criteria).update({User.is_unreachable: unreachable}, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+    if updated:
+        invalidate_user_cache(telegram_id)
+        _user_changed(telegram_id)
+    return bool(updated)
+
+
+def get_unreachable_telegram_ids() -> list:
+    """telegram_id всех пользователей, которым бот не может писать"""
+    session = get_session()
+    try:
+        return [row[0] for row in session.query(User.telegram_id).filter(User.is_unreachable == True)]
+    finally:
+        session.close()
+
+
+def touch_users(seen: dict) -> list:
+    """
+    Записать время последней активности пачкой (один UPDATE на все строки)
+    
+    Args:
+        seen: {telegram_id: время последнего обновления от пользователя}
+    
+    Returns:
+        telegram_id пользователей, которые были спящими и вернулись
+    """
+    if not seen:
+        return []
+    session = get_session()
+    try:
+        restored = [row[0] for row in session.query(User.telegram_id).filter(
+            User.telegram_id.in_(list(seen)),
+            User.is_dormant == True
+        )]
+        users = User.__table__
+        session.execute(
+            update(users).where(users.c.telegram_id == bindparam('b_telegram_id')).values(
+                last_seen_at=bindparam('b_last_seen_at'), is_dormant=False
+            ),
+            [{'b_telegram_id': telegram_id, 'b_last_seen_at': last_seen_at}
+             for telegram_id, last_seen_at in seen.items()]
+        )
+        session.commit()
+    finally:
+        session.close()
+    for telegram_id in restored:
+        invalidate_user_cache(telegram_id)
+        _user_changed(telegram_id)
+    return restored
+
+
+def mark_dormant_users(inactive_since: datetime) -> int:
+    """Перевести в спящие пользователей, не заходивших с inactive_since (анкеты операторов не трогаем)"""
+    session = get_session()
+    try:
+        updated = session.query(User).filter(
+            User.is_dormant == False,
+            User.is_operator_managed == False,
+            User.last_seen_at < inactive_since
+        ).update({User.is_dormant: True}, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+    if updated:
+        # Кэш анкет не знает, кто уснул
+        invalidate_user_cache()
+    return updated
+
+
+def count_dormant_users() -> int:
+    """Количество спящих пользователей"""
+    session = get_session()
+    try:
+        return session.query(func.count(User.id)).filter(User.is_dormant == True).scalar()
+    finally:
+        session.close()
+
+
+def get_users_brief(telegram_ids: list) -> list:
+    """
+    Пол, время регистрации и наличие подписки пользователей одним запросом
+    (для записи обновлений, recorder.py)
+    
+    Returns:
+        [(telegram_id, id, пол, registered_at, есть активная подписка)]
+    """
+    if not telegram_ids:
+        return []
+    session = get_session()
+    try:
+        subscribed = session.query(Subscription.id).filter(
+            Subscription.user_id == User.id,
+            Subscription.is_active == True,
+            Subscription.expires_at > datetime.now()
+        ).exists()
+        return session.query(
+            User.telegram_id, User.id, User.gender, User.registered_at, subscribed
+        ).filter(User.telegram_id.in_(telegram_ids)).all()
+    finally:
+        session.close()
+
+
 def invalidate_user_cache(telegram_id: int = None):
     """Очистить кэш пользователя (вызывать после обновления данных)"""
     with _cache_lock:
@@ -228,8 +413,8 @@ def invalidate_user_cache(telegram_id: int = None):
 
 
 def create_user(telegram_id: int, username: str, name: str, gender: str, age: int, 
-                city: str, description: str, photo_path: str):
-    """Создать нового пользователя"""
+                city: str, description: str, photo_path: str, operator_managed: bool = False):
+    """Создать нового пользователя (operator_managed - анкету ведут админы)"""
     session = get_session()
     try:
         # Генерируем хэштэг только для женских анкет
@@ -246,7 +431,8 @@ def create_user(telegram_id: int, username: str, name: str, gender: str, age: in
             city=city,
             description=description,
             photo_path=photo_path,
-            hashtag=hashtag
+            hashtag=hashtag,
+            is_operator_managed=operator_managed
         )
         session.add(user)
         session.commit()
@@ -276,7 +462,9 @@ def get_profiles_for_user(user_id: int, city: str, limit: int = 1):
         # Получаем женские профили с исключением
         query = session.query(User).filter(
             User.gender == 'female',
-            User.is_active == True
+            User.is_active == True,
+            User.is_unreachable == False,
+            User.is_dormant == False
         )
         
         # Применяем исключение только если есть исключенные ID
@@ -295,7 +483,9 @@ def get_profiles_for_user(user_id: int, city: str, limit: int = 1):
             
             query = session.query(User).filter(
                 User.gender == 'female',
-                User.is_active == True
+                User.is_active == True,
+                User.is_unreachable == False,
+                User.is_dormant == False
             )
             if excluded_ids:
                 query = query.filter(~User.id.in_(excluded_ids))
@@ -318,11 +508,14 @@ def add_viewed_profile(user_id: int, viewed_user_id: int):
 
 
 def add_like(from_user_id: int, to_user_id: int):
-    """Добавить лайк"""
+    """Добавить лайк (и увеличить счётчик непросмотренных у получателя)"""
     session = get_session()
     try:
         like = Like(from_user_id=from_user_id, to_user_id=to_user_id)
         session.add(like)
+        session.query(User).filter_by(id=to_user_id).update(
+            {User.unviewed_likes: User.unviewed_likes + 1}, synchronize_session=False
+        )
         session.commit()
         session.refresh(like)
         return like
@@ -330,31 +523,116 @@ def add_like(from_user_id: int, to_user_id: int):
         session.close()
 
 
-def get_unviewed_likes(user_id: int):
-    """Получить непросмотренные лайки для пользователя"""
+def _decrease_unviewed_likes(session, user_id: int, count: int):
+    """Уменьшить счётчик непросмотренных лайков (не ниже нуля)"""
+    session.query(User).filter_by(id=user_id).update({
+        User.unviewed_likes: case((User.unviewed_likes > count, User.unviewed_likes - count), else_=0)
+    }, synchronize_session=False)
+
+
+def _mark_likes_viewed(session, user_id: int, *criteria) -> int:
+    """Отметить просмотренными лайки пользователю одним UPDATE и поправить счётчик"""
+    updated = session.query(Like).filter(
+        Like.to_user_id == user_id,
+        Like.is_viewed == False,
+        *criteria
+    ).update({Like.is_viewed: True}, synchronize_session=False)
+    if updated:
+        _decrease_unviewed_likes(session, user_id, updated)
+    return updated
+
+
+def count_unviewed_likes(user_id: int) -> int:
+    """Количество непросмотренных лайков пользователя (по счётчику в users)"""
     session = get_session()
     try:
-        likes = session.query(Like).filter_by(
-            to_user_id=user_id,
-            is_viewed=False
-        ).all()
-        return likes
+        return session.query(User.unviewed_likes).filter_by(id=user_id).scalar() or 0
     finally:
         session.close()
 
 
-def mark_like_as_viewed(like_id: int):
-    """Отметить лайк как просмотренный"""
+def get_likes_inbox(user_id: int, after_id: int = 0, before_id: int = None, limit: int = 10):
+    """
+    Получить страницу непросмотренных лайков вместе с анкетами отправителей
+    (keyset-пагинация по id, like.from_user загружается тем же запросом)
+    
+    Args:
+        user_id: кому поставлены лайки
+        after_id: вернуть лайки с id больше указанного (следующая страница)
+        before_id: вернуть лайки с id меньше указанного (предыдущая страница)
+        limit: размер страницы
+    
+    Returns:
+        (лайки, есть_предыдущая, есть_следующая)
+    """
     session = get_session()
     try:
-        like = session.query(Like).filter_by(id=like_id).first()
-        if like:
-            like.is_viewed = True
-            session.commit()
+        query = session.query(Like).filter(Like.to_user_id == user_id, Like.is_viewed == False)
+        page = query.options(joinedload(Like.from_user))
+        
+        if before_id is not None:
+            rows = page.filter(Like.id < before_id).order_by(Like.id.desc()).limit(limit + 1).all()
+            has_prev = len(rows) > limit
+            likes = list(reversed(rows[:limit]))
+            has_next = True
+        else:
+            rows = page.filter(Like.id > after_id).order_by(Like.id).limit(limit + 1).all()
+            has_next = len(rows) > limit
+            likes = rows[:limit]
+            has_prev = bool(likes) and session.query(
+                query.filter(Like.id < likes[0].id).exists()
+            ).scalar()
+        
+        return likes, has_prev, has_next
+    finally:
+        session.close()
+
+
+def open_like(like_id: int, user_id: int):
+    """
+    Открыть лайк получателем: отметить просмотренным и вернуть вместе
+    с анкетами отправителя и получателя (один запрос с JOIN)
+    
+    Returns:
+        Like с загруженными from_user и to_user или None, если лайк не этому пользователю
+    """
+    session = get_session()
+    try:
+        like = session.query(Like).options(
+            joinedload(Like.from_user), joinedload(Like.to_user)
+        ).filter(Like.id == like_id, Like.to_user_id == user_id).first()
+        if like is None:
+            return None
+        _mark_likes_viewed(session, user_id, Like.id == like_id)
+        # Отсоединяем до commit, иначе загруженные анкеты сбросятся
+        session.expunge_all()
+        session.commit()
+        like.is_viewed = True
+        return like
     finally:
         session.close()
 
 
+def mark_likes_viewed(user_id: int, from_id: int, to_id: int) -> int:
+    """Отметить просмотренными все лайки пользователю с id от from_id до to_id (страница списка)"""
+    session = get_session()
+    try:
+        updated = _mark_likes_viewed(session, user_id, Like.id >= from_id, Like.id <= to_id)
+        session.commit()
+        return updated
+    finally:
+        session.close()
+
+
+def recount_unviewed_likes():
+    """Пересчитать счётчики непросмотренных лайков всех пользователей по таблице likes"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            'UPDATE users SET unviewed_likes = ('
+            'SELECT COUNT(*) FROM likes WHERE likes.to_user_id = users.id AND likes.is_viewed = :viewed)'
+        ), {'viewed': False})
+
+
 def start_chat(like_id: int):
     """Начать чат (отметить в лайке)"""
     session = get_session()
@@ -385,6 +663,24 @@ def add_message(from_user_id: int, to_user_id: int, text: str):
         session.close()
 
 
+def add_messages(rows: list) -> int:
+    """
+    Добавить пачку сообщений одним INSERT
+    
+    Args:
+        rows: словари с from_user_id, to_user_id, text и created_at
+    """
+    if not rows:
+        return 0
+    session = get_session()
+    try:
+        session.execute(insert(Message), rows)
+        session.commit()
+        return len(rows)
+    finally:
+        session.close()
+
+
 def get_active_chats(user_id: int):
     """Получить активные чаты пользователя - оптимизированная версия"""
     session = get_session()
@@ -456,6 +752,23 @@ def get_user_by_id(user_id: int):
         session.close()
 
 
+def set_photo_file_id(user_id: int, telegram_id: int, file_id: str = None):
+    """Сохранить (или сбросить) file_id фото пользователя в Telegram"""
+    session = get_session()
+    try:
+        session.query(User).filter_by(id=user_id).update({User.photo_file_id: file_id})
+        session.commit()
+        
+        # Обновляем закэшированный объект, если он есть
+        with _cache_lock:
+            cached = _user_cache.get(telegram_id)
+            if cached is not None and cached.id == user_id:
+                cached.photo_file_id = file_id
+        _user_changed(telegram_id)
+    finally:
+        session.close()
+
+
 def get_user_by_hashtag(hashtag: str):
     """Получить пользователя по хэштэгу"""
     session = get_session()
@@ -464,12 +777,60 @@ def get_user_by_hashtag(hashtag: str):
         if not hashtag.startswith('#'):
             hashtag = '#' + hashtag
         
-        user = session.query(User).filter_by(hashtag=hashtag, is_active=True).first()
+        user = session.query(User).filter_by(hashtag=hashtag, is_active=True, is_unreachable=False,
+                                              is_dormant=False).first()
         return user
     finally:
         session.close()
 
 
+def get_profiles_page(gender: str, after_id: int = 0, before_id: int = None, limit: int = 10):
+    """
+    Получить страницу активных анкет (keyset-пагинация по id)
+    
+    Args:
+        gender: 'male' или 'female'
+        after_id: вернуть анкеты с id больше указанного (следующая страница)
+        before_id: вернуть анкеты с id меньше указанного (предыдущая страница)
+        limit: размер страницы
+    
+    Returns:
+        (анкеты, есть_предыдущая, есть_следующая)
+    """
+    session = get_session()
+    try:
+        query = session.query(User).filter(User.gender == gender, User.is_active == True)
+        
+        if before_id is not None:
+            rows = query.filter(User.id < before_id).order_by(User.id.desc()).limit(limit + 1).all()
+            has_prev = len(rows) > limit
+            profiles = list(reversed(rows[:limit]))
+            has_next = True
+        else:
+            rows = query.filter(User.id > after_id).order_by(User.id).limit(limit + 1).all()
+            has_next = len(rows) > limit
+            profiles = rows[:limit]
+            has_prev = bool(profiles) and session.query(
+                query.filter(User.id < profiles[0].id).exists()
+            ).scalar()
+        
+        return profiles, has_prev, has_next
+    finally:
+        session.close()
+
+
+def count_active_profiles(gender: str) -> int:
+    """Количество активных анкет указанного пола"""
+    session = get_session()
+    try:
+        return session.query(func.count(User.id)).filter(
+            User.gender == gender,
+            User.is_active == True
+        ).scalar()
+    finally:
+        session.close()
+
+
 def get_likes_stats_by_female():
     """Получить статистику лайков по женским анкетам (количество уникальных мужчин, поставивших лайк)"""
     session = get_session()
@@ -669,6 +1030,241 @@ def get_donations_to_user(recipient_user_id: int):
         session.close()
 
 
+# ========== Функции для входящих анкет операторов ==========
+
+def get_operator_telegram_ids() -> list:
+    """telegram_id всех анкет, которые ведут админы"""
+    session = get_session()
+    try:
+        return [row[0] for row in session.query(User.telegram_id).filter(User.is_operator_managed == True)]
+    finally:
+        session.close()
+
+
+def add_operator_item(profile_id: int, from_user_id: int, kind: str, text: str,
+                      payload: str = None, like_id: int = None):
+    """Добавить входящее для анкеты оператора (уведомления бота отвечать не нужно)"""
+    session = get_session()
+    try:
+        item = OperatorInboxItem(
+            profile_id=profile_id,
+            from_user_id=from_user_id,
+            kind=kind,
+            text=text,
+            payload=payload,
+            like_id=like_id
+        )
+        if from_user_id is None:
+            item.answered_at = datetime.now()
+        session.add(item)
+        session.commit()
+        return item.id
+    finally:
+        session.close()
+
+
+def get_undelivered_operator_items(limit: int = 100):
+    """Ещё не разосланные админам входящие (с анкетами обеих сторон) в порядке поступления"""
+    session = get_session()
+    try:
+        items = session.query(OperatorInboxItem).options(
+            joinedload(OperatorInboxItem.profile), joinedload(OperatorInboxItem.from_user)
+        ).filter(OperatorInboxItem.delivered_at == None).order_by(OperatorInboxItem.id).limit(limit).all()
+        session.expunge_all()
+        return items
+    finally:
+        session.close()
+
+
+def mark_operator_items_delivered(item_ids: list) -> int:
+    """Отметить входящие разосланными админам"""
+    if not item_ids:
+        return 0
+    session = get_session()
+    try:
+        updated = session.query(OperatorInboxItem).filter(
+            OperatorInboxItem.id.in_(item_ids)
+        ).update({OperatorInboxItem.delivered_at: datetime.now()}, synchronize_session=False)
+        session.commit()
+        return updated
+    finally:
+        session.close()
+
+
+def mark_operator_answered(profile_id: int, from_user_id: int, admin_telegram_id: int) -> int:
+    """Отметить отвеченными все входящие анкете от пользователя"""
+    session = get_session()
+    try:
+        updated = session.query(OperatorInboxItem).filter(
+            OperatorInboxItem.profile_id == profile_id,
+            OperatorInboxItem.from_user_id == from_user_id,
+            OperatorInboxItem.answered_at == None
+        ).update({
+            OperatorInboxItem.answered_at: datetime.now(),
+            OperatorInboxItem.answered_by: admin_telegram_id
+        }, synchronize_session=False)
+        session.commit()
+        return updated
+    finally:
+        session.close()
+
+
+def get_operator_conversations(limit: int = 20):
+    """
+    Диалоги анкет операторов, в которых есть неотвеченные входящие (сначала свежие)
+    
+    Returns:
+        список (анкета, пользователь, число неотвеченных, время последнего)
+    """
+    session = get_session()
+    try:
+        last_at = func.max(OperatorInboxItem.created_at)
+        rows = session.query(
+            OperatorInboxItem.profile_id, OperatorInboxItem.from_user_id, func.count(OperatorInboxItem.id), last_at
+        ).filter(
+            OperatorInboxItem.answered_at == None,
+            OperatorInboxItem.from_user_id != None
+        ).group_by(
+            OperatorInboxItem.profile_id, OperatorInboxItem.from_user_id
+        ).order_by(last_at.desc()).limit(limit).all()
+        
+        user_ids = {row[0] for row in rows} | {row[1] for row in rows}
+        users = {user.id: user for user in session.query(User).filter(User.id.in_(user_ids))} if user_ids else {}
+        session.expunge_all()
+        return [
+            (users[profile_id], users[from_user_id], count, created_at)
+            for profile_id, from_user_id, count, created_at in rows
+            if profile_id in users and from_user_id in users
+        ]
+    finally:
+        session.close()
+
+
+def count_operator_conversations() -> int:
+    """Число диалогов анкет операторов с неотвеченными входящими"""
+    session = get_session()
+    try:
+        return session.query(
+            OperatorInboxItem.profile_id, OperatorInboxItem.from_user_id
+        ).filter(
+            OperatorInboxItem.answered_at == None,
+            OperatorInboxItem.from_user_id != None
+        ).distinct().count()
+    finally:
+        session.close()
+
+
+# ========== Функции для хранилища фото ==========
+
+def acquire_photo_blob(blob_hash: str, path: str, size: int):
+    """
+    Увеличить счётчик ссылок на файл фото (создать запись, если её нет)
+    
+    Returns:
+        True - запись создана (файл нужно записать), False - счётчик увеличен,
+        None - файл сейчас удаляет сборщик мусора (ref_count = -1), повторите позже
+    """
+    session = get_session()
+    try:
+        for _ in range(2):
+            updated = session.query(PhotoBlob).filter(
+                PhotoBlob.hash == blob_hash,
+                PhotoBlob.ref_count >= 0
+            ).update({
+                PhotoBlob.ref_count: PhotoBlob.ref_count + 1,
+                PhotoBlob.updated_at: datetime.now()
+            }, synchronize_session=False)
+            if updated:
+                session.commit()
+                return False
+            if session.query(PhotoBlob.hash).filter_by(hash=blob_hash).first():
+                return None
+            session.add(PhotoBlob(hash=blob_hash, path=path, size=size, ref_count=1))
+            try:
+                session.commit()
+                return True
+            except IntegrityError:
+                # Запись успели создать параллельно - увеличиваем её счётчик
+                session.rollback()
+        return None
+    finally:
+        session.close()
+
+
+def _release_photo_blob(session, path: str):
+    """Уменьшить счётчик ссылок на файл фото в рамках сессии"""
+    updated = session.query(PhotoBlob).filter(
+        PhotoBlob.path == path,
+        PhotoBlob.ref_count > 0
+    ).update({
+        PhotoBlob.ref_count: PhotoBlob.ref_count - 1,
+        PhotoBlob.updated_at: datetime.now()
+    }, synchronize_session=False)
+    
+    if not updated and not session.query(PhotoBlob.hash).filter_by(path=path).first():
+        # Старый файл вне хранилища (photos/<id>.jpg) - передаём его сборщику мусора
+        session.add(PhotoBlob(
+            hash=hashlib.sha256(f"legacy:{path}".encode()).hexdigest(),
+            path=path,
+            size=0,
+            ref_count=0
+        ))
+
+
+def release_photo_blob(path: str):
+    """Уменьшить счётчик ссылок на файл фото"""
+    session = get_session()
+    try:
+        _release_photo_blob(session, path)
+        session.commit()
+    finally:
+        session.close()
+
+
+def get_unreferenced_photo_blobs(older_than: datetime, limit: int = 500):
+    """Получить файлы фото, на которые больше никто не ссылается"""
+    session = get_session()
+    try:
+        return session.query(PhotoBlob).filter(
+            PhotoBlob.ref_count <= 0,
+            PhotoBlob.updated_at < older_than
+        ).limit(limit).all()
+    finally:
+        session.close()
+
+
+def claim_photo_blob(blob_hash: str, updated_at: datetime) -> bool:
+    """
+    Захватить файл для удаления сборщиком мусора (ref_count = -1), если с момента
+    выборки на него так и не сослались; новые ссылки на захваченный файл не выдаются
+    """
+    session = get_session()
+    try:
+        claimed = session.query(PhotoBlob).filter(
+            PhotoBlob.hash == blob_hash,
+            PhotoBlob.ref_count <= 0,
+            PhotoBlob.updated_at == updated_at
+        ).update({PhotoBlob.ref_count: -1}, synchronize_session=False)
+        session.commit()
+        return claimed > 0
+    finally:
+        session.close()
+
+
+def delete_photo_blob(blob_hash: str) -> bool:
+    """Удалить запись о захваченном сборщиком мусора файле (после удаления самого файла)"""
+    session = get_session()
+    try:
+        deleted = session.query(PhotoBlob).filter(
+            PhotoBlob.hash == blob_hash,
+            PhotoBlob.ref_count < 0
+        ).delete(synchronize_session=False)
+        session.commit()
+        return deleted > 0
+    finally:
+        session.close()
+
+
 # ========== Функции для редактирования профиля ==========
 
 def update_user_profile(user_id: int, name: str = None, age: int = None, 
@@ -690,6 +1286,8 @@ def update_user_profile(user_id: int, name: str = None, age: int = None,
             user.description = description
         if photo_path is not None:
             user.photo_path = photo_path
+            # Старый file_id указывает на прежнее фото
+            user.photo_file_id = None
         
         session.commit()
         
@@ -697,6 +1295,7 @@ def update_user_profile(user_id: int, name: str = None, age: int = None,
         if user.telegram_id:
             with _cache_lock:
                 _user_cache[user.telegram_id] = user
+        _user_changed(user.telegram_id)
         
         return True
     finally:
@@ -711,15 +1310,22 @@ def delete_user_profile(user_id: int):
         if not user:
             return False
         
-        # Удаляем фото
-        import os
-        try:
-            if os.path.exists(user.photo_path):
-                os.remove(user.photo_path)
-        except:
-            pass
+        # Освобождаем фото (файл удалит сборщик мусора, если он больше никому не нужен)
+        _release_photo_blob(session, user.photo_path)
+        
+        # Непросмотренные лайки удаляемого пользователя больше не учитываются у получателей
+        pending = session.query(Like.to_user_id, func.count(Like.id)).filter(
+            Like.from_user_id == user_id,
+            Like.is_viewed == False
+        ).group_by(Like.to_user_id).all()
+        for to_user_id, count in pending:
+            _decrease_unviewed_likes(session, to_user_id, count)
+        
+        # Удаляем связанные данные (входящие операторов ссылаются на лайки - раньше них)
+        session.query(OperatorInboxItem).filter(
+            (OperatorInboxItem.profile_id == user_id) | (OperatorInboxItem.from_user_id == user_id)
+        ).delete()
         
-        # Удаляем связанные данные
         session.query(Like).filter(
             (Like.from_user_id == user_id) | (Like.to_user_id == user_id)
         ).delete()
@@ -743,6 +1349,7 @@ def delete_user_profile(user_id: int):
         if user.telegram_id:
             with _cache_lock:
                 _user_cache.pop(user.telegram_id, None)
+        _user_changed(user.telegram_id)
         
         return True
     finally:
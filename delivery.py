@@ -0,0 +1,68 @@
+"""
+Пользователи, которым бот не может доставить сообщения
+
+Когда Telegram отвечает, что бот заблокирован, аккаунт удалён или чата нет,
+диспетчер outbound вызывает chat_unreachable(). Пользователь помечается в БД
+(users.is_unreachable), пропадает из ленты анкет, поиска по коду и сводок
+симпатий, а отправки ему завершаются ChatUnreachable без запроса к Bot API.
+Анкеты с выдуманным telegram_id, которые ведут админы, сюда не попадают:
+отправки им забирает operator_inbox.py.
+
+Отметка снимается, когда пользователь снова пишет боту или разблокирует
+его (обновление my_chat_member).
+"""
+import asyncio
+import logging
+
+from telegram import ChatMember, Update
+from telegram.error import Forbidden
+from telegram.ext import ContextTypes
+
+import database as db
+import metrics
+import outbound
+import tasks
+
+logger = logging.getLogger(__name__)
+
+
+def install():
+    """Загрузить недоступные чаты из БД и подключиться к диспетчеру (из post_init)"""
+    outbound.unreachable.update(db.get_unreachable_telegram_ids())
+    outbound.unreachable_hook = chat_unreachable
+    metrics.unreachable_users.set_function(lambda: len(outbound.unreachable))
+    logger.info(f"Недоступных чатов: {len(outbound.unreachable)}")
+
+
+def chat_unreachable(chat_id: int, error: Exception):
+    """Диспетчер получил постоянную ошибку доставки в чат"""
+    metrics.unreachable_marked.inc(type(error).__name__)
+    logger.warning(f"Чат {chat_id} недоступен, пользователь исключён из ленты и рассылок: {error}")
+    tasks.spawn(asyncio.to_thread(db.set_user_unreachable, chat_id, True), 'mark_unreachable')
+
+
+def mark_reachable(telegram_id: int):
+    """Пользователь снова доступен"""
+    if telegram_id not in outbound.unreachable:
+        return
+    outbound.unreachable.discard(telegram_id)
+    db.set_user_unreachable(telegram_id, False)
+    logger.info(f"Чат {telegram_id} снова доступен")
+
+
+async def track_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Любое обновление от пользователя значит, что ему снова можно писать (группа -1)"""
+    if update.my_chat_member or not update.effective_user:
+        return
+    mark_reachable(update.effective_user.id)
+
+
+async def my_chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пользователь заблокировал или разблокировал бота"""
+    member = update.my_chat_member
+    if member.chat.type != 'private':
+        return
+    if member.new_chat_member.status == ChatMember.BANNED:
+        outbound.mark_unreachable(member.chat.id, Forbidden("Forbidden: bot was blocked by the user"))
+    elif member.new_chat_member.status == ChatMember.MEMBER:
+        mark_reachable(member.chat.id)
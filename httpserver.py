@@ -0,0 +1,170 @@
+"""
+Минимальный асинхронный HTTP/1.1 сервер (приём вебхуков, служебные эндпоинты)
+
+Без зависимостей: для нескольких служебных адресов полноценный веб-фреймворк
+не нужен, а запросы обрабатываются в том же event loop, что и бот.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 10 * 1024 * 1024
+# Соединения, по которым долго ничего не приходит, закрываются
+IDLE_TIMEOUT = 75
+
+REASONS = {
+    200: 'OK',
+    204: 'No Content',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+class Request:
+    """Входящий HTTP-запрос"""
+
+    def __init__(self, method: str, path: str, query: str, headers: dict, body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers  # имена заголовков в нижнем регистре
+        self.body = body
+
+
+class Response:
+    """Ответ HTTP"""
+
+    def __init__(self, status: int = 200, body: bytes = b'', content_type: str = 'text/plain; charset=utf-8',
+                 headers: dict = None):
+        self.status = status
+        self.body = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+class HTTPServer:
+    """
+    HTTP-сервер с маршрутизацией по пути
+
+    handler(request) - async функция, возвращающая Response. Точное совпадение
+    пути (route) проверяется раньше префиксов (route_prefix).
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._prefix_routes = []
+        self._server = None
+        self._connections = set()
+
+    def route(self, path: str, handler):
+        """Зарегистрировать обработчик для пути"""
+        self._routes[path] = handler
+
+    def route_prefix(self, prefix: str, handler):
+        """Зарегистрировать обработчик для всех путей, начинающихся с prefix"""
+        self._prefix_routes.append((prefix, handler))
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        if not self.port:
+            # Порт 0 - выбран системой
+            self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"HTTP-сервер слушает {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Открытые keep-alive соединения сервер сам не закрывает
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise ValueError("Некорректная строка запроса")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise OverflowError
+        body = await reader.readexactly(length) if length else b''
+
+        path, _, query = target.partition('?')
+        return Request(method.upper(), path, query, headers, body)
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get(request.path)
+        if handler is None:
+            handler = next((h for prefix, h in self._prefix_routes if request.path.startswith(prefix)), None)
+        if handler is None:
+            return Response(404, b'not found')
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Ошибка обработки {request.method} {request.path}: {e}")
+            return Response(500, b'internal error')
+
+    @staticmethod
+    def _write_response(writer, response: Response, keep_alive: bool):
+        head = [
+            f"HTTP/1.1 {response.status} {REASONS.get(response.status, 'Unknown')}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(response.body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        head.extend(f"{name}: {value}" for name, value in response.headers.items())
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response.body)
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), IDLE_TIMEOUT)
+                except OverflowError:
+                    self._write_response(writer, Response(413, b'too large'), keep_alive=False)
+                    break
+                except (ValueError, asyncio.IncompleteReadError):
+                    self._write_response(writer, Response(400, b'bad request'), keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                self._write_response(writer, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
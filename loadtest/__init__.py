@@ -0,0 +1,16 @@
+"""
+Сквозное нагрузочное тестирование бота
+
+fake_api - локальный поддельный Bot API с задержками и ошибками,
+simulator - виртуальные пользователи, которые ходят по сценариям бота
+через настоящий Application (bot.build_application). Запуск:
+
+    python -m loadtest.simulator --men 2000 --women 1000 --concurrency 200 --ramp 50,100,200,400
+
+replay - воспроизведение обновлений, записанных в проде (recorder.py,
+RECORD_UPDATES_DIR), с задержками обработки по видам обновлений;
+compare - сравнение двух воспроизведений одной записи:
+
+    python -m loadtest.replay recordings/updates-*.jsonl.gz --speed 10 --output after.json
+    python -m loadtest.compare before.json after.json
+"""
@@ -0,0 +1,68 @@
+"""
+Сравнение двух воспроизведений одной записи (loadtest.replay --output)
+
+Печатает p50 и p95 по видам обновлений до и после и их отношение; код
+выхода 1, если по какому-либо виду с достаточным числом обновлений
+выбранный перцентиль вырос больше, чем в --threshold раз, или стало
+больше необработанных обновлений.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнить два результата loadtest.replay")
+    parser.add_argument('base', help="результат до изменения")
+    parser.add_argument('new', help="результат после изменения")
+    parser.add_argument('--metric', choices=('p50_ms', 'p95_ms', 'p99_ms'), default='p95_ms',
+                        help="по какому перцентилю искать замедления")
+    parser.add_argument('--threshold', type=float, default=1.2, help="допустимое замедление (во сколько раз)")
+    parser.add_argument('--min-count', type=int, default=20, help="виды с меньшим числом ответов не проверяются")
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    for label, run in (('до', base), ('после', new)):
+        meta = run['meta']
+        print(f"{label}: {meta['git_commit'] or '?'}{' (изменён)' if meta['git_dirty'] else ''}, "
+              f"{meta['updates']} обновлений, x{meta['speed']:g}, {meta['timestamp']}")
+    if base['meta']['recording'] != new['meta']['recording'] or base['meta']['updates'] != new['meta']['updates']:
+        print("⚠️  Воспроизведены разные записи, сравнение неточное")
+    if (base['meta']['speed'], base['meta']['seed']) != (new['meta']['speed'], new['meta']['seed']):
+        print("⚠️  Разные --speed или --seed, сравнение неточное")
+    print()
+
+    base_kinds = {kind['kind']: kind for kind in base['kinds']}
+    regressions = 0
+    print(f"{'вид':36} {'p50 до':>9} {'p50 после':>10} {'p95 до':>9} {'p95 после':>10} {'отношение':>10}")
+    for kind in new['kinds'] + [{'kind': 'всего', **new['overall'], 'unhandled': new['unhandled']}]:
+        old = base_kinds.get(kind['kind'])
+        if old is None and kind['kind'] == 'всего':
+            old = {**base['overall'], 'unhandled': base['unhandled']}
+        if old is None:
+            print(f"{kind['kind'][:36]:36} {'-':>9} {kind['p50_ms']:10.1f} {'-':>9} {kind['p95_ms']:10.1f} {'новый':>10}")
+            continue
+        ratio = kind[args.metric] / old[args.metric] if old[args.metric] else float('inf')
+        mark = ''
+        checked = min(kind['count'], old['count']) >= args.min_count
+        if checked and (ratio > args.threshold or kind['unhandled'] > old['unhandled']):
+            mark = '  ❌'
+            regressions += 1
+        elif checked and ratio < 1 / args.threshold:
+            mark = '  ✅'
+        print(f"{kind['kind'][:36]:36} {old['p50_ms']:9.1f} {kind['p50_ms']:10.1f} {old['p95_ms']:9.1f} "
+              f"{kind['p95_ms']:10.1f} {ratio:10.2f}{mark}")
+
+    print(f"\nПропускная способность: {base['updates_per_second']} -> {new['updates_per_second']} обновлений/с")
+    if regressions:
+        print(f"Замедлилось видов обновлений: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""
+Локальный поддельный Bot API (и API ЮKassa) для нагрузочного тестирования
+
+Сервер работает в отдельном потоке со своим event loop: бот вызывает
+ЮKassa синхронно (requests) из своего event loop, и сервер в том же
+loop не смог бы ответить.
+
+- getUpdates отдаёт обновления, добавленные через push_update (long polling);
+- sendMessage, sendPhoto, edit* и остальные методы возвращают правдоподобные
+  объекты Message, а каждый вызов с chat_id передаётся в on_send(record);
+- getFile и скачивание файла отдают сгенерированный JPEG;
+- /yookassa/v3/payments создаёт платёж, который при проверке уже оплачен.
+
+Задержка ответа (latency + случайная добавка до jitter) и ошибки
+(error_rate - ответ 500, flood_rate - 429 с retry_after) вносятся во все
+методы, кроме служебных (getUpdates, getMe и т.п.).
+"""
+import asyncio
+import email.parser
+import email.policy
+import io
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, quote
+
+from PIL import Image
+
+import httpserver
+
+logger = logging.getLogger(__name__)
+
+# Методы, в которые не вносятся задержки и ошибки
+SERVICE_METHODS = {'getUpdates', 'getMe', 'deleteWebhook', 'setWebhook', 'getWebhookInfo',
+                   'setMyCommands', 'getFile', 'close', 'logOut'}
+
+
+def _decode_value(value: str):
+    # python-telegram-bot передаёт словари и списки (reply_markup, media) строкой JSON
+    if value[:1] in ('{', '['):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_params(request: httpserver.Request) -> dict:
+    """Параметры метода из тела запроса (form-urlencoded, multipart или JSON)"""
+    content_type = request.headers.get('content-type', '')
+    if not request.body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(request.body)
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + request.body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            if part.get_filename() is not None:
+                params[name] = payload
+            else:
+                params[name] = _decode_value(payload.decode('utf-8'))
+        return params
+    return {key: _decode_value(values[-1]) for key, values in parse_qs(request.body.decode('utf-8')).items()}
+
+
+def _sample_jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (960, 1280), (180, 120, 140)).save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+class FakeBotAPI:
+    """Поддельный Bot API на httpserver.HTTPServer в отдельном потоке"""
+
+    def __init__(self, token: str, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, flood_rate: float = 0.0, seed: int = None):
+        self.token = token
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        # Вызывается в потоке сервера для каждого метода с chat_id: {'method', 'params', 'result'}
+        self.on_send = None
+
+        self.bot_user = {'id': int(token.split(':')[0]), 'is_bot': True, 'first_name': 'LoadTest',
+                         'username': 'loadtest_bot', 'can_join_groups': False,
+                         'can_read_all_group_messages': False, 'supports_inline_queries': False}
+        self.calls = {}  # метод -> число вызовов
+        self.injected_errors = {'500': 0, '429': 0}
+        self._rng = random.Random(seed)
+        self._updates = deque()
+        self._update_ids = itertools.count(1)
+        self._message_ids = {}
+        self._file_ids = itertools.count(1)
+        self._payments = {}
+        self._jpeg = _sample_jpeg()
+
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._has_updates = None
+        self._ready = threading.Event()
+        self._stopped = None
+
+    # ========== Адреса для бота ==========
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}/bot'
+
+    @property
+    def base_file_url(self) -> str:
+        return f'http://{self.host}:{self.port}/file/bot'
+
+    @property
+    def yookassa_url(self) -> str:
+        return f'http://{self.host}:{self.port}/yookassa/v3'
+
+    # ========== Запуск ==========
+
+    def start(self):
+        """Запустить сервер в отдельном потоке и дождаться готовности"""
+        self._thread = threading.Thread(target=self._run, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+        self._loop.close()
+
+    async def _serve(self):
+        self._has_updates = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._server = httpserver.HTTPServer(self.host, self.port)
+        self._server.route_prefix(f'/bot{self.token}/', self._handle_method)
+        self._server.route_prefix(f'/file/bot{self.token}/', self._handle_file)
+        # python-telegram-bot экранирует путь файла вместе с токеном (':' -> '%3A')
+        self._server.route_prefix(f'/file/bot{quote(self.token)}/', self._handle_file)
+        self._server.route('/yookassa/v3/payments', self._handle_payment_create)
+        self._server.route_prefix('/yookassa/v3/payments/', self._handle_payment_get)
+        await self._server.start()
+        self.port = self._server.port
+        self._ready.set()
+        await self._stopped.wait()
+        await self._server.stop()
+        # Даём обработчикам закрытых соединений завершиться
+        await asyncio.sleep(0.1)
+
+    # ========== Обновления ==========
+
+    def push_update(self, update: dict) -> int:
+        """Добавить обновление в очередь getUpdates (можно вызывать из любого потока)"""
+        update_id = next(self._update_ids)
+        update = {'update_id': update_id, **update}
+        self._loop.call_soon_threadsafe(self._add_update, update)
+        return update_id
+
+    def _add_update(self, update: dict):
+        self._updates.append(update)
+        self._has_updates.set()
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._updates, limit))
+
+    # ========== Bot API ==========
+
+    def _message(self, chat_id: int, params: dict, message_id: int = None) -> dict:
+        if message_id is None:
+            message_id = self._message_ids[chat_id] = self._message_ids.get(chat_id, 0) + 1
+        message = {
+            'message_id': int(message_id),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': self.bot_user,
+        }
+        for key in ('text', 'caption'):
+            if key in params:
+                message[key] = str(params[key])
+        markup = params.get('reply_markup')
+        # В Message может быть только inline-клавиатура
+        if isinstance(markup, dict) and 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+        return message
+
+    def _photo_sizes(self, photo) -> list:
+        if isinstance(photo, str) and not photo.startswith('attach://'):
+            file_id = photo
+        else:
+            file_id = f'photo-{next(self._file_ids)}'
+        return [{'file_id': file_id, 'file_unique_id': f'u{file_id}', 'width': 960, 'height': 1280,
+                 'file_size': len(self._jpeg)}]
+
+    def _result(self, method: str, params: dict):
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+
+        if method == 'getMe':
+            return self.bot_user
+        if method == 'getFile':
+            return {'file_id': params['file_id'], 'file_unique_id': f"u{params['file_id']}",
+                    'file_size': len(self._jpeg), 'file_path': f"photos/{params['file_id']}.jpg"}
+        if chat_id is None:
+            return True
+        if method in ('sendMessage', 'forwardMessage', 'sendVideo', 'sendDocument'):
+            return self._message(chat_id, params)
+        if method == 'sendPhoto':
+            return {**self._message(chat_id, params), 'photo': self._photo_sizes(params.get('photo'))}
+        if method == 'sendMediaGroup':
+            messages = []
+            for item in params.get('media') or []:
+                message = self._message(chat_id, item)
+                if item.get('type') == 'photo':
+                    message['photo'] = self._photo_sizes(item.get('media'))
+                messages.append(message)
+            return messages
+        if method == 'copyMessage':
+            return {'message_id': self._message(chat_id, params)['message_id']}
+        if method in ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'):
+            return self._message(chat_id, params, message_id=params.get('message_id'))
+        return True
+
+    def _injected_error(self):
+        roll = self._rng.random()
+        if roll < self.flood_rate:
+            self.injected_errors['429'] += 1
+            return httpserver.Response(429, json.dumps({
+                'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1},
+            }), content_type='application/json')
+        if roll < self.flood_rate + self.error_rate:
+            self.injected_errors['500'] += 1
+            return httpserver.Response(500, json.dumps({
+                'ok': False, 'error_code': 500, 'description': 'Internal Server Error: injected',
+            }), content_type='application/json')
+        return None
+
+    async def _handle_method(self, request: httpserver.Request) -> httpserver.Response:
+        method = request.path.rsplit('/', 1)[-1]
+        params = parse_params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == 'getUpdates':
+            result = await self._get_updates(params)
+        else:
+            if method not in SERVICE_METHODS:
+                if self.latency or self.jitter:
+                    await asyncio.sleep(self.latency + self._rng.random() * self.jitter)
+                error = self._injected_error()
+                if error is not None:
+                    return error
+            result = self._result(method, params)
+            if 'chat_id' in params and self.on_send is not None:
+                self.on_send({'method': method, 'params': params, 'result': result})
+
+        return httpserver.Response(200, json.dumps({'ok': True, 'result': result}, ensure_ascii=False),
+                                   content_type='application/json')
+
+    async def _handle_file(self, request: httpserver.Request) -> httpserver.Response:
+        return httpserver.Response(200, self._jpeg, content_type='image/jpeg')
+
+    # ========== ЮKassa ==========
+
+    async def _handle_payment_create(self, request: httpserver.Request) -> httpserver.Response:
+        body = json.loads(request.body or b'{}')
+        payment_id = str(uuid.uuid4())
+        self._payments[payment_id] = {
+            'id': payment_id,
+            'status': 'pending',
+            'paid': False,
+            'amount': body.get('amount', {'value': '0.00', 'currency': 'RUB'}),
+            'confirmation': {'type': 'redirect',
+                             'confirmation_url': f'https://yoomoney.ru/checkout/payments/v2/contract?orderId={payment_id}'},
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'description': body.get('description', ''),
+            'metadata': {key: str(value) for key, value in (body.get('metadata') or {}).items()},
+            'recipient': {'account_id': 'loadtest', 'gateway_id': 'loadtest'},
+            'refundable': False,
+            'test': True,
+        }
+        return httpserver.Response(200, json.dumps(self._payments[payment_id]), content_type='application/json')
+
+    async def _handle_payment_get(self, request: httpserver.Request) -> httpserver.Response:
+        payment = self._payments.get(request.path.rsplit('/', 1)[-1])
+        if payment is None:
+            return httpserver.Response(404, json.dumps({'type': 'error', 'code': 'not_found'}),
+                                       content_type='application/json')
+        # Пользователь «оплатил» сразу после создания платежа
+        payment.update(status='succeeded', paid=True)
+        return httpserver.Response(200, json.dumps(payment), content_type='application/json')
@@ -0,0 +1,414 @@
+"""
+Воспроизведение записанных обновлений (recorder.py) через настоящий Application
+
+Обновления из файлов updates-*.jsonl.gz (можно от нескольких воркеров -
+они сливаются по времени получения) отправляются в поддельный Bot API с
+теми же промежутками, что и в проде (--speed 1), в N раз быстрее
+(--speed N) или без пауз (--speed 0, проверка пропускной способности).
+Задержка обновления - время от отправки в поддельный API до конца
+последней группы обработчиков бота (очередь перед обработкой входит в
+неё); не обработанные за --drain-timeout сек после отправки всех
+обновлений считаются отдельно. В конце печатаются p50/p95/p99 по видам
+обновлений (команда, кнопка меню, текст, фото, callback по префиксу
+данных), а с --output результат пишется в JSON для сравнения двух
+сборок:
+
+    python -m loadtest.replay recordings/updates-*.jsonl.gz --speed 10 --output before.json
+    (переключиться на новую сборку)
+    python -m loadtest.replay recordings/updates-*.jsonl.gz --speed 10 --output after.json
+    python -m loadtest.compare before.json after.json
+
+Бот запускается на временной БД (или пустой --database-url), в которую
+перед воспроизведением заводятся (ReplaySeeder):
+- пользователи из строк "user" записи - с теми же id в БД, полом и
+  подпиской, а вместо telegram_id псевдоним из записи; кто
+  зарегистрировался во время записи, проходит регистрацию и здесь;
+- анкеты и симпатии, на которые ссылаются callback_data (like_<id>,
+  view_like_<id>, start_chat_<id>, open_chat_<id>, view_partner_<id>);
+- --profiles синтетических анкет, чтобы лента не кончалась.
+Так обновления доходят до тех же обработчиков ленты, симпатий и чатов,
+что и в проде. Не восстанавливаются состояния, начатые до записи
+(например, открытый чат), переписка и просмотренные анкеты.
+Данные и задержки поддельного API зависят только от --seed, так что
+прогоны разных сборок на одной записи сравнимы.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.ext import ContextTypes, TypeHandler
+
+from benchmarks.seed import CITIES, FEMALE_NAMES, FEMALE_SHARE, MALE_NAMES
+from loadtest.fake_api import FakeBotAPI, _sample_jpeg
+from loadtest.simulator import TOKEN, Stats, start_bot, stop_bot
+
+# Начало id записи в callback_data: like_15 -> like, check_payment_2ca7... -> check_payment
+_CALLBACK_IDS = re.compile(r'_[^_]*\d')
+# Текст после очистки состоит из "x"; другие буквы остаются только в кнопках меню
+_KEPT_LETTERS = re.compile(r'[^\W\dx_]')
+_MEDIA = ('photo', 'video', 'document', 'voice', 'video_note', 'sticker', 'animation')
+# callback_data со ссылкой на пользователя или симпатию в БД
+_REFERENCE = re.compile(r'^(like|dislike|view_like|start_chat|open_chat|view_partner)_(\d+)')
+
+# Фото всех заведённых анкет
+PHOTO_KEY = 'replay/profile.jpg'
+# telegram_id анкет, которых нет в записи (псевдонимы начинаются с 1 000 000 000)
+PLACEHOLDER_TELEGRAM_ID = 100_000_000
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def load_recording(paths: list):
+    """
+    Обновления из файлов в порядке получения и данные пользователей
+
+    Returns:
+        (записи {'ts', 'update'}, {псевдоним: данные пользователя})
+    """
+    entries = []
+    users = {}
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная последняя строка (бот остановлен аварийно)
+                    continue
+                if 'user' in record:
+                    users[record['user']['id']] = record['user']
+                else:
+                    entries.append(record)
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries, users
+
+
+def sender_of(update: dict):
+    """telegram_id автора обновления"""
+    for value in update.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+    return None
+
+
+class ReplaySeeder:
+    """Пользователи, подписки и симпатии, без которых обновления записи не дойдут до своих обработчиков"""
+
+    def __init__(self, entries: list, users: dict, profiles: int, seed: int):
+        self.rng = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+        self.users = {}  # id в БД -> [telegram_id или None, пол, есть подписка]
+        self.likes = {}  # id -> [от кого, кому, начат чат]
+        self._chats = set()
+
+        first_seen = {}
+        for entry in entries:
+            first_seen.setdefault(sender_of(entry['update']), entry['ts'])
+        by_telegram_id = {}
+        for pseudonym, user in users.items():
+            # Зарегистрировавшиеся во время записи проходят регистрацию и при воспроизведении
+            if (user['registered_at'] or 0) < first_seen.get(pseudonym, float('inf')):
+                self.users[user['user_id']] = [pseudonym, user['gender'], user['subscribed']]
+                by_telegram_id[pseudonym] = user['user_id']
+
+        references = []
+        for entry in entries:
+            query = entry['update'].get('callback_query')
+            presser = by_telegram_id.get(query['from']['id']) if query else None
+            match = _REFERENCE.match(query.get('data') or '') if presser else None
+            if match:
+                references.append((presser, match.group(1), int(match.group(2))))
+
+        # Новые анкеты и симпатии получают id после всех, на которые есть ссылки
+        self._next_user_id = max([0, *self.users, *(number for _, kind, number in references
+                                                    if kind not in ('view_like', 'start_chat'))]) + 1
+        self._next_like_id = max([0, *(number for _, kind, number in references
+                                       if kind in ('view_like', 'start_chat'))]) + 1
+        for _ in range(profiles):
+            self._add_user('female' if self.rng.random() < FEMALE_SHARE else 'male')
+        for presser, kind, number in references:
+            self._reference(presser, kind, number)
+
+    def _add_user(self, gender: str, user_id: int = None) -> int:
+        if user_id is None:
+            user_id = self._next_user_id
+            self._next_user_id += 1
+        self.users.setdefault(user_id, [None, gender, False])
+        return user_id
+
+    def _random_user(self, gender: str) -> int:
+        candidates = [user_id for user_id, (_, user_gender, _) in self.users.items() if user_gender == gender]
+        return self.rng.choice(candidates) if candidates else self._add_user(gender)
+
+    def _add_like(self, from_user_id: int, to_user_id: int, chat_started: bool, like_id: int = None):
+        if like_id is None:
+            like_id = self._next_like_id
+            self._next_like_id += 1
+        self.likes.setdefault(like_id, [from_user_id, to_user_id, chat_started])
+
+    def _reference(self, presser: int, kind: str, number: int):
+        gender = self.users[presser][1]
+        if kind in ('like', 'dislike'):
+            # Мужчина оценивает анкету из ленты
+            self._add_user('female', number)
+        elif kind in ('view_like', 'start_chat'):
+            # Девушка открывает симпатию к себе
+            if number not in self.likes:
+                self._add_like(self._random_user('male'), presser, False, number)
+        else:
+            # Чат с собеседником: нужна симпатия с начатым чатом
+            partner_gender = 'female' if gender == 'male' else 'male'
+            partner = self._add_user(partner_gender, number)
+            pair = (presser, partner) if gender == 'male' else (partner, presser)
+            if pair not in self._chats:
+                self._chats.add(pair)
+                self._add_like(*pair, True)
+
+    def _user_rows(self):
+        registered = self.now - timedelta(days=30)
+        for user_id, (telegram_id, gender, _) in sorted(self.users.items()):
+            female = gender == 'female'
+            yield {
+                'id': user_id,
+                'telegram_id': telegram_id or PLACEHOLDER_TELEGRAM_ID + user_id,
+                'name': self.rng.choice(FEMALE_NAMES if female else MALE_NAMES),
+                'gender': gender,
+                'age': self.rng.randint(18, 50),
+                'city': self.rng.choice(CITIES),
+                'description': 'Анкета для воспроизведения нагрузки',
+                'photo_path': PHOTO_KEY,
+                'hashtag': f'#R{user_id:07d}' if female else None,
+                'registered_at': registered,
+                'is_active': True,
+                'last_seen_at': self.now,
+            }
+
+    def run(self, db):
+        """Записать всё в БД бота"""
+        subscriptions = [
+            {'user_id': user_id, 'subscription_type': 'monthly', 'started_at': self.now - timedelta(days=1),
+             'expires_at': self.now + timedelta(days=30), 'is_active': True}
+            for user_id, (_, _, subscribed) in self.users.items() if subscribed
+        ]
+        likes = [
+            {'id': like_id, 'from_user_id': from_user_id, 'to_user_id': to_user_id,
+             'created_at': self.now - timedelta(days=1), 'is_viewed': chat_started, 'chat_started': chat_started}
+            for like_id, (from_user_id, to_user_id, chat_started) in sorted(self.likes.items())
+        ]
+        with db.engine.begin() as conn:
+            conn.execute(db.User.__table__.insert(), list(self._user_rows()))
+            if subscriptions:
+                conn.execute(db.Subscription.__table__.insert(), subscriptions)
+            if likes:
+                conn.execute(db.Like.__table__.insert(), likes)
+            if db.engine.dialect.name == 'postgresql':
+                # id задавались явно - сдвигаем последовательности за максимальный id
+                for table in ('users', 'likes'):
+                    conn.exec_driver_sql(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                        f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"
+                    )
+        db.recount_unviewed_likes()
+        recorded = sum(1 for telegram_id, _, _ in self.users.values() if telegram_id)
+        print(f"Заведено в БД: пользователей из записи {recorded}, других анкет {len(self.users) - recorded}, "
+              f"симпатий {len(likes)}")
+
+
+def kind_of(update: dict) -> str:
+    """Вид обновления для разбивки задержек"""
+    if 'callback_query' in update:
+        data = update['callback_query'].get('data') or ''
+        return f"callback:{_CALLBACK_IDS.split(data, 1)[0] or '?'}"
+    message = update.get('message')
+    if message is None:
+        return next((key for key in update if key != 'update_id'), 'unknown')
+    text = message.get('text')
+    if text is not None:
+        if text.startswith('/'):
+            return f"command:{text.split()[0].split('@')[0]}"
+        if _KEPT_LETTERS.search(text):
+            return f"button:{text}"
+        return 'text'
+    return next((key for key in _MEDIA if key in message), 'message')
+
+
+class LatencyTracker:
+    """Задержки обработки: отправка в поддельный API -> конец последней группы обработчиков"""
+
+    # Группа обработчика-отметки: после всех обработчиков бота
+    GROUP = 1000
+
+    def __init__(self):
+        self.latencies = {}  # вид -> [мс]
+        self.unhandled = {}  # вид -> число необработанных обновлений
+        self._waiting = {}  # update_id -> (вид, время отправки)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def pushed(self, update_id: int, kind: str):
+        self._waiting[update_id] = (kind, time.monotonic())
+
+    async def handled(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        entry = self._waiting.pop(update.update_id, None)
+        if entry is not None:
+            kind, pushed_at = entry
+            self.latencies.setdefault(kind, []).append((time.monotonic() - pushed_at) * 1000)
+
+    def finish(self):
+        """Обновления, которые бот так и не обработал"""
+        for kind, _ in self._waiting.values():
+            self.unhandled[kind] = self.unhandled.get(kind, 0) + 1
+        self._waiting.clear()
+
+
+async def replay(entries: list, fake: FakeBotAPI, tracker: LatencyTracker, speed: float) -> float:
+    """Отправить обновления с исходными промежутками (делёнными на speed); вернуть время отправки, сек"""
+    started = time.monotonic()
+    first_ts = entries[0]['ts']
+    for entry in entries:
+        if speed > 0:
+            delay = (entry['ts'] - first_ts) / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = dict(entry['update'])
+        # Поддельный API нумерует обновления сам
+        update.pop('update_id', None)
+        tracker.pushed(fake.push_update(update), kind_of(update))
+    return time.monotonic() - started
+
+
+def report(tracker: LatencyTracker, updates: int, seconds: float, fake: FakeBotAPI) -> dict:
+    print("\nЗадержки обработки по видам обновлений, мс:")
+    print(f"  {'вид':36} {'кол-во':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'не обработано':>14}")
+    kinds = []
+    for kind in sorted(set(tracker.latencies) | set(tracker.unhandled),
+                       key=lambda kind: -len(tracker.latencies.get(kind, []))):
+        summary = Stats.summary(tracker.latencies.get(kind, []))
+        unhandled = tracker.unhandled.get(kind, 0)
+        kinds.append({'kind': kind, 'unhandled': unhandled, **summary})
+        print(f"  {kind[:36]:36} {summary['count']:7} {summary['p50_ms']:9.1f} {summary['p95_ms']:9.1f} "
+              f"{summary['p99_ms']:9.1f} {summary['max_ms']:9.1f} {unhandled:14}")
+
+    overall = Stats.summary([value for values in tracker.latencies.values() for value in values])
+    print(f"\nВсего: {updates} обновлений за {seconds:.1f} с ({updates / seconds if seconds else 0:.1f}/с), "
+          f"p50 {overall['p50_ms']} мс, p95 {overall['p95_ms']} мс, p99 {overall['p99_ms']} мс, "
+          f"не обработано {sum(tracker.unhandled.values())}")
+    print(f"Вызовы Bot API: {sum(fake.calls.values())}")
+    return {'kinds': kinds, 'overall': overall, 'unhandled': sum(tracker.unhandled.values()),
+            'seconds': round(seconds, 3), 'updates_per_second': round(updates / seconds, 1) if seconds else 0.0,
+            'api_calls': fake.calls}
+
+
+async def seed_database(entries: list, users: dict, profiles: int, seed: int):
+    """Завести в пустую БД бота пользователей записи и фото анкет"""
+    import database as db
+    import storage
+
+    session = db.get_session()
+    try:
+        empty = session.query(db.User.id).first() is None
+    finally:
+        session.close()
+    if not empty:
+        print("⚠️  В БД уже есть пользователи - данные для воспроизведения не заводятся")
+        return
+    await asyncio.to_thread(ReplaySeeder(entries, users, profiles, seed).run, db)
+    await storage.backend.put(PHOTO_KEY, _sample_jpeg())
+
+
+async def main_async(args):
+    entries, users = load_recording(args.recording)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print("В записи нет обновлений")
+        return
+    print(f"Обновлений: {len(entries)}, записано за {entries[-1]['ts'] - entries[0]['ts']:.1f} с, "
+          f"скорость воспроизведения: {'без пауз' if args.speed <= 0 else f'x{args.speed:g}'}")
+
+    workdir = tempfile.mkdtemp(prefix='replay-')
+    fake = FakeBotAPI(TOKEN, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, seed=args.seed)
+    fake.start()
+    tracker = LatencyTracker()
+
+    application = await start_bot(fake, workdir, args.database_url, args.log_level)
+    try:
+        await seed_database(entries, users, args.profiles, args.seed)
+    except BaseException:
+        await stop_bot(application, fake)
+        raise
+    application.add_handler(TypeHandler(Update, tracker.handled), group=LatencyTracker.GROUP)
+    started = time.monotonic()
+    try:
+        await replay(entries, fake, tracker, args.speed)
+        # Ждём обработки последних обновлений
+        deadline = time.monotonic() + args.drain_timeout
+        while tracker.waiting and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        seconds = time.monotonic() - started
+        tracker.finish()
+    finally:
+        await stop_bot(application, fake)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = report(tracker, len(entries), seconds, fake)
+    summary['meta'] = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _git('rev-parse', '--short', 'HEAD'),
+        'git_dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'recording': sorted(args.recording),
+        'updates': len(entries),
+        'speed': args.speed,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'seed': args.seed,
+        'profiles': args.profiles,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"Результат: {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизвести записанные обновления через поддельный Bot API")
+    parser.add_argument('recording', nargs='+', help="файлы updates-*.jsonl.gz (recorder.py)")
+    parser.add_argument('--speed', type=float, default=1.0, help="ускорение относительно записи (0 - без пауз)")
+    parser.add_argument('--limit', type=int, help="воспроизвести только первые N обновлений")
+    parser.add_argument('--drain-timeout', type=float, default=60,
+                        help="сколько ждать обработки оставшихся обновлений после отправки всех, сек")
+    parser.add_argument('--latency-ms', type=float, default=30, help="задержка ответа Bot API")
+    parser.add_argument('--jitter-ms', type=float, default=20, help="случайная добавка к задержке")
+    parser.add_argument('--database-url', help="пустая БД бота (по умолчанию временная SQLite)")
+    parser.add_argument('--profiles', type=int, default=200, help="синтетических анкет в ленте")
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="записать результат в JSON (для loadtest.compare)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,514 @@
+"""
+Симулятор пользователей: прогоняет настоящий Application из bot.py через поддельный Bot API
+
+Виртуальные мужчины и женщины проходят сценарии так же, как живые люди:
+регистрация (с загрузкой фото), оплата подписки, просмотр анкет с
+лайками, ответ на симпатии и переписка. Для каждого шага измеряется время
+от отправки обновления до ответа бота (для сообщений в чате - до доставки
+собеседнику), в конце печатаются p50/p95/p99 по шагам и сценариям и
+пропускная способность по фазам. С --ramp просмотр анкет повторяется
+при растущем числе одновременных пользователей, чтобы найти потолок
+обновлений в секунду.
+
+    python -m loadtest.simulator --men 2000 --women 1000 --concurrency 200 --latency-ms 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+from loadtest.fake_api import FakeBotAPI
+
+TOKEN = '123456:LOADTEST'
+MEN_ID_BASE = 2_000_000_000
+WOMEN_ID_BASE = 3_000_000_000
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск']
+TOKEN_PATTERN = re.compile(r'lt[0-9a-f]{12}')
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def has_button(record, prefix: str) -> bool:
+    return button_data(record, prefix) is not None
+
+
+def button_data(record, prefix: str):
+    markup = record['params'].get('reply_markup')
+    if not isinstance(markup, dict):
+        return None
+    for row in markup.get('inline_keyboard', []):
+        for button in row:
+            data = button.get('callback_data')
+            if data and data.startswith(prefix):
+                return data
+    return None
+
+
+def text_of(record) -> str:
+    params = record['params']
+    media = params.get('media') if isinstance(params.get('media'), list) else None
+    return str(params.get('text') or params.get('caption') or (media and media[0].get('caption')) or '')
+
+
+class StepTimeout(Exception):
+    pass
+
+
+class Stats:
+    """Задержки по (сценарий, шаг) и по сценариям целиком"""
+
+    def __init__(self):
+        self.steps = {}
+        self.flows = {}
+        self.timeouts = {}
+        self.updates = 0
+
+    def add_step(self, flow: str, step: str, seconds: float):
+        self.steps.setdefault((flow, step), []).append(seconds * 1000)
+
+    def add_flow(self, flow: str, seconds: float):
+        self.flows.setdefault(flow, []).append(seconds * 1000)
+
+    def add_timeout(self, flow: str, step: str):
+        self.timeouts[(flow, step)] = self.timeouts.get((flow, step), 0) + 1
+
+    @staticmethod
+    def summary(values: list) -> dict:
+        return {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 0.50), 1),
+            'p95_ms': round(percentile(values, 0.95), 1),
+            'p99_ms': round(percentile(values, 0.99), 1),
+            'max_ms': round(max(values), 1) if values else 0.0,
+        }
+
+
+class VirtualUser:
+    """Пользователь Telegram: отправляет обновления и получает сообщения бота"""
+
+    def __init__(self, sim, telegram_id: int, gender: str, index: int):
+        self.sim = sim
+        self.telegram_id = telegram_id
+        self.gender = gender
+        self.name = f"{'Иван' if gender == 'male' else 'Анна'}{index}"
+        self.inbox = []
+        self.registered = False
+        self.subscribed = False
+        self._message_ids = 0
+        self._event = asyncio.Event()
+
+    def deliver(self, record: dict):
+        self.inbox.append(record)
+        self._event.set()
+
+    async def wait_for(self, predicate, since: int, timeout: float) -> dict:
+        """Первое сообщение бота с номером >= since, для которого predicate(record) истинно"""
+        deadline = time.perf_counter() + timeout
+        position = since
+        while True:
+            while position < len(self.inbox):
+                record = self.inbox[position]
+                position += 1
+                if predicate(record):
+                    return record
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise StepTimeout
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    # ========== Обновления от пользователя ==========
+
+    def _user(self) -> dict:
+        return {'id': self.telegram_id, 'is_bot': False, 'first_name': self.name,
+                'username': f'vu{self.telegram_id}', 'language_code': 'ru'}
+
+    def _message(self, **fields) -> dict:
+        self._message_ids += 1
+        return {'message_id': self._message_ids, 'date': int(time.time()), 'from': self._user(),
+                'chat': {'id': self.telegram_id, 'type': 'private', 'first_name': self.name}, **fields}
+
+    def text(self, text: str) -> dict:
+        fields = {'text': text}
+        if text.startswith('/'):
+            fields['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'message': self._message(**fields)}
+
+    def photo(self) -> dict:
+        file_id = f'upload-{self.telegram_id}'
+        return {'message': self._message(photo=[
+            {'file_id': file_id, 'file_unique_id': f'u{file_id}', 'width': 960, 'height': 1280, 'file_size': 50000}
+        ])}
+
+    def album(self, count: int, caption: str) -> list:
+        """Альбом: count фото с общим media_group_id, подпись у первого"""
+        group = uuid.uuid4().hex[:16]
+        updates = []
+        for index in range(count):
+            update = self.photo()
+            update['message']['media_group_id'] = group
+            if index == 0:
+                update['message']['caption'] = caption
+            updates.append(update)
+        return updates
+
+    def callback(self, record: dict, data: str) -> dict:
+        return {'callback_query': {'id': uuid.uuid4().hex, 'from': self._user(),
+                                   'chat_instance': str(self.telegram_id), 'data': data,
+                                   'message': record['result']}}
+
+    # ========== Шаги ==========
+
+    async def step(self, flow: str, step: str, update: dict, predicate) -> dict:
+        """Отправить обновление и дождаться ответа бота, записать задержку"""
+        since = len(self.inbox)
+        started = time.perf_counter()
+        self.sim.push(update)
+        try:
+            record = await self.wait_for(predicate, since, self.sim.step_timeout)
+        except StepTimeout:
+            self.sim.stats.add_timeout(flow, step)
+            raise
+        self.sim.stats.add_step(flow, step, time.perf_counter() - started)
+        return record
+
+
+class Simulator:
+    def __init__(self, args, fake: FakeBotAPI):
+        self.args = args
+        self.fake = fake
+        self.step_timeout = args.step_timeout
+        self.stats = Stats()
+        self.rng = random.Random(args.seed)
+        self.loop = asyncio.get_running_loop()
+        self.men = [VirtualUser(self, MEN_ID_BASE + i, 'male', i) for i in range(args.men)]
+        self.women = [VirtualUser(self, WOMEN_ID_BASE + i, 'female', i) for i in range(args.women)]
+        self.users = {user.telegram_id: user for user in self.men + self.women}
+        self._relay_waiters = {}
+        fake.on_send = lambda record: self.loop.call_soon_threadsafe(self._deliver, record)
+
+    def push(self, update: dict):
+        self.stats.updates += 1
+        self.fake.push_update(update)
+
+    def _deliver(self, record: dict):
+        user = self.users.get(int(record['params']['chat_id']))
+        if user is not None:
+            user.deliver(record)
+        for token in TOKEN_PATTERN.findall(text_of(record)):
+            waiter = self._relay_waiters.pop(token, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(record)
+
+    # ========== Сценарии ==========
+
+    async def register(self, user: VirtualUser):
+        started = time.perf_counter()
+        record = await user.step('registration', 'start', user.text('/start'), lambda r: has_button(r, 'gender_'))
+        await user.step('registration', 'gender', user.callback(record, f'gender_{user.gender}'),
+                        lambda r: 'как вас зовут' in text_of(r).lower())
+        await user.step('registration', 'name', user.text(user.name), lambda r: 'сколько вам лет' in text_of(r).lower())
+        await user.step('registration', 'age', user.text(str(20 + user.telegram_id % 25)),
+                        lambda r: 'город' in text_of(r))
+        await user.step('registration', 'city', user.text(CITIES[user.telegram_id % len(CITIES)]),
+                        lambda r: 'описание' in text_of(r))
+        await user.step('registration', 'description', user.text('Люблю путешествия и кино'),
+                        lambda r: 'фото' in text_of(r))
+        await user.step('registration', 'photo', user.photo(), lambda r: 'Регистрация завершена' in text_of(r))
+        user.registered = True
+        self.stats.add_flow('registration', time.perf_counter() - started)
+
+    async def pay(self, user: VirtualUser):
+        started = time.perf_counter()
+        record = await user.step('payment', 'menu', user.text('💎 Подписка'),
+                                 lambda r: has_button(r, 'pay_'))
+        record = await user.step('payment', 'create', user.callback(record, button_data(record, 'pay_')),
+                                 lambda r: has_button(r, 'check_payment_'))
+        await user.step('payment', 'confirm', user.callback(record, button_data(record, 'check_payment_')),
+                        lambda r: 'Оплата прошла успешно' in text_of(r))
+        user.subscribed = True
+        self.stats.add_flow('payment', time.perf_counter() - started)
+
+    async def browse(self, user: VirtualUser, count: int, flow: str = 'browse'):
+        started = time.perf_counter()
+        for _ in range(count):
+            record = await user.step(flow, 'next_profile', user.text('🔍 Смотреть анкеты'),
+                                     lambda r: has_button(r, 'like_') or 'нет доступных анкет' in text_of(r))
+            if not has_button(record, 'like_'):
+                break
+            like = self.rng.random() < self.args.like_rate
+            data = button_data(record, 'like_' if like else 'dislike_')
+            message_id = record['result']['message_id']
+            await user.step(flow, 'like' if like else 'dislike', user.callback(record, data),
+                            lambda r: r['method'] == 'editMessageCaption'
+                            and int(r['params'].get('message_id', 0)) == message_id)
+        self.stats.add_flow(flow, time.perf_counter() - started)
+
+    async def answer_likes(self, user: VirtualUser, limit: int):
+        started = time.perf_counter()
+        listing = await user.step('match', 'likes', user.text('❤️ Уведомления о симпатиях'),
+                                  lambda r: has_button(r, 'view_like_') or 'нет новых симпатий' in text_of(r))
+        answered = 0
+        while answered < limit and has_button(listing, 'view_like_'):
+            since = len(user.inbox)
+            list_id = listing['result']['message_id']
+            record = await user.step('match', 'view_like', user.callback(listing, button_data(listing, 'view_like_')),
+                                     lambda r: has_button(r, 'start_chat_'))
+            # Список симпатий обновляется на месте, уже без просмотренной
+            listing = await user.wait_for(lambda r: r['method'] == 'editMessageText'
+                                          and int(r['params'].get('message_id', 0)) == list_id,
+                                          since, self.step_timeout)
+            message_id = record['result']['message_id']
+            await user.step('match', 'start_chat', user.callback(record, button_data(record, 'start_chat_')),
+                            lambda r: r['method'] == 'editMessageCaption'
+                            and int(r['params'].get('message_id', 0)) == message_id)
+            answered += 1
+        if answered:
+            self.stats.add_flow('match', time.perf_counter() - started)
+
+    async def relay(self, user: VirtualUser, step: str, updates: list, token: str):
+        """Отправить обновления и дождаться, когда бот перешлёт token собеседнику"""
+        waiter = self.loop.create_future()
+        self._relay_waiters[token] = waiter
+        sent = time.perf_counter()
+        for update in updates:
+            self.push(update)
+        try:
+            await asyncio.wait_for(waiter, self.step_timeout)
+        except asyncio.TimeoutError:
+            self._relay_waiters.pop(token, None)
+            self.stats.add_timeout('chat', step)
+            raise StepTimeout
+        self.stats.add_step('chat', step, time.perf_counter() - sent)
+
+    async def chat(self, user: VirtualUser, messages: int, albums: int):
+        started = time.perf_counter()
+        record = await user.step('chat', 'list', user.text('💬 Мои чаты'),
+                                 lambda r: has_button(r, 'open_chat_') or 'нет активных чатов' in text_of(r))
+        if not has_button(record, 'open_chat_'):
+            return
+        await user.step('chat', 'open', user.callback(record, button_data(record, 'open_chat_')),
+                        lambda r: 'Чат открыт' in text_of(r))
+        # Сообщение считается доставленным, когда бот переслал его собеседнику
+        for _ in range(messages):
+            token = f'lt{uuid.uuid4().hex[:12]}'
+            await self.relay(user, 'relay', [user.text(f'Привет! {token}')], token)
+        for _ in range(albums):
+            token = f'lt{uuid.uuid4().hex[:12]}'
+            await self.relay(user, 'album', user.album(3, f'Альбом {token}'), token)
+        self.stats.add_flow('chat', time.perf_counter() - started)
+
+    # ========== Фазы ==========
+
+    async def phase(self, name: str, users: list, scenario, concurrency: int = None) -> dict:
+        """Прогнать сценарий для users, не больше concurrency пользователей одновременно"""
+        semaphore = asyncio.Semaphore(concurrency or self.args.concurrency)
+        failures = 0
+
+        async def run(user):
+            nonlocal failures
+            async with semaphore:
+                try:
+                    await scenario(user)
+                except StepTimeout:
+                    failures += 1
+
+        updates_before = self.stats.updates
+        calls_before = sum(self.fake.calls.values())
+        started = time.perf_counter()
+        await asyncio.gather(*(run(user) for user in users))
+        elapsed = time.perf_counter() - started
+        result = {
+            'phase': name,
+            'users': len(users),
+            'concurrency': concurrency or self.args.concurrency,
+            'seconds': round(elapsed, 2),
+            'updates': self.stats.updates - updates_before,
+            'updates_per_second': round((self.stats.updates - updates_before) / elapsed, 1) if elapsed else 0.0,
+            'api_calls_per_second': round((sum(self.fake.calls.values()) - calls_before) / elapsed, 1) if elapsed else 0.0,
+            'timed_out_users': failures,
+        }
+        print(f"  {name:14} {result['users']:6} польз. за {elapsed:7.1f} с: "
+              f"{result['updates_per_second']:8.1f} обновл./с, {result['api_calls_per_second']:8.1f} вызовов API/с"
+              + (f", не дождались ответа: {failures}" if failures else ""))
+        return result
+
+    async def run(self) -> dict:
+        args = self.args
+        phases = []
+        print("Фазы:")
+        # Сначала женщины - иначе мужчинам нечего смотреть
+        phases.append(await self.phase('register_women', self.women, self.register))
+        phases.append(await self.phase('register_men', self.men, self.register))
+        men = [user for user in self.men if user.registered]
+        women = [user for user in self.women if user.registered]
+
+        payers = men[:int(len(men) * args.pay_rate)]
+        phases.append(await self.phase('payment', payers, self.pay))
+        phases.append(await self.phase('browse', men, lambda user: self.browse(user, args.browse)))
+        # Уведомления о лайках идут через очередь исходящих - даём им дойти
+        await asyncio.sleep(2)
+        phases.append(await self.phase('match', women, lambda user: self.answer_likes(user, args.matches)))
+        await asyncio.sleep(2)
+        chatters = [user for user in men if user.subscribed]
+        phases.append(await self.phase('chat', chatters, lambda user: self.chat(user, args.messages, args.albums)))
+
+        ramp = []
+        if args.ramp:
+            print("Нарастание нагрузки (просмотр анкет):")
+            for level in args.ramp:
+                stats_before = len(self.stats.steps.get(('ramp', 'next_profile'), []))
+                result = await self.phase(f'ramp_{level}', men[:level],
+                                          lambda user: self.browse(user, args.ramp_steps, flow='ramp'), level)
+                latencies = self.stats.steps.get(('ramp', 'next_profile'), [])[stats_before:]
+                result['next_profile_p95_ms'] = round(percentile(latencies, 0.95), 1)
+                ramp.append(result)
+
+        return {'phases': phases, 'ramp': ramp}
+
+
+def report(stats: Stats, result: dict, fake: FakeBotAPI, slo_ms: float) -> dict:
+    print("\nЗадержки по шагам, мс:")
+    print(f"  {'сценарий':14} {'шаг':14} {'кол-во':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'таймаут':>8}")
+    steps = []
+    for (flow, step), values in sorted(stats.steps.items()):
+        summary = Stats.summary(values)
+        timeouts = stats.timeouts.get((flow, step), 0)
+        steps.append({'flow': flow, 'step': step, 'timeouts': timeouts, **summary})
+        print(f"  {flow:14} {step:14} {summary['count']:7} {summary['p50_ms']:9.1f} {summary['p95_ms']:9.1f} "
+              f"{summary['p99_ms']:9.1f} {summary['max_ms']:9.1f} {timeouts:8}")
+
+    print("\nСценарии целиком, мс:")
+    flows = []
+    for flow, values in sorted(stats.flows.items()):
+        summary = Stats.summary(values)
+        flows.append({'flow': flow, **summary})
+        print(f"  {flow:14} {summary['count']:7} p50 {summary['p50_ms']:9.1f}  p95 {summary['p95_ms']:9.1f}  "
+              f"p99 {summary['p99_ms']:9.1f}")
+
+    candidates = [phase for phase in result['ramp'] if phase['next_profile_p95_ms'] <= slo_ms] or result['ramp']
+    candidates = candidates or result['phases']
+    ceiling = max(candidates, key=lambda phase: phase['updates_per_second'])
+    print(f"\nПотолок: {ceiling['updates_per_second']} обновлений/с ({ceiling['phase']}, "
+          f"{ceiling['concurrency']} одновременных пользователей)")
+    print(f"Вызовы Bot API: {sum(fake.calls.values())}, внесено ошибок: {fake.injected_errors}")
+
+    return {'steps': steps, 'flows': flows, **result, 'ceiling': ceiling,
+            'api_calls': fake.calls, 'injected_errors': fake.injected_errors}
+
+
+async def start_bot(fake: FakeBotAPI, workdir: str, database_url: str = None, log_level: str = 'WARNING'):
+    """Запустить настоящий Application из bot.py с поддельным Bot API (БД, состояние и фото - в workdir)"""
+    # Настройки бота задаются до импорта bot/config
+    os.environ.update({
+        'BOT_TOKEN': TOKEN,
+        'DATABASE_URL': database_url or f'sqlite:///{workdir}/bot.db',
+        'STATE_DB_PATH': os.path.join(workdir, 'state.db'),
+        'RELAY_SPOOL_PATH': os.path.join(workdir, 'relay_spool.jsonl'),
+        'PHOTOS_DIR': os.path.join(workdir, 'photos'),
+        'PHOTO_STORAGE': 'local',
+        'LOG_FILE': os.path.join(workdir, 'bot.log'),
+        'LOG_LEVEL': log_level,
+        'METRICS_PORT': '0',
+        'RECORD_UPDATES_DIR': '',
+        'YOOKASSA_SHOP_ID': 'loadtest',
+        'YOOKASSA_SECRET_KEY': 'loadtest',
+    })
+    import bot
+    import database as db
+    from yookassa import Configuration
+    Configuration.configure('loadtest', 'loadtest', api_url=fake.yookassa_url)
+
+    db.init_db()
+    application = bot.build_application(base_url=fake.base_url, base_file_url=fake.base_file_url)
+    print(f"Поддельный Bot API: {fake.base_url}, рабочий каталог: {workdir}")
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+    return application
+
+
+async def stop_bot(application, fake: FakeBotAPI):
+    """Остановить бота так же, как run_polling, и поддельный Bot API"""
+    try:
+        await application.updater.stop()
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+    finally:
+        fake.stop()
+
+
+async def main_async(args):
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    fake = FakeBotAPI(TOKEN, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                      error_rate=args.error_rate, flood_rate=args.flood_rate, seed=args.seed)
+    fake.start()
+
+    application = await start_bot(fake, workdir, args.database_url, args.log_level)
+    try:
+        simulator = Simulator(args, fake)
+        result = await simulator.run()
+    finally:
+        await stop_bot(application, fake)
+
+    summary = report(simulator.stats, result, fake, args.slo_ms)
+    summary['settings'] = vars(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"Результат: {args.output}")
+    if args.keep_workdir:
+        print(f"База и логи бота: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с поддельным Bot API")
+    parser.add_argument('--men', type=int, default=200)
+    parser.add_argument('--women', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument('--browse', type=int, default=10, help="анкет просматривает каждый мужчина")
+    parser.add_argument('--like-rate', type=float, default=0.3, help="доля анкет, получающих лайк")
+    parser.add_argument('--pay-rate', type=float, default=0.5, help="доля мужчин, покупающих подписку")
+    parser.add_argument('--matches', type=int, default=3, help="на сколько симпатий отвечает каждая женщина")
+    parser.add_argument('--messages', type=int, default=5, help="сообщений в чате от каждого мужчины")
+    parser.add_argument('--albums', type=int, default=1, help="альбомов из 3 фото в чате от каждого мужчины")
+    parser.add_argument('--ramp', type=lambda value: [int(x) for x in value.split(',')],
+                        help="уровни одновременных пользователей для поиска потолка, например 50,100,200,400")
+    parser.add_argument('--ramp-steps', type=int, default=5, help="анкет на пользователя на каждом уровне")
+    parser.add_argument('--slo-ms', type=float, default=1000, help="допустимый p95 ответа при поиске потолка")
+    parser.add_argument('--latency-ms', type=float, default=30, help="задержка ответа Bot API")
+    parser.add_argument('--jitter-ms', type=float, default=20, help="случайная добавка к задержке")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="доля ответов 429 (flood control)")
+    parser.add_argument('--step-timeout', type=float, default=30, help="сколько ждать ответа бота, сек")
+    parser.add_argument('--database-url', help="БД бота (по умолчанию временная SQLite)")
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="записать результат в JSON")
+    parser.add_argument('--keep-workdir', action='store_true', help="не удалять базу и логи бота")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
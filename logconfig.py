@@ -0,0 +1,138 @@
+"""
+Настройка логирования
+
+Вызов logger.info(...) в обработчике только кладёт запись в очередь:
+форматирование и запись в файл/консоль выполняются в отдельном потоке
+(QueueListener), поэтому event loop не ждёт диска. В файл пишется JSON
+(одна запись - одна строка), в консоль - обычный текст.
+
+Для частых сообщений можно включить выборку по логгерам (LOG_SAMPLING),
+например "__main__=0.1,outbound=0.5": от этих логгеров записи ниже WARNING
+сохраняются с указанной вероятностью. Предупреждения и ошибки пишутся всегда.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+import config
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в виде одной строки JSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if 'CLUSTER_WORKER_INDEX' in os.environ:
+            entry['worker'] = config.CLUSTER_WORKER_INDEX
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю записей ниже WARNING от указанных логгеров"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который не форматирует сообщение в вызывающем потоке
+
+    Стандартный QueueHandler.prepare() подставляет аргументы в сообщение сразу;
+    здесь это делает поток записи. Аргументы логов должны быть неизменяемыми
+    значениями (числа, строки), что в коде бота так и есть.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Трассировку форматируем сразу: объект traceback держит кадры стека
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_sampling(value: str) -> dict:
+    """'logger=0.1,other=0.5' -> {'logger': 0.1, 'other': 0.5}"""
+    rates = {}
+    for item in value.split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def log_file_path(log_file: str = None) -> str:
+    """Файл лога; у каждого воркера кластера свой, чтобы процессы не мешали друг другу при ротации"""
+    log_file = log_file or config.LOG_FILE
+    if 'CLUSTER_WORKER_INDEX' in os.environ:
+        base, ext = os.path.splitext(log_file)
+        log_file = f"{base}-worker{config.CLUSTER_WORKER_INDEX}{ext}"
+    return log_file
+
+
+def setup(log_file: str = None):
+    """Настроить логирование (повторные вызовы ничего не делают)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_file = log_file_path(log_file)
+    os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=10*1024*1024,  # 10MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sampling(config.LOG_SAMPLING)))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(config.LOG_LEVEL)
+
+    # httpx пишет в INFO каждый запрос к Bot API
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """Дописать оставшиеся записи и остановить поток логирования"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
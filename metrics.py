@@ -0,0 +1,361 @@
+"""
+Метрики бота в текстовом формате Prometheus (эндпоинт /metrics)
+
+Собирается:
+- время работы каждого обработчика обновлений и число ошибок в них;
+- время вызовов функций database.py, число SQL-запросов и их время
+  (через события SQLAlchemy; запросы из обработчиков в обход database.py
+  попадают в function="inline");
+- время запросов к Bot API по методам, коды ответов и сетевые ошибки;
+- попадания и промахи кэшей (пользователи, состояния, file_id фото);
+- длина очередей (входящие обновления, исходящие сообщения).
+
+Эндпоинт слушает только localhost (METRICS_HOST:METRICS_PORT); в кластере
+у каждого воркера свой порт METRICS_PORT + номер воркера.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from telegram.error import NetworkError
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+import config
+import httpserver
+import sqlprofile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Функция database.py, которая сейчас выполняется (для подписи SQL-запросов)
+current_db_function = contextvars.ContextVar('current_db_function', default=None)
+# Обработчик обновления, который сейчас выполняется
+current_handler = contextvars.ContextVar('current_handler', default=None)
+
+_registry = []
+_server = None
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _samples(self):
+        """Строки вида 'имя{метки} значение'"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+    type_name = 'counter'
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение
+
+    Значение можно задавать через set() или функцией (set_function), которая
+    вызывается при каждом запросе /metrics.
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception as e:
+                logger.debug("Не удалось получить значение %s: %s", self.name, e)
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    """Распределение длительностей по корзинам"""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                # [счётчики по корзинам (последняя - +Inf), сумма, количество]
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+# ========== Метрики ==========
+
+handler_seconds = Histogram('bot_handler_seconds', 'Время обработки обновления', ('handler',))
+handler_errors = Counter('bot_handler_errors_total', 'Необработанные исключения в обработчиках', ('handler', 'error'))
+
+db_function_seconds = Histogram('bot_db_function_seconds', 'Время вызова функции database.py', ('function',))
+db_queries = Counter('bot_db_queries_total', 'Выполнено SQL-запросов', ('function',))
+db_query_seconds = Counter('bot_db_query_seconds_total', 'Суммарное время SQL-запросов', ('function',))
+
+api_seconds = Histogram('bot_telegram_api_seconds', 'Время запроса к Bot API', ('method',))
+api_responses = Counter('bot_telegram_api_responses_total', 'Ответы Bot API по HTTP-кодам', ('method', 'code'))
+api_errors = Counter('bot_telegram_api_errors_total', 'Сетевые ошибки запросов к Bot API', ('method', 'error'))
+
+cache_lookups = Counter('bot_cache_lookups_total', 'Обращения к кэшам', ('cache', 'result'))
+
+update_queue_size = Gauge('bot_update_queue_size', 'Обновлений в очереди на обработку')
+outbound_pending = Gauge('bot_outbound_pending', 'Исходящих сообщений в очереди диспетчера')
+outbound_skipped = Counter('bot_outbound_skipped_total', 'Отправки в недоступные чаты, завершённые без запроса к API', ('method',))
+unreachable_users = Gauge('bot_unreachable_users', 'Пользователей, которым бот не может писать')
+unreachable_marked = Counter('bot_unreachable_marked_total', 'Пользователи, помеченные недоступными', ('reason',))
+operator_profiles = Gauge('bot_operator_profiles', 'Анкет, которые ведут админы')
+operator_inbox_items = Counter('bot_operator_inbox_items_total', 'Входящие анкет операторов', ('kind',))
+operator_delivered = Counter('bot_operator_delivered_total', 'Входящие, разосланные админам')
+dormant_users = Gauge('bot_dormant_users', 'Спящих пользователей (давно не заходили)')
+dormant_marked = Counter('bot_dormant_marked_total', 'Пользователи, переведённые в спящие')
+dormant_restored = Counter('bot_dormant_restored_total', 'Спящие пользователи, которые вернулись')
+activity_flush_seconds = Histogram('bot_activity_flush_seconds', 'Время записи last_seen пачкой')
+recorded_updates = Counter('bot_recorded_updates_total', 'Обновления, записанные для воспроизведения нагрузки')
+
+background_pending = Gauge('bot_background_tasks', 'Незавершённых фоновых задач')
+background_seconds = Histogram('bot_background_task_seconds', 'Время выполнения фоновой задачи', ('task',))
+background_errors = Counter('bot_background_task_errors_total', 'Ошибки фоновых задач', ('task', 'error'))
+background_rejected = Counter('bot_background_tasks_rejected_total', 'Отклонённые фоновые задачи', ('task',))
+
+relay_seconds = Histogram('bot_relay_seconds', 'Время от получения сообщения в чате до доставки собеседнику', ('method',))
+relay_pending = Gauge('bot_relay_pending', 'Сообщений в очередях пересылки')
+relay_unsaved = Gauge('bot_relay_unsaved', 'Пересланных сообщений, ещё не записанных в БД')
+relay_persist_errors = Counter('bot_relay_persist_errors_total', 'Ошибки записи пересланных сообщений в БД', ('error',))
+
+
+def cache_hit(cache: str):
+    cache_lookups.inc(cache, 'hit')
+
+
+def cache_miss(cache: str):
+    cache_lookups.inc(cache, 'miss')
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+# ========== Обработчики обновлений ==========
+
+def _instrument_callback(callback):
+    if getattr(callback, '_metrics_wrapped', False):
+        return callback
+    name = getattr(callback, '__name__', type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        token = current_handler.set(name)
+        profile_token = sqlprofile.begin(name)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name)
+            sqlprofile.finish(profile_token)
+            current_handler.reset(token)
+
+    wrapper._metrics_wrapped = True
+    return wrapper
+
+
+def _instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks:
+            _instrument_handler(nested)
+        for handlers in handler.states.values():
+            for nested in handlers:
+                _instrument_handler(nested)
+        return
+    if getattr(handler, 'callback', None) is not None:
+        handler.callback = _instrument_callback(handler.callback)
+
+
+def instrument_application(application):
+    """Замерять время всех зарегистрированных обработчиков приложения"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+    update_queue_size.set_function(application.update_queue.qsize)
+
+
+# ========== База данных ==========
+
+# Функции, которые не обращаются к БД или вызываются один раз при запуске
+_DB_SKIP = {'get_session', 'init_db', 'invalidate_user_cache'}
+
+
+def _instrument_db_function(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        # Вложенные вызовы (одна функция database.py вызывает другую) считаются во внешней
+        token = current_db_function.set(name) if current_db_function.get() is None else None
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            db_function_seconds.observe(time.perf_counter() - start, name)
+            if token is not None:
+                current_db_function.reset(token)
+
+    wrapper._metrics_wrapped = True
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    function = current_db_function.get() or 'inline'
+    db_queries.inc(function)
+    db_query_seconds.inc(function, amount=elapsed)
+
+
+def instrument_database(db):
+    """Замерять функции модуля database и SQL-запросы движка db.engine (повторный вызов ничего не делает)"""
+    if event.contains(db.engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    for name, function in list(vars(db).items()):
+        if (name.startswith('_') or name in _DB_SKIP or not inspect.isfunction(function)
+                or function.__module__ != db.__name__ or getattr(function, '_metrics_wrapped', False)):
+            continue
+        setattr(db, name, _instrument_db_function(name, function))
+    event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+# ========== Bot API ==========
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет время и результат каждого запроса к Bot API"""
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+        except NetworkError as e:
+            api_errors.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - start, api_method)
+        api_responses.inc(api_method, str(code))
+        return code, payload
+
+
+# ========== HTTP-эндпоинт ==========
+
+async def _handle_metrics(request: httpserver.Request) -> httpserver.Response:
+    return httpserver.Response(200, render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def start_server():
+    """Запустить эндпоинт /metrics (METRICS_PORT = 0 - отключён)"""
+    global _server
+    if not config.METRICS_PORT or _server is not None:
+        return
+    _server = httpserver.HTTPServer(config.METRICS_HOST, config.METRICS_PORT + config.CLUSTER_WORKER_INDEX)
+    _server.route('/metrics', _handle_metrics)
+    try:
+        await _server.start()
+    except OSError as e:
+        logger.error(f"Не удалось запустить эндпоинт метрик: {e}")
+        _server = None
+
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        await _server.stop()
+        _server = None
@@ -0,0 +1,152 @@
+"""
+Версионированные миграции схемы БД
+
+Миграция - модуль vNNN_описание.py в этом пакете с функцией upgrade(conn).
+Применённые версии записываются в таблицу schema_version, поэтому при
+запуске достаточно одного запроса MAX(version): если схема актуальна,
+ни create_all, ни чтение структуры таблиц не выполняются.
+
+- новая (пустая) БД создаётся сразу по моделям database.py и помечается
+  последней версией;
+- БД, созданная до появления миграций (нет schema_version), проходит все
+  миграции с первой, поэтому операции в migrations.ops идемпотентны;
+- миграция с TRANSACTIONAL = False выполняется вне транзакции (нужно для
+  CREATE INDEX CONCURRENTLY на Postgres), остальные - в одной транзакции
+  вместе с записью в schema_version.
+
+На Postgres миграции выполняются под advisory-блокировкой, чтобы
+несколько одновременно запущенных процессов не применяли их дважды.
+Запуск вручную (например, перед деплоем): python -m migrations
+"""
+import contextlib
+import importlib
+import logging
+import pkgutil
+import re
+import time
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+_metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+_MODULE_NAME = re.compile(r'^v(\d{3,})_(\w+)$')
+# Ключ pg_advisory_lock для миграций (произвольная константа)
+_LOCK_KEY = 7310021
+
+
+class Migration:
+    """Модуль миграции: версия, имя и функция upgrade(conn)"""
+
+    __slots__ = ('version', 'name', 'module')
+
+    def __init__(self, version: int, name: str, module):
+        self.version = version
+        self.name = name
+        self.module = module
+
+    @property
+    def transactional(self) -> bool:
+        return getattr(self.module, 'TRANSACTIONAL', True)
+
+    @property
+    def description(self) -> str:
+        return (self.module.__doc__ or self.name).strip().splitlines()[0]
+
+
+def discover() -> list:
+    """Все миграции пакета по возрастанию версии"""
+    migrations = {}
+    for info in pkgutil.iter_modules(__path__):
+        match = _MODULE_NAME.match(info.name)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise RuntimeError(f"Две миграции с версией {version}: {migrations[version].name} и {info.name}")
+        migrations[version] = Migration(version, info.name, importlib.import_module(f'{__name__}.{info.name}'))
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def current_version(engine):
+    """Версия схемы из schema_version; None, если таблицы ещё нет"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except DBAPIError:
+        return None
+
+
+@contextlib.contextmanager
+def _lock(engine):
+    if engine.dialect.name != 'postgresql':
+        # SQLite: схему меняет один процесс (в кластере - мастер)
+        yield
+        return
+    with engine.connect() as conn:
+        conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': _LOCK_KEY})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': _LOCK_KEY})
+            conn.commit()
+
+
+def _record(conn, migration: Migration):
+    conn.execute(schema_version.insert().values(
+        version=migration.version, name=migration.name, applied_at=datetime.now()
+    ))
+
+
+def _apply(engine, migration: Migration):
+    started = time.perf_counter()
+    logger.info(f"Миграция {migration.version:03d}: {migration.description}")
+    if migration.transactional:
+        with engine.begin() as conn:
+            migration.module.upgrade(conn)
+            _record(conn, migration)
+    else:
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            migration.module.upgrade(conn)
+            _record(conn, migration)
+    logger.info(f"Миграция {migration.version:03d} применена за {time.perf_counter() - started:.2f} с")
+
+
+def migrate(engine, metadata) -> int:
+    """Довести схему до последней версии, вернуть число применённых миграций"""
+    migrations = discover()
+    latest = migrations[-1].version if migrations else 0
+    if current_version(engine) == latest:
+        return 0
+
+    with _lock(engine):
+        # Пока ждали блокировку, миграции мог применить другой процесс
+        current = current_version(engine)
+        if current is None:
+            existing = set(inspect(engine).get_table_names()) & set(metadata.tables)
+            schema_version.create(engine, checkfirst=True)
+            if not existing:
+                with engine.begin() as conn:
+                    metadata.create_all(conn)
+                    for migration in migrations:
+                        _record(conn, migration)
+                logger.info(f"Создана новая схема БД версии {latest}")
+                return 0
+            current = 0
+
+        pending = [migration for migration in migrations if migration.version > current]
+        for migration in pending:
+            _apply(engine, migration)
+        return len(pending)
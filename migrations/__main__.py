@@ -0,0 +1,33 @@
+"""
+Применить миграции вручную: python -m migrations [--status]
+
+Удобно перед деплоем, если миграция долго строит индекс на большой таблице.
+"""
+import argparse
+import logging
+
+import migrations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('--status', action='store_true', help="только показать версии, ничего не применять")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    import database as db
+
+    current = migrations.current_version(db.engine)
+    print(f"Версия схемы: {'нет schema_version' if current is None else current}")
+    for migration in migrations.discover():
+        applied = current is not None and migration.version <= current
+        print(f"  {'✅' if applied else '⏳'} {migration.version:03d} {migration.description}")
+    if args.status:
+        return
+
+    applied = migrations.migrate(db.engine, db.Base.metadata)
+    print(f"Применено миграций: {applied}, версия схемы: {migrations.current_version(db.engine)}")
+
+
+if __name__ == '__main__':
+    main()
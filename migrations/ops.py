@@ -0,0 +1,54 @@
+"""
+Операции для миграций
+
+Все операции можно выполнять повторно: БД, созданная до появления
+миграций, проходит их с первой, и часть изменений в ней уже может быть.
+"""
+from sqlalchemy import inspect, text
+
+
+def is_postgres(conn) -> bool:
+    return conn.dialect.name == 'postgresql'
+
+
+def _autocommit(conn) -> bool:
+    return conn.get_execution_options().get('isolation_level') == 'AUTOCOMMIT'
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    return any(col['name'] == column for col in inspect(conn).get_columns(table))
+
+
+def add_column(conn, table: str, column: str, ddl: str):
+    """Добавить колонку, если её нет (ddl - тип и ограничения, например 'BOOLEAN DEFAULT FALSE')"""
+    if not has_column(conn, table, column):
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def create_index(conn, name: str, table: str, columns: list, unique: bool = False):
+    """
+    Создать индекс, если его нет
+
+    На Postgres вне транзакции (миграция с TRANSACTIONAL = False) индекс
+    строится CONCURRENTLY - без блокировки записи в таблицу.
+    """
+    concurrently = ''
+    if is_postgres(conn) and _autocommit(conn):
+        concurrently = ' CONCURRENTLY'
+        # Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс,
+        # и IF NOT EXISTS его бы пропустил
+        invalid = conn.execute(text(
+            'SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE c.relname = :name'
+        ), {'name': name}).scalar()
+        if invalid:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX{concurrently} IF NOT EXISTS {name} "
+        f"ON {table} ({', '.join(columns)})"
+    ))
+
+
+def drop_index(conn, name: str):
+    concurrently = ' CONCURRENTLY' if is_postgres(conn) and _autocommit(conn) else ''
+    conn.execute(text(f'DROP INDEX{concurrently} IF EXISTS {name}'))
@@ -0,0 +1,7 @@
+"""Таблицы и индексы моделей database.py, которых ещё нет в БД"""
+
+
+def upgrade(conn):
+    from database import Base
+
+    Base.metadata.create_all(conn)
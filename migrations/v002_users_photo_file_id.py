@@ -0,0 +1,6 @@
+"""Колонка users.photo_file_id (file_id фото анкеты в Telegram)"""
+from migrations import ops
+
+
+def upgrade(conn):
+    ops.add_column(conn, 'users', 'photo_file_id', 'VARCHAR(255)')
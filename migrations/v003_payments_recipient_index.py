@@ -0,0 +1,8 @@
+"""Индекс payments(recipient_user_id, status) для списка донатов пользователю"""
+from migrations import ops
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    ops.create_index(conn, 'idx_payment_recipient', 'payments', ['recipient_user_id', 'status'])
@@ -0,0 +1,12 @@
+"""Счётчик users.unviewed_likes (непросмотренные лайки) и его начальное заполнение"""
+from sqlalchemy import text
+
+from migrations import ops
+
+
+def upgrade(conn):
+    ops.add_column(conn, 'users', 'unviewed_likes', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute(text(
+        'UPDATE users SET unviewed_likes = ('
+        'SELECT COUNT(*) FROM likes WHERE likes.to_user_id = users.id AND likes.is_viewed = :viewed)'
+    ), {'viewed': False})
@@ -0,0 +1,6 @@
+"""Отметка users.is_unreachable: бот не может писать пользователю"""
+from migrations import ops
+
+
+def upgrade(conn):
+    ops.add_column(conn, 'users', 'is_unreachable', 'BOOLEAN NOT NULL DEFAULT FALSE')
@@ -0,0 +1,17 @@
+"""Анкеты, которые ведут админы (users.is_operator_managed), и таблица operator_inbox"""
+from sqlalchemy import text
+
+from migrations import ops
+
+
+def upgrade(conn):
+    from database import OperatorInboxItem
+
+    ops.add_column(conn, 'users', 'is_operator_managed', 'BOOLEAN NOT NULL DEFAULT FALSE')
+    # Анкеты, добавленные через админ панель до этой версии: их ведут админы,
+    # а "недоступными" они стали из-за выдуманного telegram_id
+    conn.execute(text(
+        'UPDATE users SET is_operator_managed = :managed, is_unreachable = :unreachable '
+        'WHERE username = :username'
+    ), {'managed': True, 'unreachable': False, 'username': 'Анкета от админа'})
+    OperatorInboxItem.__table__.create(conn, checkfirst=True)
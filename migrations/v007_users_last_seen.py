@@ -0,0 +1,14 @@
+"""Время последней активности users.last_seen_at и отметка спящих users.is_dormant"""
+from datetime import datetime
+
+from sqlalchemy import text
+
+from migrations import ops
+
+
+def upgrade(conn):
+    ops.add_column(conn, 'users', 'last_seen_at', 'TIMESTAMP')
+    ops.add_column(conn, 'users', 'is_dormant', 'BOOLEAN NOT NULL DEFAULT FALSE')
+    # Активность до этой версии не записывалась: отсчёт для всех начинается с миграции
+    conn.execute(text('UPDATE users SET last_seen_at = :now WHERE last_seen_at IS NULL'), {'now': datetime.now()})
+    ops.create_index(conn, 'idx_dormant_last_seen', 'users', ['is_dormant', 'last_seen_at'])
@@ -0,0 +1,126 @@
+"""
+Уведомления о симпатиях
+
+Вместо отдельного сообщения на каждый лайк девушка получает сводку:
+первый лайк откладывает отправку на LIKES_DIGEST_DELAY секунд, все лайки
+за это время попадают в одно сообщение, а следующая сводка уходит не
+раньше чем через LIKES_DIGEST_MIN_INTERVAL после предыдущей. Число
+симпатий в сводке берётся из БД в момент отправки, поэтому уже
+просмотренные лайки в неё не попадают.
+
+Ожидающие сводки хранятся в state (SQLite), переживают перезапуск и
+общие для воркеров кластера; рассылает их задача likes_digest_job.
+"""
+import asyncio
+import logging
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import config
+import database as db
+import outbound
+import state
+
+logger = logging.getLogger(__name__)
+
+# telegram_id получательницы -> {'since': время первого неотправленного лайка или None,
+#                                 'sent': время последней сводки}
+pending_digests = state.StateStore('likes_digest', ttl=config.STATE_CHAT_TTL)
+
+
+def like_received(telegram_id: int):
+    """Учесть новый лайк: запланировать сводку для получательницы"""
+    entry = pending_digests.get(telegram_id) or {'since': None, 'sent': 0}
+    if entry['since'] is None:
+        # Лайки после первого в том же окне ничего не меняют и не пишутся в state
+        pending_digests[telegram_id] = {'since': time.time(), 'sent': entry['sent']}
+
+
+def likes_page(user_id: int, after_id: int = 0, before_id: int = None):
+    """
+    Одно сообщение со страницей непросмотренных симпатий
+
+    Returns:
+        (текст, клавиатура или None)
+    """
+    likes, has_prev, has_next = db.get_likes_inbox(
+        user_id, after_id=after_id, before_id=before_id, limit=config.LIKES_PAGE_SIZE
+    )
+    if not likes and (after_id or before_id is not None):
+        # Все симпатии этой страницы уже просмотрены - показываем первую
+        return likes_page(user_id)
+    if not likes:
+        return "У вас пока нет новых симпатий 😊", None
+
+    # Повторный показ страницы после просмотра анкеты начинается с того же места
+    anchor = likes[0].id - 1
+    keyboard = [
+        [InlineKeyboardButton(f"👀 {like.from_user.name}, {like.from_user.age} · {like.created_at:%d.%m %H:%M}",
+                              callback_data=f'view_like_{like.id}_{anchor}')]
+        for like in likes
+    ]
+    keyboard.append([InlineKeyboardButton("✅ Отметить просмотренными",
+                                          callback_data=f'likes_seen_{likes[0].id}_{likes[-1].id}')])
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f'likes_page_prev_{likes[0].id}'))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f'likes_page_next_{likes[-1].id}'))
+    if navigation:
+        keyboard.append(navigation)
+
+    text = (
+        f"❤️ У вас {db.count_unviewed_likes(user_id)} новых симпатий!\n"
+        f"Нажмите на кнопку ниже чтобы посмотреть анкету:"
+    )
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def _send_digest(telegram_id: int):
+    user = db.get_user_by_telegram_id(telegram_id)
+    if not user or not user.is_active or user.is_unreachable:
+        return
+    count = db.count_unviewed_likes(user.id)
+    if not count:
+        return
+    keyboard = [[InlineKeyboardButton("👀 Посмотреть", callback_data='likes_page_next_0')]]
+    try:
+        await outbound.send_message(
+            chat_id=telegram_id,
+            text=f"❤️ У вас {count} новых симпатий!\n\nКто-то проявил к вам интерес.",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            priority=outbound.PRIORITY_NOTIFICATION
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при отправке сводки симпатий (TG: {telegram_id}): {e}")
+
+
+async def send_due_digests() -> int:
+    """Отправить сводки, время которых пришло; вернуть их число"""
+    now = time.time()
+    due = []
+    for telegram_id in list(pending_digests):
+        entry = pending_digests.get(telegram_id)
+        if entry is None:
+            continue
+        if entry['since'] is None:
+            # Сводка давно отправлена, новых лайков нет - запись больше не нужна
+            if now - entry['sent'] >= config.LIKES_DIGEST_MIN_INTERVAL:
+                pending_digests.pop(telegram_id, None)
+            continue
+        send_at = max(entry['since'] + config.LIKES_DIGEST_DELAY,
+                      entry['sent'] + config.LIKES_DIGEST_MIN_INTERVAL)
+        if now >= send_at:
+            pending_digests[telegram_id] = {'since': None, 'sent': now}
+            due.append(telegram_id)
+
+    if due:
+        await asyncio.gather(*(_send_digest(telegram_id) for telegram_id in due))
+        logger.info(f"Отправлено сводок симпатий: {len(due)}")
+    return len(due)
+
+
+async def likes_digest_job(context):
+    """Периодическая задача рассылки сводок симпатий"""
+    await send_due_digests()
@@ -0,0 +1,280 @@
+"""
+Входящие анкет, которые ведут админы
+
+Анкеты из админ панели создаются с выдуманным telegram_id и отметкой
+users.is_operator_managed. Всё, что бот отправил бы такой анкете, вместо
+запроса к Bot API (он завершился бы ошибкой "chat not found") записывается
+в таблицу operator_inbox:
+- сообщения и вложения из чатов (relay.engine.operator_hook) - с отправителем;
+- симпатии (like_received) - с кнопкой начать диалог от имени анкеты;
+- остальные уведомления бота (outbound.operator_hook) - для сведения.
+
+Раз в OPERATOR_INBOX_INTERVAL сек первый воркер рассылает новые входящие
+всем ADMIN_IDS: одно сообщение на диалог (анкета <- пользователь) вместо
+сообщения на каждое входящее, вложения - копиями. Кнопка "✍️ Ответить"
+включает режим ответа (replying): текст админа уходит пользователю через
+relay от имени анкеты, а диалог отмечается отвеченным. Неотвеченные
+диалоги видны в админ панели.
+
+В кластере о новой анкете воркеры узнают сразу через шину
+(profile_added_hook), а раз в OPERATOR_REFRESH_INTERVAL сек список
+перечитывается из БД. Ошибки доставки не помечают такие анкеты
+недоступными даже до того, как воркер о них узнал.
+"""
+import asyncio
+import json
+import logging
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+import config
+import database as db
+import metrics
+import outbound
+import relay
+import state
+
+logger = logging.getLogger(__name__)
+
+# В кластере (cluster.py): функция (telegram_id), которая сообщает другим
+# процессам о новой анкете оператора
+profile_added_hook = None
+
+# telegram_id админа -> [id анкеты, id пользователя], пока админ отвечает от имени анкеты
+replying = state.StateStore('operator_reply', ttl=config.STATE_INPUT_TTL)
+
+# Элементы альбома при повторной отправке админам
+_MEDIA_TYPES = {'photo': InputMediaPhoto, 'video': InputMediaVideo, 'document': InputMediaDocument}
+
+_KIND_EMOJI = {'message': '💬', 'like': '❤️', 'notice': '🔔'}
+
+# Длина одного входящего в сводке и ограничение Telegram на длину сообщения
+ITEM_TEXT_LIMIT = 500
+MESSAGE_LIMIT = 4096
+# Диалогов в списке неотвеченных
+CONVERSATIONS_PAGE_SIZE = 20
+
+
+def install():
+    """Загрузить анкеты операторов и подключиться к outbound и relay (из post_init)"""
+    refresh_profiles()
+    outbound.operator_hook = _bot_notice
+    relay.engine.operator_hook = _relayed
+    metrics.operator_profiles.set_function(lambda: len(outbound.operator_chats))
+    logger.info(f"Анкет, которые ведут админы: {len(outbound.operator_chats)}")
+
+
+def refresh_profiles():
+    """Перечитать анкеты операторов из БД (новую анкету мог добавить другой воркер)"""
+    managed = set(db.get_operator_telegram_ids())
+    outbound.operator_chats.intersection_update(managed)
+    outbound.operator_chats.update(managed)
+    # Такие анкеты не "недоступны": их входящие читают админы
+    outbound.unreachable.difference_update(managed)
+
+
+async def refresh_profiles_job(context):
+    """Периодическая задача обновления списка анкет операторов"""
+    await asyncio.to_thread(refresh_profiles)
+
+
+def add_profile(telegram_id: int):
+    """Отправки анкете в этом процессе идут во входящие"""
+    outbound.operator_chats.add(telegram_id)
+    outbound.unreachable.discard(telegram_id)
+
+
+def register_profile(telegram_id: int):
+    """Админ добавил анкету: отправки ей сразу идут во входящие во всех воркерах"""
+    add_profile(telegram_id)
+    if profile_added_hook:
+        profile_added_hook(telegram_id)
+
+
+# ========== Приём входящих ==========
+
+def _payload(method: str, kwargs: dict):
+    """JSON вызова Bot API, которым вложение можно показать админу (None - хватит текста)"""
+    if method == 'copy_message':
+        return json.dumps({'method': method, 'from_chat_id': kwargs['from_chat_id'],
+                           'message_id': kwargs['message_id']})
+    if method == 'send_media_group':
+        media = [{'type': item.type, 'media': item.media, 'caption': item.caption} for item in kwargs['media']]
+        return json.dumps({'method': method, 'media': media})
+    if method == 'send_photo' and isinstance(kwargs.get('photo'), str):
+        return json.dumps({'method': method, 'photo': kwargs['photo']})
+    return None
+
+
+async def _relayed(from_user_id: int, profile_id: int, method: str, kwargs: dict, record: str):
+    """Сообщение из чата анкете оператора (relay.engine.operator_hook)"""
+    if record is None:
+        # Служебное сообщение relay (подсказка под альбомом) - админам не нужно
+        return
+    await asyncio.to_thread(db.add_operator_item, profile_id, from_user_id, 'message', record,
+                            _payload(method, kwargs))
+    metrics.operator_inbox_items.inc('message')
+
+
+async def _bot_notice(method: str, chat_id: int, kwargs: dict):
+    """Уведомление бота анкете оператора (outbound.operator_hook)"""
+    profile = db.get_user_by_telegram_id(chat_id)
+    if profile is None:
+        return None
+    text = kwargs.get('text') or kwargs.get('caption') or method
+    await asyncio.to_thread(db.add_operator_item, profile.id, None, 'notice', text)
+    metrics.operator_inbox_items.inc('notice')
+    return None
+
+
+def like_received(like_id: int, from_user, profile):
+    """Симпатия анкете оператора (вместо сводки notifications)"""
+    text = f"Симпатия: {from_user.name}, {from_user.age}, {from_user.city}\n{from_user.description}"
+    payload = None
+    if from_user.photo_file_id:
+        payload = json.dumps({'method': 'send_photo', 'photo': from_user.photo_file_id})
+    db.add_operator_item(profile.id, from_user.id, 'like', text, payload, like_id=like_id)
+    metrics.operator_inbox_items.inc('like')
+
+
+# ========== Рассылка админам ==========
+
+def _shorten(text: str, limit: int = ITEM_TEXT_LIMIT) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _chunks(header: str, lines: list):
+    """Разбить сводку на сообщения не длиннее MESSAGE_LIMIT"""
+    chunk = header
+    for line in lines:
+        if len(chunk) + len(line) + 1 > MESSAGE_LIMIT:
+            yield chunk
+            chunk = ""
+        chunk = f"{chunk}\n{line}" if chunk else line
+    yield chunk
+
+
+def _conversation_summary(items: list):
+    """Текст(ы) и клавиатура сводки по одному диалогу"""
+    profile, from_user = items[0].profile, items[0].from_user
+    header = f"📥 Анкета 👩 {profile.name} (код {profile.hashtag or '—'})"
+    keyboard = []
+    if from_user is not None:
+        gender_emoji = "👨" if from_user.gender == 'male' else "👩"
+        header += f"\nот {gender_emoji} {from_user.name}, {from_user.age} · {from_user.city}\n"
+        for item in items:
+            if item.kind == 'like' and item.like_id:
+                keyboard.append([InlineKeyboardButton("💬 Начать диалог", callback_data=f'op_start_{item.like_id}')])
+                break
+        keyboard.append([InlineKeyboardButton("✍️ Ответить", callback_data=f'op_reply_{profile.id}_{from_user.id}')])
+    else:
+        header += "\nуведомления бота\n"
+    lines = [
+        f"{_KIND_EMOJI.get(item.kind, '•')} {item.created_at:%H:%M} {_shorten(item.text)}"
+        for item in items
+    ]
+    return list(_chunks(header, lines)), InlineKeyboardMarkup(keyboard) if keyboard else None
+
+
+async def _send_payload(admin_id: int, payload: str):
+    data = json.loads(payload)
+    method = data.pop('method')
+    if method == 'send_media_group':
+        data['media'] = [_MEDIA_TYPES[item['type']](item['media'], caption=item['caption']) for item in data['media']]
+    await outbound.send(method, admin_id, outbound.PRIORITY_NOTIFICATION, **data)
+
+
+async def _deliver_conversation(admin_id: int, items: list):
+    """Отправить админу вложения диалога, затем сводку с кнопками"""
+    for item in items:
+        if item.payload:
+            try:
+                await _send_payload(admin_id, item.payload)
+            except Exception as e:
+                logger.error(f"Не удалось показать вложение входящего {item.id} админу {admin_id}: {e}")
+    texts, reply_markup = _conversation_summary(items)
+    for number, text in enumerate(texts, 1):
+        await outbound.send_message(
+            chat_id=admin_id,
+            text=text,
+            reply_markup=reply_markup if number == len(texts) else None,
+            priority=outbound.PRIORITY_NOTIFICATION
+        )
+
+
+async def deliver_pending() -> int:
+    """Разослать админам новые входящие (по сообщению на диалог); вернуть их число"""
+    if not config.ADMIN_IDS:
+        return 0
+    items = await asyncio.to_thread(db.get_undelivered_operator_items, config.OPERATOR_BATCH_SIZE)
+    if not items:
+        return 0
+
+    conversations = {}
+    for item in items:
+        conversations.setdefault((item.profile_id, item.from_user_id), []).append(item)
+
+    deliveries = [
+        _deliver_conversation(admin_id, conversation)
+        for admin_id in config.ADMIN_IDS
+        for conversation in conversations.values()
+    ]
+    results = await asyncio.gather(*deliveries, return_exceptions=True)
+    for error in results:
+        if isinstance(error, Exception):
+            logger.error(f"Ошибка при рассылке входящих анкет админу: {error}")
+
+    # Даже если какой-то админ не получил сводку, диалог остаётся в списке неотвеченных
+    await asyncio.to_thread(db.mark_operator_items_delivered, [item.id for item in items])
+    metrics.operator_delivered.inc(amount=len(items))
+    logger.info(f"Админам разосланы входящие анкет: {len(items)} в {len(conversations)} диалогах")
+    return len(items)
+
+
+async def operator_inbox_job(context):
+    """Периодическая задача рассылки входящих анкет операторов"""
+    await deliver_pending()
+
+
+# ========== Ответы админов ==========
+
+def finish_markup():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✅ Закончить ответ", callback_data='op_done')]])
+
+
+def start_reply(admin_id: int, profile, user):
+    """
+    Включить режим ответа от имени анкеты
+
+    Returns:
+        (текст подсказки, клавиатура)
+    """
+    replying[admin_id] = [profile.id, user.id]
+    text = (
+        f"✍️ Ответ от имени 👩 {profile.name} для {user.name}, {user.age}.\n\n"
+        f"Отправьте текст сообщения - оно уйдёт пользователю от анкеты. "
+        f"Можно отправить несколько сообщений подряд."
+    )
+    return text, finish_markup()
+
+
+def conversations_page():
+    """
+    Список неотвеченных диалогов анкет операторов
+
+    Returns:
+        (текст, клавиатура или None)
+    """
+    conversations = db.get_operator_conversations(limit=CONVERSATIONS_PAGE_SIZE)
+    if not conversations:
+        return "📥 Неотвеченных сообщений анкетам нет.", None
+    keyboard = [
+        [InlineKeyboardButton(f"✍️ {profile.name} ← {user.name} · {count} · {last_at:%d.%m %H:%M}",
+                              callback_data=f'op_reply_{profile.id}_{user.id}')]
+        for profile, user, count, last_at in conversations
+    ]
+    text = (
+        f"📥 Неотвеченных диалогов: {db.count_operator_conversations()}\n"
+        f"Выберите диалог, чтобы ответить от имени анкеты:"
+    )
+    return text, InlineKeyboardMarkup(keyboard)
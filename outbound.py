@@ -0,0 +1,456 @@
+"""
+Централизованная отправка исходящих сообщений в Telegram
+
+Все сообщения другим пользователям (пересылка в чатах, уведомления, рассылки)
+проходят через общий диспетчер, который:
+- соблюдает глобальный лимит Telegram (~30 сообщений/сек на бота)
+  и лимит на один чат (~1 сообщение/сек) через token bucket;
+- хранит отдельную FIFO-очередь для каждого чата, поэтому порядок
+  сообщений одному получателю сохраняется;
+- обслуживает чаты по приоритету: чат > уведомления > рассылки;
+- обрабатывает RetryAfter (пауза всей отправки) и временные сетевые ошибки
+  (повтор с экспоненциальной задержкой);
+- не тратит запросы на недоступные чаты (бот заблокирован, чат не найден):
+  после первой такой ошибки отправки в чат сразу завершаются ChatUnreachable.
+
+Отправки анкетам, которые ведут админы, в Bot API не уходят вовсе: их
+забирает operator_hook во входящие операторов (operator_inbox.py).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета (меньше - важнее)
+PRIORITY_CHAT = 0  # Пересылка сообщений между собеседниками
+PRIORITY_NOTIFICATION = 1  # Уведомления (симпатии, начало чата и т.п.)
+PRIORITY_BROADCAST = 2  # Массовые рассылки
+
+
+class OutboundQueueFull(Exception):
+    """Очередь исходящих сообщений переполнена (рассылка отклонена)"""
+
+
+class ChatUnreachable(Forbidden):
+    """Чат недоступен (раньше Telegram ответил, что бот заблокирован или чата нет), запрос не отправлялся"""
+
+
+# telegram_id недоступных чатов (заполняет delivery.py из БД при запуске)
+unreachable = set()
+
+# Функция (chat_id, error), которую диспетчер вызывает при первой постоянной
+# ошибке доставки в чат (delivery.py записывает её в БД)
+unreachable_hook = None
+
+
+# telegram_id анкет, которые ведут админы (заполняет operator_inbox.py): у них
+# выдуманный telegram_id, и отправки им уходят во входящие операторов
+operator_chats = set()
+
+# Корутина (method, chat_id, kwargs), которая вместо Bot API кладёт отправку
+# анкете оператора во входящие
+operator_hook = None
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """Ошибка, после которой писать в этот чат бесполезно"""
+    if isinstance(error, Forbidden):
+        # Бот заблокирован, аккаунт удалён, пользователь не запускал бота
+        return True
+    if isinstance(error, BadRequest):
+        message = error.message.lower()
+        return 'chat not found' in message or 'user not found' in message
+    return False
+
+
+def mark_unreachable(chat_id: int, error: Exception):
+    """Запомнить, что чат недоступен; ожидающие отправки в него завершаются ошибкой"""
+    if chat_id in unreachable:
+        return
+    unreachable.add(chat_id)
+    dispatcher.drop_chat(chat_id)
+    if unreachable_hook:
+        unreachable_hook(chat_id, error)
+
+
+def _unreachable_error(chat_id: int) -> ChatUnreachable:
+    return ChatUnreachable(f"Chat {chat_id} is unreachable: bot was blocked or chat not found")
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity за раз"""
+
+    __slots__ = ('rate', 'capacity', '_tokens', '_updated', '_paused_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до появления токена (0 - можно отправлять)"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def consume(self):
+        """Забрать один токен"""
+        self._refill(time.monotonic())
+        self._tokens -= 1
+
+    def pause(self, seconds: float):
+        """Запретить отправку на указанное время (после RetryAfter)"""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+    def is_idle(self) -> bool:
+        """Ведро полное - состояние можно не хранить"""
+        now = time.monotonic()
+        self._refill(now)
+        return now >= self._paused_until and self._tokens >= self.capacity
+
+
+class _Job:
+    """Одна отправка: метод Bot API, его аргументы и future с результатом"""
+
+    __slots__ = ('method', 'chat_id', 'kwargs', 'priority', 'seq', 'future', 'attempts')
+
+    def __init__(self, method: str, chat_id: int, kwargs: dict, priority: int, seq: int, future):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.attempts = 0
+
+
+class OutboundDispatcher:
+    """Диспетчер исходящих сообщений с лимитами, приоритетами и повторами"""
+
+    def __init__(self, global_rate: float, per_chat_rate: float, per_chat_burst: int,
+                 workers: int, max_retries: int, max_pending: int):
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+
+        self._bot = None
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}  # {chat_id: TokenBucket}
+        self._chat_queues = {}  # {chat_id: deque[_Job]}
+        self._ready = []  # heap (priority, seq, chat_id) - чаты, готовые к отправке
+        self._delayed = []  # heap (ready_at, priority, seq, chat_id) - ждут лимита чата
+        self._busy = set()  # чаты, у которых сейчас идёт отправка
+        self._pending = 0
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._slots = None
+        self._scheduler = None
+        self._in_flight = set()
+        self._last_prune = time.monotonic()
+
+    @property
+    def running(self) -> bool:
+        return self._scheduler is not None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def start(self, bot):
+        """Запустить диспетчер (вызывается из post_init приложения)"""
+        if self._scheduler:
+            return
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._scheduler = asyncio.create_task(self._run(), name='outbound-dispatcher')
+        logger.info(
+            f"Диспетчер исходящих сообщений запущен: {self.global_rate}/сек всего, "
+            f"{self.per_chat_rate}/сек на чат, воркеров: {self.workers}"
+        )
+
+    async def stop(self, timeout: float = 10):
+        """Дождаться отправки очереди (не дольше timeout) и остановить диспетчер"""
+        if not self._scheduler:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        self._scheduler.cancel()
+        try:
+            await self._scheduler
+        except asyncio.CancelledError:
+            pass
+        self._scheduler = None
+
+        # Всё, что не успели отправить, завершаем ошибкой
+        for queue in self._chat_queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.set_exception(asyncio.CancelledError())
+        if self._pending:
+            logger.warning(f"Диспетчер остановлен, не отправлено сообщений: {self._pending}")
+        self._chat_queues.clear()
+        self._ready.clear()
+        self._delayed.clear()
+        self._pending = 0
+
+    def submit(self, method: str, chat_id: int, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+        """Поставить отправку в очередь, вернуть future с результатом метода Bot API"""
+        if not self._scheduler:
+            raise RuntimeError("Диспетчер исходящих сообщений не запущен")
+
+        if chat_id in unreachable:
+            metrics.outbound_skipped.inc(method)
+            raise _unreachable_error(chat_id)
+
+        if priority >= PRIORITY_BROADCAST and self._pending >= self.max_pending:
+            raise OutboundQueueFull(f"В очереди уже {self._pending} сообщений")
+
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(method, chat_id, kwargs, priority, next(self._seq), future)
+
+        queue = self._chat_queues.get(chat_id)
+        if queue is None:
+            queue = self._chat_queues[chat_id] = deque()
+        queue.append(job)
+        self._pending += 1
+
+        # Чат только что получил первое сообщение - ставим его в очередь готовых
+        if len(queue) == 1 and chat_id not in self._busy:
+            heapq.heappush(self._ready, (job.priority, job.seq, chat_id))
+            self._wakeup.set()
+        return future
+
+    async def send(self, method: str, chat_id: int, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+        """Отправить и дождаться результата"""
+        return await self.submit(method, chat_id, priority, **kwargs)
+
+    def drop_chat(self, chat_id: int):
+        """Завершить ошибкой ChatUnreachable все ожидающие отправки в чат"""
+        queue = self._chat_queues.pop(chat_id, None)
+        if not queue:
+            return
+        for job in queue:
+            metrics.outbound_skipped.inc(job.method)
+            if not job.future.done():
+                job.future.set_exception(_unreachable_error(chat_id))
+        self._pending -= len(queue)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    def _schedule_chat(self, chat_id: int, not_before: float = 0.0):
+        """Вернуть чат в расписание, если в его очереди ещё есть сообщения"""
+        queue = self._chat_queues.get(chat_id)
+        if not queue:
+            self._chat_queues.pop(chat_id, None)
+            return
+        head = queue[0]
+        if not_before > time.monotonic():
+            heapq.heappush(self._delayed, (not_before, head.priority, head.seq, chat_id))
+        else:
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._wakeup.set()
+
+    def _prune_buckets(self):
+        """Удалить состояние лимитов для неактивных чатов"""
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for chat_id in [cid for cid, bucket in self._chat_buckets.items()
+                        if cid not in self._chat_queues and cid not in self._busy and bucket.is_idle()]:
+            del self._chat_buckets[chat_id]
+
+    async def _run(self):
+        """Планировщик: выбирает следующий чат с учётом приоритета и лимитов"""
+        while True:
+            try:
+                await self._dispatch_next()
+            except Exception as e:
+                # Без планировщика все отправки ждали бы вечно - он не должен останавливаться
+                logger.exception(f"Ошибка планировщика исходящих сообщений: {e}")
+                await asyncio.sleep(0.1)
+
+    async def _dispatch_next(self):
+        """Запустить отправку следующего сообщения (или дождаться, когда оно появится)"""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, priority, seq, chat_id = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+
+        if not self._ready:
+            self._prune_buckets()
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        _, _, chat_id = heapq.heappop(self._ready)
+        if chat_id in self._busy or not self._chat_queues.get(chat_id):
+            return
+
+        # Лимит конкретного чата не позволяет - откладываем, берём следующий чат
+        chat_delay = self._chat_bucket(chat_id).delay()
+        if chat_delay > 0:
+            self._schedule_chat(chat_id, now + chat_delay)
+            return
+
+        # Глобальный лимит - ждём, но чат уже выбран по приоритету
+        global_delay = self._global.delay()
+        while global_delay > 0:
+            await asyncio.sleep(global_delay)
+            global_delay = self._global.delay()
+
+        await self._slots.acquire()
+        # Пока ждали, чат могли исключить (drop_chat) - очереди уже нет
+        queue = self._chat_queues.get(chat_id)
+        if not queue:
+            self._slots.release()
+            return
+        self._global.consume()
+        self._chat_bucket(chat_id).consume()
+        job = queue.popleft()
+        self._busy.add(chat_id)
+        task = asyncio.create_task(self._deliver(job))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _deliver(self, job: _Job):
+        """Выполнить один вызов Bot API и обработать ошибки"""
+        retry_at = 0.0
+        requeue = False
+        failure = None
+        try:
+            job.attempts += 1
+            result = await getattr(self._bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+            if not job.future.done():
+                job.future.set_result(result)
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            logger.warning(f"Flood control Telegram: пауза отправки на {delay} сек")
+            self._global.pause(delay)
+            # Повтор после RetryAfter не считается неудачной попыткой
+            job.attempts -= 1
+            requeue = True
+        except BadRequest as e:
+            # BadRequest наследуется от NetworkError, но повторять его бессмысленно
+            if not job.future.done():
+                job.future.set_exception(e)
+            failure = e
+        except NetworkError as e:
+            if job.attempts <= self.max_retries:
+                backoff = min(30.0, 0.5 * 2 ** (job.attempts - 1))
+                logger.warning(
+                    f"Сетевая ошибка при {job.method} в чат {job.chat_id}: {e}. "
+                    f"Повтор через {backoff} сек (попытка {job.attempts})"
+                )
+                retry_at = time.monotonic() + backoff
+                requeue = True
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            failure = e
+        finally:
+            if requeue and job.chat_id in unreachable:
+                # Чат исключили, пока шёл запрос - повторять некуда
+                metrics.outbound_skipped.inc(job.method)
+                if not job.future.done():
+                    job.future.set_exception(_unreachable_error(job.chat_id))
+                requeue = False
+            if requeue:
+                self._chat_queues.setdefault(job.chat_id, deque()).appendleft(job)
+            else:
+                self._pending -= 1
+            self._busy.discard(job.chat_id)
+            self._slots.release()
+            if failure is not None and is_permanent_failure(failure):
+                mark_unreachable(job.chat_id, failure)
+            self._schedule_chat(job.chat_id, retry_at)
+
+
+dispatcher = OutboundDispatcher(
+    global_rate=config.OUTBOUND_GLOBAL_RATE,
+    per_chat_rate=config.OUTBOUND_PER_CHAT_RATE,
+    per_chat_burst=config.OUTBOUND_PER_CHAT_BURST,
+    workers=config.OUTBOUND_WORKERS,
+    max_retries=config.OUTBOUND_MAX_RETRIES,
+    max_pending=config.OUTBOUND_MAX_PENDING,
+)
+
+
+# В кластере (cluster.py): объект с методами is_local(chat_id) и
+# send_remote(method, chat_id, priority, kwargs). Сообщения в чаты других
+# процессов передаются им, чтобы лимит на чат соблюдался в одном месте.
+router = None
+
+
+async def send(method: str, chat_id: int, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+    """Отправить произвольный метод Bot API через диспетчер"""
+    if operator_hook is not None and chat_id in operator_chats:
+        return await operator_hook(method, chat_id, kwargs)
+    if chat_id in unreachable:
+        metrics.outbound_skipped.inc(method)
+        raise _unreachable_error(chat_id)
+    if router is not None and not router.is_local(chat_id):
+        return await router.send_remote(method, chat_id, priority, kwargs)
+    return await dispatcher.send(method, chat_id, priority, **kwargs)
+
+
+async def send_message(chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+    """Отправить текстовое сообщение через диспетчер"""
+    return await send('send_message', chat_id, priority, text=text, **kwargs)
+
+
+async def send_photo(chat_id: int, photo, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+    """Отправить фото через диспетчер"""
+    return await send('send_photo', chat_id, priority, photo=photo, **kwargs)
+
+
+async def send_video(chat_id: int, video, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+    """Отправить видео через диспетчер"""
+    return await send('send_video', chat_id, priority, video=video, **kwargs)
+
+
+async def send_document(chat_id: int, document, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+    """Отправить документ через диспетчер"""
+    return await send('send_document', chat_id, priority, document=document, **kwargs)
@@ -0,0 +1,247 @@
+"""
+Сохранение состояния диалогов (ConversationHandler) и context.user_data в SQLite
+
+Пользователь, который был на середине регистрации или редактирования анкеты,
+после перезапуска бота продолжает с того же шага. В БД пишутся только
+изменившиеся ключи user_data (а не весь словарь целиком), запись идёт пачкой
+раз в update_interval секунд в отдельном потоке и не задерживает обработку
+обновлений. Заброшенные диалоги и данные пользователей со временем удаляются.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для python-telegram-bot: user_data и состояния диалогов в SQLite"""
+
+    def __init__(self, path: str, user_data_ttl: int, conversation_ttl: int, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self.user_data_ttl = user_data_ttl
+        self.conversation_ttl = conversation_ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        # Последние записанные значения {user_id: {ключ: json}} - чтобы писать только изменения
+        self._snapshots = {}
+        # Время последней активности пользователя {user_id: unix time}
+        self._touched = {}
+        # В кластере: функция user_id -> bool, загружать только своих пользователей
+        self.owns_user = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS ptb_user_data ('
+                ' user_id INTEGER NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' value TEXT NOT NULL,'
+                ' updated_at REAL NOT NULL,'
+                ' PRIMARY KEY (user_id, key))'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS ptb_conversations ('
+                ' name TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' state TEXT NOT NULL,'
+                ' updated_at REAL NOT NULL,'
+                ' PRIMARY KEY (name, key))'
+            )
+        return self._conn
+
+    def _execute(self, func, *args):
+        with self._lock:
+            return func(self._connect(), *args)
+
+    async def _run(self, func, *args):
+        """Выполнить работу с SQLite в отдельном потоке, не блокируя event loop"""
+        return await asyncio.to_thread(self._execute, func, *args)
+
+    # ========== user_data ==========
+
+    @staticmethod
+    def _load_user_data(conn, not_before):
+        # При запуске заодно удаляем данные тех, кто давно не появлялся
+        conn.execute('DELETE FROM ptb_user_data WHERE updated_at <= ?', (not_before,))
+        return conn.execute('SELECT user_id, key, value, updated_at FROM ptb_user_data').fetchall()
+
+    async def get_user_data(self):
+        rows = await self._run(self._load_user_data, time.time() - self.user_data_ttl)
+        user_data = {}
+        for user_id, key, value, updated_at in rows:
+            if self.owns_user and not self.owns_user(user_id):
+                continue
+            user_data.setdefault(user_id, {})[key] = json.loads(value)
+            self._snapshots.setdefault(user_id, {})[key] = value
+            self._touched[user_id] = max(self._touched.get(user_id, 0), updated_at)
+        logger.info(f"Загружены данные {len(user_data)} пользователей")
+        return user_data
+
+    @staticmethod
+    def _write_user_data(conn, user_id, changed, removed, now):
+        conn.execute('BEGIN')
+        try:
+            if changed:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO ptb_user_data (user_id, key, value, updated_at) VALUES (?, ?, ?, ?)',
+                    [(user_id, key, value, now) for key, value in changed.items()]
+                )
+            if removed:
+                conn.executemany(
+                    'DELETE FROM ptb_user_data WHERE user_id = ? AND key = ?',
+                    [(user_id, key) for key in removed]
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    async def update_user_data(self, user_id: int, data: dict):
+        snapshot = self._snapshots.get(user_id, {})
+        current = {}
+        for key, value in data.items():
+            try:
+                current[str(key)] = json.dumps(value, ensure_ascii=False, sort_keys=True)
+            except (TypeError, ValueError):
+                logger.warning(f"user_data[{key!r}] пользователя {user_id} не сериализуется в JSON, не сохраняем")
+
+        # Метод вызывается для всех пользователей, от которых были обновления
+        now = time.time()
+        self._touched[user_id] = now
+
+        changed = {key: value for key, value in current.items() if snapshot.get(key) != value}
+        removed = [key for key in snapshot if key not in current]
+        if not changed and not removed:
+            return
+
+        await self._run(self._write_user_data, user_id, changed, removed, now)
+        if current:
+            self._snapshots[user_id] = current
+        else:
+            self._snapshots.pop(user_id, None)
+
+    async def drop_user_data(self, user_id: int):
+        await self._run(lambda conn: conn.execute('DELETE FROM ptb_user_data WHERE user_id = ?', (user_id,)))
+        self._snapshots.pop(user_id, None)
+        self._touched.pop(user_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    def expired_user_ids(self, user_ids) -> list:
+        """Пользователи из user_ids, от которых не было обновлений дольше user_data_ttl"""
+        now = time.time()
+        cutoff = now - self.user_data_ttl
+        # Кого видим впервые (ещё не было записи persistence) - отсчитываем от текущего момента
+        return [user_id for user_id in user_ids if self._touched.setdefault(user_id, now) < cutoff]
+
+    # ========== Диалоги ==========
+
+    async def get_conversations(self, name: str):
+        not_before = time.time() - self.conversation_ttl
+        rows = await self._run(lambda conn: conn.execute(
+            'SELECT key, state FROM ptb_conversations WHERE name = ? AND updated_at > ?',
+            (name, not_before)
+        ).fetchall())
+        conversations = {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+        if self.owns_user:
+            # Ключ диалога - (chat_id, user_id)
+            conversations = {key: state for key, state in conversations.items() if self.owns_user(key[-1])}
+        return conversations
+
+    async def update_conversation(self, name: str, key, new_state):
+        key_json = json.dumps(list(key))
+        if new_state is None:
+            await self._run(lambda conn: conn.execute(
+                'DELETE FROM ptb_conversations WHERE name = ? AND key = ?',
+                (name, key_json)
+            ))
+        else:
+            await self._run(lambda conn: conn.execute(
+                'INSERT OR REPLACE INTO ptb_conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)',
+                (name, key_json, json.dumps(new_state), time.time())
+            ))
+
+    # ========== Очистка ==========
+
+    def _purge_conversations(self, conn):
+        return conn.execute(
+            'DELETE FROM ptb_conversations WHERE updated_at <= ?', (time.time() - self.conversation_ttl,)
+        ).rowcount
+
+    async def expire_job(self, context):
+        """Периодическая задача: забыть заброшенные диалоги и user_data"""
+        application = context.application
+        expired = self.expired_user_ids(list(application.user_data))
+        for user_id in expired:
+            application.drop_user_data(user_id)
+            self._touched.pop(user_id, None)
+            self._snapshots.pop(user_id, None)
+
+        # user_data удалится из БД при следующей записи persistence (drop_user_data)
+        conversations = await self._run(self._purge_conversations)
+        if expired or conversations:
+            logger.info(f"Очистка persistence: user_data пользователей {len(expired)}, диалогов {conversations}")
+
+    # ========== Не используются (chat_data, bot_data, callback_data не сохраняются) ==========
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        """Закрыть соединение (вызывается при остановке бота после последней записи)"""
+        def close(_conn):
+            self._conn.close()
+            self._conn = None
+
+        if self._conn is not None:
+            await self._run(close)
+
+
+def create_persistence() -> SQLitePersistence:
+    """Persistence согласно настройкам"""
+    return SQLitePersistence(
+        path=config.STATE_DB_PATH,
+        user_data_ttl=config.USER_DATA_TTL,
+        conversation_ttl=config.CONVERSATION_TIMEOUT,
+        update_interval=config.PERSISTENCE_UPDATE_INTERVAL
+    )
@@ -0,0 +1,415 @@
+"""
+Работа с фотографиями анкет
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+from telegram import InputFile, InputMediaPhoto
+from telegram.error import BadRequest
+
+import config
+import database as db
+import metrics
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз ждать, пока сборщик мусора удалит запись о таком же фото
+BLOB_ACQUIRE_ATTEMPTS = 10
+
+# Пул процессов для обработки изображений (создаётся при первой загрузке фото)
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=config.PHOTO_WORKERS)
+    return _executor
+
+
+def shutdown():
+    """Остановить пул процессов обработки фото"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def thumbnail_key(photo_key: str) -> str:
+    """Ключ миниатюры для фото анкеты"""
+    base, _ = os.path.splitext(photo_key)
+    return f"{base}_thumb.jpg"
+
+
+def process_photo(data: bytes, max_side: int, quality: int, thumb_side: int):
+    """
+    Нормализовать фото (выполняется в отдельном процессе)
+
+    Поворачивает по EXIF, убирает метаданные, уменьшает до max_side,
+    пересжимает в JPEG и делает миниатюру.
+
+    Returns:
+        (байты фото, байты миниатюры)
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        rotated = original.getexif().get(0x0112, 1) != 1  # тег Orientation
+        oriented = ImageOps.exif_transpose(original)
+        changed = rotated or max(oriented.size) > max_side or original.format != 'JPEG'
+
+        image = oriented.convert('RGB') if oriented.mode != 'RGB' else oriented
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        # Без параметров exif/icc_profile метаданные в файл не попадают
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+        photo_bytes = output.getvalue()
+
+        thumb = image.copy()
+        thumb.thumbnail((thumb_side, thumb_side), Image.LANCZOS)
+        thumb_output = io.BytesIO()
+        thumb.save(thumb_output, 'JPEG', quality=quality, optimize=True)
+
+    # Telegram уже присылает сжатые JPEG без метаданных: если поворачивать
+    # и уменьшать не нужно, а пересжатие только увеличило файл - оставляем исходник
+    if not changed and len(photo_bytes) >= len(data):
+        photo_bytes = data
+    return photo_bytes, thumb_output.getvalue()
+
+
+def _load_font(font_path: str, size: int):
+    try:
+        return ImageFont.truetype(font_path, size)
+    except (OSError, TypeError):
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1
+            return ImageFont.load_default()
+
+
+def render_contact_sheet(tiles, columns: int, tile_side: int, quality: int, font_path: str = None) -> bytes:
+    """
+    Собрать миниатюры анкет в одну картинку-сетку (выполняется в отдельном процессе)
+    
+    Args:
+        tiles: список (байты фото или None, подпись из одной-двух строк)
+        columns: анкет в ряду
+        tile_side: сторона квадратной миниатюры
+        quality: качество JPEG
+        font_path: путь к TTF-шрифту для подписей
+    
+    Returns:
+        байты JPEG
+    """
+    font_size = max(tile_side // 14, 10)
+    font = _load_font(font_path, font_size)
+    padding = 4
+    label_height = 2 * (font_size + padding) + padding
+    cell_height = tile_side + label_height
+    columns = max(1, min(columns, len(tiles)))
+    rows = (len(tiles) + columns - 1) // columns
+
+    sheet = Image.new('RGB', (columns * tile_side, rows * cell_height), 'white')
+    draw = ImageDraw.Draw(sheet)
+
+    for index, (data, label) in enumerate(tiles):
+        x = (index % columns) * tile_side
+        y = (index // columns) * cell_height
+
+        tile = None
+        if data:
+            try:
+                with Image.open(io.BytesIO(data)) as image:
+                    image = ImageOps.exif_transpose(image).convert('RGB')
+                    tile = ImageOps.fit(image, (tile_side, tile_side), Image.LANCZOS)
+            except Exception:
+                tile = None
+        if tile is None:
+            tile = Image.new('RGB', (tile_side, tile_side), (200, 200, 200))
+        sheet.paste(tile, (x, y))
+
+        for line_no, line in enumerate(label.split('\n')[:2]):
+            # Обрезаем подпись, чтобы она не заезжала на соседнюю ячейку
+            if draw.textlength(line, font=font) > tile_side - 2 * padding:
+                while line and draw.textlength(line + '…', font=font) > tile_side - 2 * padding:
+                    line = line[:-1]
+                line += '…'
+            draw.text(
+                (x + padding, y + tile_side + padding + line_no * (font_size + padding)),
+                line,
+                fill='black',
+                font=font
+            )
+
+    output = io.BytesIO()
+    sheet.save(output, 'JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def blob_key(digest: str) -> str:
+    """
+    Ключ файла фото в хранилище по хэшу содержимого
+
+    Файлы раскладываются по двум уровням подкаталогов (ab/cd/abcd....jpg),
+    чтобы ни в одном каталоге не было слишком много файлов.
+    """
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+
+
+async def store_photo(photo_bytes: bytes, thumb_bytes: bytes = None) -> str:
+    """
+    Сохранить фото в хранилище и увеличить счётчик ссылок
+
+    Одинаковые фото (например, одна картинка для нескольких анкет)
+    хранятся в одном экземпляре.
+
+    Returns:
+        ключ файла, который записывается в photo_path анкеты
+    """
+    digest = hashlib.sha256(photo_bytes).hexdigest()
+    key = blob_key(digest)
+
+    # Сначала ссылка, потом файл: сборщик мусора удаляет только захваченные им записи
+    for attempt in range(BLOB_ACQUIRE_ATTEMPTS):
+        created = db.acquire_photo_blob(digest, key, len(photo_bytes))
+        if created is not None:
+            break
+        # Такое же фото сейчас удаляет сборщик мусора - ждём, пока он удалит запись
+        await asyncio.sleep(0.2 * (attempt + 1))
+    else:
+        raise storage.StorageError(f"Фото {digest[:12]} удаляется сборщиком мусора")
+
+    # Новая запись - файла могло не остаться после прошлой сборки мусора, пишем всегда
+    if created or not await storage.backend.exists(key):
+        await storage.backend.put(key, photo_bytes)
+    else:
+        logger.info(f"Фото {digest[:12]} уже есть в хранилище, повторно не сохраняем")
+    if thumb_bytes and (created or not await storage.backend.exists(thumbnail_key(key))):
+        await storage.backend.put(thumbnail_key(key), thumb_bytes)
+    return key
+
+
+def release_photo(key: str):
+    """Освободить фото анкеты (после замены фото); файл удалит сборщик мусора"""
+    if key:
+        db.release_photo_blob(key)
+
+
+async def _delete_files(*keys):
+    for key in keys:
+        try:
+            await storage.backend.delete(key)
+        except Exception as e:
+            logger.error(f"Не удалось удалить файл {key}: {e}")
+
+
+async def collect_garbage(grace_seconds: int = 3600) -> int:
+    """Удалить файлы фото, на которые не ссылается ни одна анкета"""
+    older_than = datetime.now() - timedelta(seconds=grace_seconds)
+    removed = 0
+    freed = 0
+    for blob in db.get_unreferenced_photo_blobs(older_than):
+        # Сначала захват записи, потом файл, потом запись: загрузка того же фото
+        # в это время дождётся удаления записи и запишет файл заново
+        if not db.claim_photo_blob(blob.hash, blob.updated_at):
+            continue
+        await _delete_files(blob.path, thumbnail_key(blob.path))
+        db.delete_photo_blob(blob.hash)
+        removed += 1
+        freed += blob.size
+    if removed:
+        logger.info(f"Сборка мусора фото: удалено файлов {removed}, освобождено {freed} байт")
+    return removed
+
+
+async def collect_garbage_job(context):
+    """Периодическая задача сборки мусора фото"""
+    await collect_garbage(config.PHOTO_GC_GRACE)
+
+
+async def ingest_telegram_photo(bot, photo) -> dict:
+    """
+    Скачать фото из Telegram, обработать и положить в хранилище вместе с миниатюрой
+
+    Returns:
+        dict с путями и размерами до/после обработки
+    """
+    file = await bot.get_file(photo.file_id)
+    data = bytes(await file.download_as_bytearray())
+
+    loop = asyncio.get_running_loop()
+    try:
+        photo_bytes, thumb_bytes = await loop.run_in_executor(
+            _get_executor(),
+            process_photo,
+            data,
+            config.PHOTO_MAX_SIDE,
+            config.PHOTO_JPEG_QUALITY,
+            config.PHOTO_THUMB_SIDE
+        )
+    except Exception as e:
+        # Не удалось обработать - сохраняем как есть, без миниатюры
+        logger.error(f"Ошибка обработки фото {photo.file_id}: {e}")
+        photo_bytes, thumb_bytes = data, None
+
+    file_path = await store_photo(photo_bytes, thumb_bytes)
+    thumb_file_path = thumbnail_key(file_path) if thumb_bytes else None
+
+    saved_bytes = len(data) - len(photo_bytes)
+    logger.info(
+        f"Фото сохранено: {file_path}, {len(data)} -> {len(photo_bytes)} байт "
+        f"(сэкономлено {saved_bytes}), миниатюра: {len(thumb_bytes) if thumb_bytes else 0} байт"
+    )
+    return {
+        'path': file_path,
+        'thumb_path': thumb_file_path,
+        'original_bytes': len(data),
+        'bytes': len(photo_bytes),
+        'saved_bytes': saved_bytes,
+    }
+
+
+@asynccontextmanager
+async def _photo_upload(key: str, attach: bool = False):
+    """Фото из хранилища для загрузки в Telegram: файл читается частями во время запроса"""
+    async with storage.backend.open(key) as f:
+        yield InputFile(f, filename=os.path.basename(key), attach=attach, read_file_handle=False)
+
+
+def is_file_id_error(error: BadRequest) -> bool:
+    """Ошибка из-за недействительного file_id (а не подписи, клавиатуры и т.п.)"""
+    text = error.message.lower()
+    return 'file identifier' in text or 'file reference' in text or 'file_id' in text
+
+
+async def reply_profile_photo(message, user, caption: str, reply_markup=None):
+    """
+    Отправить фото анкеты в ответ на сообщение
+
+    Если у анкеты уже есть file_id от Telegram, фото отправляется по нему
+    (без чтения из хранилища и повторной загрузки). Иначе файл загружается,
+    а file_id из ответа сохраняется для следующих отправок.
+    """
+    if user.photo_file_id:
+        metrics.cache_hit('photo_file_id')
+        try:
+            return await message.reply_photo(
+                photo=user.photo_file_id,
+                caption=caption,
+                reply_markup=reply_markup
+            )
+        except BadRequest as e:
+            if not is_file_id_error(e):
+                raise
+            # file_id стал недействительным - сбрасываем и загружаем файл заново
+            logger.warning(f"file_id фото анкеты {user.id} недействителен: {e}")
+            db.set_photo_file_id(user.id, user.telegram_id, None)
+            user.photo_file_id = None
+
+    metrics.cache_miss('photo_file_id')
+    async with _photo_upload(user.photo_path) as photo:
+        sent = await message.reply_photo(
+            photo=photo,
+            caption=caption,
+            reply_markup=reply_markup
+        )
+
+    if sent.photo:
+        file_id = sent.photo[-1].file_id
+        db.set_photo_file_id(user.id, user.telegram_id, file_id)
+        user.photo_file_id = file_id
+    return sent
+
+
+async def _album_media(items, files: AsyncExitStack):
+    media = []
+    for user, caption in items:
+        photo = user.photo_file_id or await files.enter_async_context(_photo_upload(user.photo_path, attach=True))
+        media.append(InputMediaPhoto(media=photo, caption=caption))
+    return media
+
+
+async def reply_profiles_album(message, users, captions):
+    """
+    Отправить до 10 анкет одним альбомом (один запрос к API вместо десяти)
+
+    Анкеты, фото которых недоступно, пропускаются.
+
+    Returns:
+        список анкет, попавших в альбом
+    """
+    items = []
+    for user, caption in zip(users, captions):
+        if not user.photo_file_id and not (user.photo_path and await storage.backend.exists(user.photo_path)):
+            logger.error(f"Фото анкеты {user.id} не найдено: {user.photo_path}")
+            continue
+        items.append((user, caption))
+    if not items:
+        return []
+    if len(items) == 1:
+        # В альбоме должно быть от 2 до 10 фото
+        await reply_profile_photo(message, *items[0])
+        return [items[0][0]]
+
+    try:
+        async with AsyncExitStack() as files:
+            messages = await message.reply_media_group(media=await _album_media(items, files))
+    except BadRequest as e:
+        if not is_file_id_error(e) or not any(user.photo_file_id for user, _ in items):
+            raise
+        # Какой-то из file_id недействителен - загружаем все фото альбома заново
+        logger.warning(f"Ошибка отправки альбома по file_id: {e}")
+        for user, _ in items:
+            if user.photo_file_id:
+                db.set_photo_file_id(user.id, user.telegram_id, None)
+                user.photo_file_id = None
+        async with AsyncExitStack() as files:
+            messages = await message.reply_media_group(media=await _album_media(items, files))
+
+    for (user, _), sent in zip(items, messages):
+        if sent.photo and user.photo_file_id != sent.photo[-1].file_id:
+            db.set_photo_file_id(user.id, user.telegram_id, sent.photo[-1].file_id)
+            user.photo_file_id = sent.photo[-1].file_id
+    return [user for user, _ in items]
+
+
+async def _read_thumbnail(user):
+    """Миниатюра фото анкеты (или само фото для старых анкет без миниатюры)"""
+    if not user.photo_path:
+        return None
+    for key in (thumbnail_key(user.photo_path), user.photo_path):
+        try:
+            return await storage.backend.get(key)
+        except storage.StorageError:
+            continue
+        except Exception as e:
+            logger.error(f"Ошибка чтения фото {key}: {e}")
+            return None
+    return None
+
+
+async def build_contact_sheet(users, labels) -> bytes:
+    """
+    Картинка-сетка из миниатюр анкет с подписями (для обзора в админке)
+    
+    Returns:
+        байты JPEG
+    """
+    thumbnails = await asyncio.gather(*(_read_thumbnail(user) for user in users))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(),
+        render_contact_sheet,
+        list(zip(thumbnails, labels)),
+        config.CONTACT_SHEET_COLUMNS,
+        config.CONTACT_SHEET_TILE_SIDE,
+        config.PHOTO_JPEG_QUALITY,
+        config.CONTACT_SHEET_FONT
+    )
@@ -0,0 +1,254 @@
+"""
+Запись входящих обновлений для воспроизведения нагрузки (loadtest.replay)
+
+Включается настройкой RECORD_UPDATES_DIR. Каждое обновление (группа -3,
+раньше всех обработчиков) превращается в JSON Bot API, очищается от
+персональных данных и копится в памяти; раз в RECORD_FLUSH_INTERVAL сек
+накопленное дописывается в отдельном потоке в сжатый файл
+updates-<время>-w<воркер>.jsonl.gz (строка: {"ts": время получения,
+"update": обновление}). Файл сменяется при RECORD_MAX_BYTES или раз в
+RECORD_ROTATE_INTERVAL сек, хранятся последние RECORD_KEEP_FILES файлов.
+
+Для каждого пользователя, впервые встреченного в файле, туда же
+дописывается строка {"ts", "user": {псевдоним, id в БД, пол, время
+регистрации, есть ли подписка}} - по ним воспроизведение заводит в пустой
+БД тех же пользователей, и обновления доходят до тех же обработчиков.
+
+Очистка (scrub):
+- telegram_id пользователей и чатов заменяются псевдонимами (HMAC с
+  ключом RECORD_SALT): переписка одного человека остаётся связной, но
+  настоящий id не восстановить;
+- имена заменяются на "User", username, фамилия, телефон, контакт,
+  геопозиция и данные заказа удаляются;
+- в текстах и подписях буквы заменяются на "x", а цифры на "0" (длина
+  сохраняется, короткие числа вроде возраста - как есть); кнопки меню и
+  команды остаются, чтобы при воспроизведении работали те же обработчики.
+callback_data и file_id не меняются.
+"""
+import asyncio
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from datetime import datetime
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import config
+import database as db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ключи, которые удаляются из обновления целиком
+DROPPED_KEYS = frozenset({
+    'last_name', 'username', 'phone_number', 'contact', 'location', 'venue', 'order_info',
+    'shipping_address', 'email', 'bio', 'language_code',
+})
+# Ключи с текстом пользователя
+TEXT_KEYS = frozenset({'text', 'caption', 'title', 'description', 'query'})
+# Числа до такой длины (возраст, сумма доната) в тексте сохраняются
+KEPT_NUMBER_LENGTH = 6
+
+_NUMBER = re.compile(r'^\d+$')
+_LETTER = re.compile(r'[^\W\d_]')
+_DIGIT = re.compile(r'\d')
+
+
+class UpdateRecorder:
+    """Очистка и запись обновлений в ротируемые файлы"""
+
+    def __init__(self, directory: str, salt: str, worker: int, max_bytes: int, rotate_interval: int,
+                 keep_files: int, kept_texts=()):
+        self.directory = directory
+        self.worker = worker
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.keep_files = keep_files
+        self.kept_texts = frozenset(kept_texts)
+        self._key = (salt or secrets.token_hex(16)).encode()
+        self._pseudonyms = {}
+        self._lines = []
+        self._known = set()  # telegram_id, чьи данные уже есть в текущем файле
+        self._new_users = []
+        self._senders = set()  # telegram_id отправителей ещё не записанных обновлений
+        self._path = None
+        self._opened_at = 0.0
+
+    @property
+    def pending(self) -> int:
+        return len(self._lines)
+
+    # ========== Очистка ==========
+
+    def pseudonym(self, telegram_id: int) -> int:
+        """Постоянный для ключа псевдоним telegram_id (в диапазоне id пользователей Telegram)"""
+        pseudonym = self._pseudonyms.get(telegram_id)
+        if pseudonym is None:
+            digest = hmac.new(self._key, str(telegram_id).encode(), hashlib.sha256).digest()
+            pseudonym = 1_000_000_000 + int.from_bytes(digest[:8], 'big') % 8_000_000_000
+            if len(self._pseudonyms) < 100000:
+                self._pseudonyms[telegram_id] = pseudonym
+        return pseudonym
+
+    def scrub_text(self, text: str) -> str:
+        if text in self.kept_texts or text.startswith('/'):
+            return text
+        if _NUMBER.match(text) and len(text) <= KEPT_NUMBER_LENGTH:
+            return text
+        return _DIGIT.sub('0', _LETTER.sub('x', text))
+
+    def scrub(self, value):
+        """Копия объекта Bot API без персональных данных"""
+        if isinstance(value, list):
+            return [self.scrub(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        # Пользователь или чат
+        identity = 'first_name' in value or 'is_bot' in value or value.get('type') == 'private'
+        result = {}
+        for key, item in value.items():
+            if key in DROPPED_KEYS:
+                continue
+            if identity and key == 'id' and isinstance(item, int):
+                result[key] = self.pseudonym(item) if item > 0 else item
+            elif identity and key == 'first_name':
+                result[key] = 'User'
+            elif key in TEXT_KEYS and isinstance(item, str):
+                result[key] = self.scrub_text(item)
+            else:
+                result[key] = self.scrub(item)
+        return result
+
+    # ========== Запись ==========
+
+    def add(self, update: Update):
+        data = self.scrub(update.to_dict())
+        self._lines.append(json.dumps({'ts': round(time.time(), 3), 'update': data},
+                                      ensure_ascii=False, separators=(',', ':')))
+        user = update.effective_user
+        if user is None:
+            return
+        self._senders.add(user.id)
+        if user.id not in self._known:
+            # Данные пользователя из БД допишет flush (не в цикле событий)
+            self._known.add(user.id)
+            self._new_users.append(user.id)
+
+    def _user_lines(self, telegram_ids: list) -> list:
+        now = round(time.time(), 3)
+        try:
+            rows = db.get_users_brief(telegram_ids)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать данные {len(telegram_ids)} пользователей для записи: {e}")
+            return []
+        return [
+            json.dumps({'ts': now, 'user': {
+                'id': self.pseudonym(telegram_id),
+                'user_id': user_id,
+                'gender': gender,
+                'registered_at': round(registered_at.timestamp(), 3) if registered_at else None,
+                'subscribed': bool(subscribed),
+            }}, separators=(',', ':'))
+            for telegram_id, user_id, gender, registered_at, subscribed in rows
+        ]
+
+    def _rotate_if_needed(self) -> bool:
+        now = time.time()
+        if self._path is not None and now - self._opened_at < self.rotate_interval:
+            try:
+                if os.path.getsize(self._path) < self.max_bytes:
+                    return False
+            except OSError:
+                pass
+        os.makedirs(self.directory, exist_ok=True)
+        self._path = os.path.join(self.directory, f"updates-{datetime.now():%Y%m%d-%H%M%S}-w{self.worker}.jsonl.gz")
+        self._opened_at = now
+        # Старые файлы этого воркера (имена сортируются по времени)
+        files = sorted(glob.glob(os.path.join(self.directory, f'updates-*-w{self.worker}.jsonl.gz')))
+        for path in files[:-self.keep_files] if self.keep_files > 0 else []:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить старую запись обновлений {path}: {e}")
+        return True
+
+    def _write(self, lines: list, users: list, senders: set) -> bool:
+        rotated = self._rotate_if_needed()
+        if rotated:
+            # Новый файл воспроизводится сам по себе: данные нужны обо всех отправителях из него
+            users = list(senders)
+        lines = lines + self._user_lines(users)
+        # Каждая запись - отдельный член gzip: файл читается целиком даже после аварийной остановки
+        with gzip.open(self._path, 'at', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return rotated
+
+    async def flush(self) -> int:
+        """Дописать накопленные обновления в файл (в отдельном потоке)"""
+        if not self._lines:
+            return 0
+        lines, self._lines = self._lines, []
+        users, self._new_users = self._new_users, []
+        senders, self._senders = self._senders, set()
+        try:
+            rotated = await asyncio.to_thread(self._write, lines, users, senders)
+        except Exception as e:
+            logger.error(f"Не удалось записать {len(lines)} обновлений в {self._path}: {e}")
+            # Данные этих пользователей в файл не попали
+            self._known.difference_update(users)
+            return 0
+        if rotated:
+            # В новом файле уже есть записанные отправители; встреченных во время записи допишет следующий flush
+            self._known = senders | set(self._new_users)
+        return len(lines)
+
+
+# UpdateRecorder, если запись включена
+writer = None
+
+
+def install(application, kept_texts=()):
+    """Включить запись, если задан RECORD_UPDATES_DIR (до запуска приложения)"""
+    global writer
+    if not config.RECORD_UPDATES_DIR:
+        return
+    from telegram.ext import TypeHandler
+
+    writer = UpdateRecorder(
+        directory=config.RECORD_UPDATES_DIR,
+        salt=config.RECORD_SALT,
+        worker=config.CLUSTER_WORKER_INDEX,
+        max_bytes=config.RECORD_MAX_BYTES,
+        rotate_interval=config.RECORD_ROTATE_INTERVAL,
+        keep_files=config.RECORD_KEEP_FILES,
+        kept_texts=kept_texts,
+    )
+    application.add_handler(TypeHandler(Update, record_update), group=-3)
+    if not config.RECORD_SALT:
+        logger.warning("RECORD_SALT не задан: псевдонимы пользователей будут разными после перезапуска")
+    logger.info(f"Запись обновлений включена: {config.RECORD_UPDATES_DIR}")
+
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запомнить обновление для записи (группа -3)"""
+    writer.add(update)
+    metrics.recorded_updates.inc()
+
+
+async def flush():
+    """Дописать накопленное (задача и остановка бота)"""
+    if writer is not None:
+        await writer.flush()
+
+
+async def flush_job(context):
+    """Периодическая задача записи обновлений"""
+    await flush()
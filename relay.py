@@ -0,0 +1,414 @@
+"""
+Пересылка сообщений между собеседниками в чатах
+
+Обработчик не ждёт ни Telegram, ни БД: forward() ставит сообщение в
+очередь и сразу возвращается. Очередь FIFO заведена на каждое направление
+разговора (отправитель -> собеседник), и у каждой непустой очереди своя
+задача, которая отправляет сообщения строго по одному. Поэтому собеседник
+получает сообщения в том порядке, в каком они были написаны, а чат,
+упёршийся в лимит Telegram, не задерживает остальные.
+
+Сообщение сначала пересылается, потом сохраняется: записи копятся в буфере
+и вставляются в БД пачками (RELAY_BATCH_SIZE строк или раз в
+RELAY_FLUSH_INTERVAL сек) в отдельном потоке, так что скорость БД на
+пересылку не влияет. Неудачная запись повторяется, а то, что не удалось
+записать к остановке бота, сохраняется в RELAY_SPOOL_PATH и попадает в БД
+при следующем запуске.
+
+Фото, видео и файлы пересылаются через copy_message. Элементы альбома
+(одинаковый media_group_id) приходят отдельными обновлениями: relay копит их,
+пока RELAY_ALBUM_WINDOW сек не придёт следующий, и отправляет альбом одним
+send_media_group с одной записью в истории чата.
+
+Собеседник отправителя берётся из таблицы маршрутов в памяти
+(telegram_id -> Route), которую заполняет открытие чата. После перезапуска
+маршрут восстанавливается одним запросом к БД при первом сообщении.
+
+Сообщения анкетам, которые ведут админы, relay не отправляет, а отдаёт
+operator_hook вместе с отправителем - они попадают во входящие операторов.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import config
+import database as db
+import metrics
+import outbound
+
+logger = logging.getLogger(__name__)
+
+# Что пересылается (для сообщения об ошибке отправителю)
+_WHAT = {
+    'send_message': 'сообщение',
+    'send_photo': 'фото',
+    'send_video': 'видео',
+    'send_document': 'файл',
+    'copy_message': 'вложение',
+    'send_media_group': 'альбом',
+}
+
+# Больше элементов в одном альбоме Telegram не принимает
+ALBUM_MAX_ITEMS = 10
+
+
+class Route:
+    """Собеседник отправителя"""
+
+    __slots__ = ('partner_id', 'partner_telegram_id')
+
+    def __init__(self, partner_id: int, partner_telegram_id: int):
+        self.partner_id = partner_id
+        self.partner_telegram_id = partner_telegram_id
+
+
+class _Relayed:
+    """Сообщение в очереди пересылки: вызов Bot API и запись для истории чата"""
+
+    __slots__ = ('from_user_id', 'from_telegram_id', 'route', 'method', 'kwargs', 'record',
+                 'created_at', 'received_at')
+
+    def __init__(self, sender, route: Route, method: str, kwargs: dict, record: str):
+        self.from_user_id = sender.id
+        self.from_telegram_id = sender.telegram_id
+        self.route = route
+        self.method = method
+        self.kwargs = kwargs
+        self.record = record
+        self.created_at = datetime.now()
+        self.received_at = time.monotonic()
+
+    def row(self):
+        """Строка для messages или None, если сообщение служебное и в историю не пишется"""
+        if self.record is None:
+            return None
+        return {
+            'from_user_id': self.from_user_id,
+            'to_user_id': self.route.partner_id,
+            'text': self.record,
+            'created_at': self.created_at,
+        }
+
+
+class _Album:
+    """Альбом, элементы которого ещё собираются"""
+
+    __slots__ = ('sender', 'route', 'header', 'reply_markup', 'media', 'captions',
+                 'created_at', 'received_at', 'timer')
+
+    def __init__(self, sender, route: Route, header: str, reply_markup):
+        self.sender = sender
+        self.route = route
+        self.header = header
+        self.reply_markup = reply_markup
+        self.media = []
+        self.captions = []
+        self.created_at = datetime.now()
+        self.received_at = time.monotonic()
+        self.timer = None
+
+
+class ChatRelay:
+    """Таблица маршрутов, очереди пересылки и пакетная запись сообщений в БД"""
+
+    def __init__(self, batch_size: int, flush_interval: float, routes_size: int, spool_path: str,
+                 album_window: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.routes_size = routes_size
+        self.spool_path = spool_path
+        self.album_window = album_window
+
+        self._routes = OrderedDict()  # {telegram_id: Route}, LRU
+        self._queues = {}  # {(telegram_id отправителя, telegram_id собеседника): deque[_Relayed]}
+        self._albums = {}  # {(telegram_id отправителя, media_group_id): _Album}
+        self._workers = set()
+        self._pending = 0
+        self._unsaved = []  # строки для INSERT в messages
+        self._flush_wakeup = asyncio.Event()
+        self._writer = None
+        self._closing = False
+        # Корутина (from_user_id, profile_id, method, kwargs, record) для сообщений
+        # анкетам операторов (telegram_id в outbound.operator_chats), см. operator_inbox.py
+        self.operator_hook = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def unsaved(self) -> int:
+        return len(self._unsaved)
+
+    # ========== Маршруты ==========
+
+    def connect(self, telegram_id: int, partner):
+        """Пользователь открыл чат с partner"""
+        self._remember(telegram_id, Route(partner.id, partner.telegram_id))
+
+    def disconnect(self, telegram_id: int):
+        """Пользователь вышел из чата"""
+        self._routes.pop(telegram_id, None)
+
+    def route(self, telegram_id: int, partner_id: int):
+        """Маршрут к собеседнику partner_id или None, если такого пользователя нет"""
+        route = self._routes.get(telegram_id)
+        if route is not None and route.partner_id == partner_id:
+            self._routes.move_to_end(telegram_id)
+            metrics.cache_hit('relay_route')
+            return route
+        metrics.cache_miss('relay_route')
+
+        partner = db.get_user_by_id(partner_id)
+        if partner is None:
+            self._routes.pop(telegram_id, None)
+            return None
+        route = Route(partner.id, partner.telegram_id)
+        self._remember(telegram_id, route)
+        return route
+
+    def _remember(self, telegram_id: int, route: Route):
+        self._routes[telegram_id] = route
+        self._routes.move_to_end(telegram_id)
+        while len(self._routes) > self.routes_size:
+            self._routes.popitem(last=False)
+
+    # ========== Пересылка ==========
+
+    def forward(self, sender, route: Route, method: str, record: str, **kwargs):
+        """
+        Переслать собеседнику (не дожидаясь отправки)
+
+        Args:
+            sender: пользователь-отправитель (User)
+            route: маршрут к собеседнику (см. route())
+            method: метод Bot API - send_message, send_photo и т.п.
+            record: текст сообщения для истории чата в БД (None - не записывать)
+            **kwargs: аргументы метода Bot API, кроме chat_id
+        """
+        # Альбом, который отправитель начал раньше, уходит раньше этого сообщения
+        self._flush_albums(sender.telegram_id)
+        self._enqueue(_Relayed(sender, route, method, kwargs, record))
+
+    def forward_album_item(self, sender, route: Route, media_group_id: str, media, caption: str,
+                           header: str, reply_markup=None):
+        """
+        Добавить элемент альбома; альбом уйдёт собеседнику одним send_media_group
+
+        Args:
+            media_group_id: идентификатор альбома из сообщения
+            media: InputMediaPhoto, InputMediaVideo или InputMediaDocument без подписи
+            caption: подпись пользователя к этому элементу
+            header: начало подписи альбома (кто отправил)
+            reply_markup: клавиатура - send_media_group её не поддерживает,
+                поэтому она уходит отдельным сообщением после альбома
+        """
+        key = (sender.telegram_id, media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = _Album(sender, route, header, reply_markup)
+        album.media.append(media)
+        if caption:
+            album.captions.append(caption)
+
+        if album.timer is not None:
+            album.timer.cancel()
+        if len(album.media) >= ALBUM_MAX_ITEMS:
+            self._flush_album(key)
+        else:
+            album.timer = asyncio.get_running_loop().call_later(self.album_window, self._flush_album, key)
+
+    def _flush_albums(self, telegram_id: int):
+        for key in [key for key in self._albums if key[0] == telegram_id]:
+            self._flush_album(key)
+
+    def _flush_album(self, key):
+        """Поставить собранный альбом в очередь пересылки"""
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        if album.timer is not None:
+            album.timer.cancel()
+
+        caption = "\n".join(album.captions)
+        media = list(album.media)
+        media[0] = _with_caption(media[0], f"{album.header}:\n\n{caption}" if caption else album.header)
+        record = f"[Альбом: {len(media)}]" + (f" {caption}" if caption else "")
+
+        item = _Relayed(album.sender, album.route, 'send_media_group', {'media': media}, record)
+        item.created_at = album.created_at
+        item.received_at = album.received_at
+        self._enqueue(item)
+        if album.reply_markup is not None:
+            self._enqueue(_Relayed(album.sender, album.route, 'send_message', {
+                'text': "👆 Чтобы ответить, откройте чат",
+                'reply_markup': album.reply_markup,
+            }, None))
+
+    def _enqueue(self, item: _Relayed):
+        key = (item.from_telegram_id, item.route.partner_telegram_id)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            task = asyncio.create_task(self._run_queue(key, queue), name=f'relay:{key[0]}->{key[1]}')
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
+        queue.append(item)
+        self._pending += 1
+
+    async def _run_queue(self, key, queue: deque):
+        """Отправить сообщения одного направления разговора по порядку"""
+        try:
+            while queue:
+                await self._deliver(queue[0])
+                queue.popleft()
+                self._pending -= 1
+        finally:
+            if self._queues.get(key) is queue:
+                del self._queues[key]
+
+    async def _deliver(self, item: _Relayed):
+        try:
+            if self.operator_hook is not None and item.route.partner_telegram_id in outbound.operator_chats:
+                await self.operator_hook(item.from_user_id, item.route.partner_id, item.method, item.kwargs,
+                                         item.record)
+            else:
+                await outbound.send(item.method, item.route.partner_telegram_id, outbound.PRIORITY_CHAT,
+                                    **item.kwargs)
+            metrics.relay_seconds.observe(time.monotonic() - item.received_at, item.method)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(
+                f"Ошибка при пересылке ({item.method}) от {item.from_telegram_id} "
+                f"к {item.route.partner_telegram_id}: {e}"
+            )
+            if item.record is not None:
+                await self._report_failure(item, e)
+
+        # Историю сохраняем и для недоставленных сообщений - как было до relay
+        row = item.row()
+        if row is not None:
+            self._unsaved.append(row)
+            if len(self._unsaved) == self.batch_size:
+                self._flush_wakeup.set()
+
+    async def _report_failure(self, item: _Relayed, error: Exception):
+        """Сообщить отправителю, что собеседник не получил сообщение"""
+        text = f"❌ Не удалось отправить {_WHAT.get(item.method, 'сообщение')}.\n"
+        if outbound.is_permanent_failure(error):
+            text += "Пользователь не найден или заблокировал бота.\n\n"
+        text += "Попробуйте выйти из чата и открыть его заново."
+        try:
+            await outbound.send_message(item.from_telegram_id, text, priority=outbound.PRIORITY_CHAT)
+        except Exception as e:
+            logger.error(f"Не удалось сообщить {item.from_telegram_id} об ошибке пересылки: {e}")
+
+    # ========== Запись в БД ==========
+
+    async def flush(self) -> bool:
+        """Записать накопленные сообщения в БД; False - БД недоступна, записи остались в буфере"""
+        while self._unsaved:
+            rows = self._unsaved[:self.batch_size]
+            try:
+                await asyncio.to_thread(db.add_messages, rows)
+            except Exception as e:
+                metrics.relay_persist_errors.inc(type(e).__name__)
+                logger.error(f"Не удалось записать в БД {len(rows)} пересланных сообщений: {e}")
+                return False
+            del self._unsaved[:len(rows)]
+        return True
+
+    async def _run_writer(self):
+        """Записывать сообщения пачками: по заполнении пачки или раз в flush_interval"""
+        delay = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            saved = await self.flush()
+            if self._closing:
+                return
+            # Пока БД недоступна, повторяем всё реже (не реже раза в 30 сек)
+            delay = self.flush_interval if saved else min(30.0, delay * 2)
+
+    def _load_spool(self):
+        """Вернуть в буфер сообщения, не записанные в БД при прошлой остановке"""
+        if not os.path.exists(self.spool_path):
+            return
+        with open(self.spool_path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        for row in rows:
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+        self._unsaved[:0] = rows
+        os.remove(self.spool_path)
+        logger.info(f"Из {self.spool_path} загружено незаписанных сообщений: {len(rows)}")
+
+    def _save_spool(self):
+        with open(self.spool_path, 'a', encoding='utf-8') as f:
+            for row in self._unsaved:
+                f.write(json.dumps(dict(row, created_at=row['created_at'].isoformat()), ensure_ascii=False) + '\n')
+        logger.warning(f"БД недоступна: {len(self._unsaved)} сообщений сохранены в {self.spool_path}")
+        self._unsaved.clear()
+
+    # ========== Запуск и остановка ==========
+
+    def start(self):
+        """Запустить запись в БД (вызывается из post_init приложения)"""
+        if self._writer:
+            return
+        self._closing = False
+        self._load_spool()
+        self._writer = asyncio.create_task(self._run_writer(), name='relay-writer')
+
+    async def stop(self, timeout: float):
+        """Дождаться очередей пересылки (не дольше timeout), записать всё в БД и остановиться"""
+        for key in list(self._albums):
+            self._flush_album(key)
+        if self._workers:
+            _, pending = await asyncio.wait(set(self._workers), timeout=timeout)
+            if pending:
+                # Неотправленные сообщения всё равно попадают в историю чата
+                leftovers = [item for queue in self._queues.values() for item in queue]
+                logger.warning(f"Пересылка остановлена, не доставлено сообщений: {len(leftovers)}")
+                self._unsaved.extend(row for row in (item.row() for item in leftovers) if row is not None)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        self._pending = 0
+
+        self._closing = True
+        if self._writer:
+            self._flush_wakeup.set()
+            await self._writer
+            self._writer = None
+        if self._unsaved and not await self.flush():
+            self._save_spool()
+
+
+def _with_caption(media, caption: str):
+    """Копия InputMedia с подписью (объекты telegram неизменяемы)"""
+    return type(media)(media=media.media, caption=caption)
+
+
+def _spool_path() -> str:
+    # В кластере у каждого воркера свой файл
+    if config.CLUSTER_WORKER_INDEX:
+        root, ext = os.path.splitext(config.RELAY_SPOOL_PATH)
+        return f"{root}.{config.CLUSTER_WORKER_INDEX}{ext}"
+    return config.RELAY_SPOOL_PATH
+
+
+engine = ChatRelay(
+    batch_size=config.RELAY_BATCH_SIZE,
+    flush_interval=config.RELAY_FLUSH_INTERVAL,
+    routes_size=config.RELAY_ROUTES_SIZE,
+    spool_path=_spool_path(),
+    album_window=config.RELAY_ALBUM_WINDOW,
+)
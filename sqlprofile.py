@@ -0,0 +1,184 @@
+"""
+Профилирование SQL-запросов по обработчикам обновлений
+
+На время работы обработчика (см. metrics._instrument_callback) в contextvar
+кладётся профиль, в который события SQLAlchemy записывают каждый запрос:
+количество, суммарное время, самый медленный запрос и сколько раз повторился
+один и тот же запрос (признак N+1 - запрос в цикле по результатам другого).
+Обработчики, превысившие порог, пишутся в лог; накопленная статистика
+выводится админу командой /sqlprofile.
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Длина SQL в логе и отчёте
+STATEMENT_PREVIEW = 200
+
+# Список колонок SELECT не помогает найти запрос, а занимает всё превью
+_SELECT_COLUMNS = re.compile(r'^SELECT .+? FROM ', re.IGNORECASE)
+
+_current = contextvars.ContextVar('sql_profile', default=None)
+
+# Статистика по обработчикам {имя обработчика: HandlerStats}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class UpdateProfile:
+    """Запросы, выполненные при обработке одного обновления"""
+    __slots__ = ('handler', 'queries', 'seconds', 'slowest_statement', 'slowest_seconds', 'statements')
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.queries = 0
+        self.seconds = 0.0
+        self.slowest_statement = None
+        self.slowest_seconds = 0.0
+        self.statements = {}  # SQL -> сколько раз выполнен
+
+    def record(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.seconds += elapsed
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+        if elapsed >= self.slowest_seconds:
+            self.slowest_seconds = elapsed
+            self.slowest_statement = statement
+
+    @property
+    def max_repeats(self) -> int:
+        return max(self.statements.values(), default=0)
+
+    @property
+    def repeated_statement(self):
+        if not self.statements:
+            return None
+        return max(self.statements, key=self.statements.get)
+
+
+class HandlerStats:
+    """Накопленная статистика обработчика"""
+    __slots__ = ('calls', 'queries', 'max_queries', 'seconds', 'max_repeats',
+                 'slowest_statement', 'slowest_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.seconds = 0.0
+        self.max_repeats = 0
+        self.slowest_statement = None
+        self.slowest_seconds = 0.0
+
+    def add(self, profile: UpdateProfile):
+        self.calls += 1
+        self.queries += profile.queries
+        self.max_queries = max(self.max_queries, profile.queries)
+        self.seconds += profile.seconds
+        self.max_repeats = max(self.max_repeats, profile.max_repeats)
+        if profile.slowest_seconds >= self.slowest_seconds:
+            self.slowest_seconds = profile.slowest_seconds
+            self.slowest_statement = profile.slowest_statement
+
+    @property
+    def avg_queries(self) -> float:
+        return self.queries / self.calls if self.calls else 0.0
+
+
+def _preview(statement) -> str:
+    statement = _SELECT_COLUMNS.sub('SELECT … FROM ', ' '.join((statement or '').split()), count=1)
+    if len(statement) > STATEMENT_PREVIEW:
+        statement = statement[:STATEMENT_PREVIEW - 1] + '…'
+    return statement
+
+
+def begin(handler: str):
+    """Начать профиль обработчика; вернуть токен для finish()"""
+    if not config.SQL_PROFILE_ENABLED:
+        return None
+    return _current.set(UpdateProfile(handler))
+
+
+def finish(token):
+    """Завершить профиль: добавить в статистику, при превышении порога записать в лог"""
+    if token is None:
+        return
+    profile = _current.get()
+    _current.reset(token)
+    if profile is None or not profile.queries:
+        return
+
+    with _stats_lock:
+        stats = _stats.get(profile.handler)
+        if stats is None:
+            stats = _stats[profile.handler] = HandlerStats()
+        stats.add(profile)
+
+    if profile.queries > config.SQL_PROFILE_MAX_QUERIES or profile.seconds > config.SQL_PROFILE_MAX_SECONDS:
+        logger.warning(
+            "Много SQL в обработчике %s: запросов %d за %.1f мс, самый медленный %.1f мс: %s; "
+            "чаще всего (%d раз): %s",
+            profile.handler, profile.queries, profile.seconds * 1000, profile.slowest_seconds * 1000,
+            _preview(profile.slowest_statement), profile.max_repeats, _preview(profile.repeated_statement)
+        )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    starts = conn.info.get('profile_start')
+    if profile is None or not starts:
+        return
+    profile.record(statement, time.perf_counter() - starts.pop())
+
+
+def install(engine):
+    """Подключить профилирование к движку SQLAlchemy (повторный вызов ничего не делает)"""
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def top_handlers(limit: int = 10) -> list:
+    """[(обработчик, HandlerStats)] по убыванию среднего числа запросов"""
+    with _stats_lock:
+        items = list(_stats.items())
+    items.sort(key=lambda item: (item[1].avg_queries, item[1].max_queries), reverse=True)
+    return items[:limit]
+
+
+def reset():
+    """Сбросить накопленную статистику"""
+    with _stats_lock:
+        _stats.clear()
+
+
+def format_report(limit: int = 10) -> str:
+    """Текстовый отчёт по обработчикам с наибольшим числом запросов"""
+    top = top_handlers(limit)
+    if not top:
+        return "SQL-запросов в обработчиках пока не было."
+
+    lines = ["🐢 SQL по обработчикам (среднее / максимум запросов за вызов):", ""]
+    for handler, stats in top:
+        lines.append(
+            f"{handler}: {stats.avg_queries:.1f} / {stats.max_queries} "
+            f"(вызовов {stats.calls}, {stats.seconds / stats.calls * 1000:.1f} мс SQL на вызов, "
+            f"повторов одного запроса до {stats.max_repeats})"
+        )
+        if stats.slowest_statement:
+            lines.append(f"  медленный ({stats.slowest_seconds * 1000:.1f} мс): {_preview(stats.slowest_statement)}")
+    return '\n'.join(lines)
@@ -0,0 +1,337 @@
+"""
+Хранилище состояния пользователей между сообщениями (открытый чат, ожидание суммы доната и т.п.)
+
+Каждое состояние - словарь {telegram_id: значение}. Последние использованные
+записи держатся в памяти (LRU ограниченного размера), все записи - в SQLite,
+поэтому после перезапуска бота пользователи остаются в своих чатах.
+Заброшенные записи удаляются по истечении TTL.
+
+Изменения не пишутся в SQLite сразу: они копятся в памяти и раз в
+STATE_FLUSH_INTERVAL сек записываются одной транзакцией в отдельном потоке
+(flush_job), другие процессы кластера узнают о них после записи. Чтение
+при промахе кэша, перебор и len() по-прежнему обращаются к SQLite
+синхронно: промахи редки, а перебор нужен только периодическим задачам.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Все созданные состояния {namespace: StateStore}
+_stores = {}
+
+# В кластере (cluster.py): функция (namespace, key), которая сообщает другим
+# процессам, что запись изменилась и её нужно убрать из их кэша в памяти
+changed_hook = None
+
+
+class SQLiteStateBackend:
+    """Долговременное хранение состояний в SQLite (одна таблица на все состояния)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        # Запись идёт из потока flush, чтение - из цикла событий
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                ' namespace TEXT NOT NULL,'
+                ' key INTEGER NOT NULL,'
+                ' value TEXT NOT NULL,'
+                ' expires_at REAL NOT NULL,'
+                ' PRIMARY KEY (namespace, key))'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_state_expires ON state (expires_at)')
+        return self._conn
+
+    def get(self, namespace: str, key: int):
+        """(значение, срок истечения) или None"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT value, expires_at FROM state WHERE namespace = ? AND key = ? AND expires_at > ?',
+                (namespace, key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def write(self, namespace: str, changed: list, touched: list, removed: list):
+        """
+        Записать пачку изменений одной транзакцией
+
+        Args:
+            changed: [(key, значение в JSON, срок истечения)]
+            touched: [(key, новый срок истечения)]
+            removed: [key]
+        """
+        with self._lock:
+            conn = self.conn
+            conn.execute('BEGIN')
+            try:
+                if changed:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                        [(namespace, key, value, expires_at) for key, value, expires_at in changed]
+                    )
+                if touched:
+                    conn.executemany(
+                        'UPDATE state SET expires_at = ? WHERE namespace = ? AND key = ?',
+                        [(expires_at, namespace, key) for key, expires_at in touched]
+                    )
+                if removed:
+                    conn.executemany(
+                        'DELETE FROM state WHERE namespace = ? AND key = ?',
+                        [(namespace, key) for key in removed]
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def keys(self, namespace: str):
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT key FROM state WHERE namespace = ? AND expires_at > ?',
+                (namespace, time.time())
+            )]
+
+    def purge_expired(self) -> int:
+        """Удалить истёкшие записи всех состояний"""
+        with self._lock:
+            return self.conn.execute('DELETE FROM state WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class StateStore(MutableMapping):
+    """
+    Словарь {telegram_id: значение} с LRU-кэшем в памяти и копией в SQLite
+
+    Значения должны сериализоваться в JSON. Срок жизни записи продлевается
+    при обращении к ней, так что истекают только заброшенные состояния.
+    """
+
+    def __init__(self, namespace: str, ttl: int, max_items: int = None, backend: SQLiteStateBackend = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_items = max_items or config.STATE_CACHE_SIZE
+        self.backend = backend or _backend
+        self._cache = OrderedDict()  # key -> (value, expires_at)
+        # Ещё не записанные в SQLite изменения: key -> (value, expires_at, JSON), value=_MISSING - удаление
+        self._dirty = {}
+        self._touched = {}  # key -> новый срок истечения
+        self._flushing = {}  # _dirty, которые сейчас записываются
+        _stores[namespace] = self
+
+    def _remember(self, key, value, expires_at):
+        # value=_MISSING - записи нет ни в памяти, ни в SQLite
+        self._cache[key] = (value, expires_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_items:
+            # Из памяти вытесняем, в SQLite запись остаётся
+            self._cache.popitem(last=False)
+
+    def _lookup(self, key):
+        now = time.time()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] is _MISSING and entry[1] <= now:
+            # Отсутствие записи перепроверяем в SQLite не чаще раза в TTL
+            entry = None
+        if entry is None:
+            # Вытесненная из памяти запись может быть ещё не записана в SQLite
+            entry = self._unflushed(key)
+        if entry is None:
+            metrics.cache_miss(f'state_{self.namespace}')
+            entry = self.backend.get(self.namespace, key)
+            if entry is None:
+                # Отсутствие тоже кэшируем: этот процесс пишет только через __setitem__,
+                # а об изменениях в других процессах сообщает forget()
+                self._remember(key, _MISSING, now + self.ttl)
+                return _MISSING
+        elif entry[1] <= now:
+            self._cache.pop(key, None)
+            self._change(key, _MISSING, now + self.ttl)
+            return _MISSING
+        else:
+            metrics.cache_hit(f'state_{self.namespace}')
+            if entry[0] is _MISSING:
+                self._remember(key, *entry)
+                return _MISSING
+
+        value, expires_at = entry
+        # Продлеваем срок, когда прошло больше половины TTL (не пишем в БД на каждое обращение)
+        if expires_at - now < self.ttl / 2:
+            expires_at = now + self.ttl
+            if key in self._dirty:
+                self._dirty[key] = (value, expires_at, self._dirty[key][2])
+            else:
+                self._touched[key] = expires_at
+        self._remember(key, value, expires_at)
+        return value
+
+    def _unflushed(self, key):
+        entry = self._dirty.get(key) or self._flushing.get(key)
+        return entry[:2] if entry is not None else None
+
+    def _change(self, key, value, expires_at):
+        # JSON - сразу: несериализуемое значение должно падать здесь, а не при записи
+        encoded = json.dumps(value) if value is not _MISSING else None
+        self._dirty[key] = (value, expires_at, encoded)
+        self._touched.pop(key, None)
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._change(key, value, expires_at)
+        self._remember(key, value, expires_at)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        expires_at = time.time() + self.ttl
+        self._change(key, _MISSING, expires_at)
+        self._remember(key, _MISSING, expires_at)
+
+    def _keys(self) -> set:
+        keys = set(self.backend.keys(self.namespace))
+        now = time.time()
+        for pending in (self._flushing, self._dirty):
+            for key, (value, expires_at, _) in pending.items():
+                if value is _MISSING or expires_at <= now:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return keys
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def _take(self):
+        """Забрать накопленные изменения для записи: (изменения, продления)"""
+        dirty, self._dirty = self._dirty, {}
+        touched, self._touched = self._touched, {}
+        self._flushing = dirty
+        return dirty, touched
+
+    def _write(self, dirty: dict, touched: dict):
+        self.backend.write(
+            self.namespace,
+            [(key, encoded, expires_at) for key, (value, expires_at, encoded) in dirty.items()
+             if value is not _MISSING],
+            list(touched.items()),
+            [key for key, (value, _, _) in dirty.items() if value is _MISSING],
+        )
+
+    async def flush(self):
+        """Записать накопленные изменения в SQLite (в отдельном потоке)"""
+        dirty, touched = self._take()
+        if not dirty and not touched:
+            return
+        try:
+            await asyncio.to_thread(self._write, dirty, touched)
+        except Exception as e:
+            logger.error(f"Не удалось записать {len(dirty) + len(touched)} изменений состояния {self.namespace}: {e}")
+            # Повторим со следующей записью; изменения, сделанные за это время, новее
+            for key, entry in dirty.items():
+                self._dirty.setdefault(key, entry)
+            for key, expires_at in touched.items():
+                if key not in self._dirty:
+                    self._touched.setdefault(key, expires_at)
+            return
+        finally:
+            self._flushing = {}
+        if changed_hook:
+            for key in dirty:
+                changed_hook(self.namespace, key)
+
+    def flush_sync(self):
+        """Записать накопленные изменения сразу (при остановке)"""
+        dirty, touched = self._take()
+        try:
+            if dirty or touched:
+                self._write(dirty, touched)
+        finally:
+            self._flushing = {}
+
+    def forget(self, key):
+        """Убрать запись только из памяти (например, если её изменил другой процесс)"""
+        self._cache.pop(key, None)
+
+
+_backend = SQLiteStateBackend(config.STATE_DB_PATH)
+_flush_lock = asyncio.Lock()
+
+
+def forget(namespace: str, key):
+    """Убрать запись из кэша в памяти (её изменил другой процесс)"""
+    store = _stores.get(namespace)
+    if store is not None:
+        store.forget(key)
+
+
+async def flush():
+    """Записать накопленные изменения всех состояний"""
+    async with _flush_lock:
+        for store in list(_stores.values()):
+            await store.flush()
+
+
+async def flush_job(context):
+    """Периодическая задача записи состояний"""
+    await flush()
+
+
+def purge_expired() -> int:
+    """Удалить из SQLite все истёкшие состояния"""
+    removed = _backend.purge_expired()
+    if removed:
+        logger.info(f"Удалено истёкших состояний: {removed}")
+    return removed
+
+
+async def purge_expired_job(context):
+    """Периодическая задача очистки истёкших состояний"""
+    await asyncio.to_thread(purge_expired)
+
+
+def close():
+    """Дописать оставшиеся изменения и закрыть соединение с SQLite"""
+    for store in _stores.values():
+        try:
+            store.flush_sync()
+        except Exception as e:
+            logger.error(f"Не удалось записать состояние {store.namespace} при остановке: {e}")
+    _backend.close()
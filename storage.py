@@ -0,0 +1,351 @@
+"""
+Хранилище файлов фотографий анкет
+
+Бот работает с фото только через ключи (значение photo_path в БД) и этот
+модуль, поэтому файлы могут лежать как на локальном диске, так и в любом
+S3-совместимом хранилище (AWS S3, MinIO, Yandex Object Storage и т.п.).
+Во втором случае несколько экземпляров бота могут работать на разных серверах.
+Фото для отправки в Telegram открываются через open() и читаются частями
+во время запроса, put() принимает и поток частей (stream() другого хранилища).
+
+Перенос существующих локальных фото в S3:
+    PHOTO_STORAGE=s3 python storage.py --upload-local
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from urllib.parse import quote, urlparse
+
+import httpx
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Временные файлы меньше этого размера остаются в памяти
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class StorageError(Exception):
+    """Ошибка при работе с хранилищем фото"""
+
+
+class PhotoStorage:
+    """Интерфейс хранилища фото"""
+
+    async def put(self, key: str, data):
+        """Сохранить файл (bytes или асинхронный итератор частей, например stream() другого хранилища)"""
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes:
+        """Прочитать файл целиком"""
+        chunks = []
+        async for chunk in self.stream(key):
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE):
+        """Читать файл частями (асинхронный итератор bytes)"""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def open(self, key: str):
+        """
+        Файл для чтения, который можно передать в Telegram без чтения в память целиком
+
+        По умолчанию содержимое из stream() копируется во временный файл
+        (до SPOOL_MAX_SIZE - в памяти, больше - на диске).
+        """
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as f:
+            async for chunk in self.stream(key):
+                await asyncio.to_thread(f.write, chunk)
+            f.seek(0)
+            yield f
+
+    async def exists(self, key: str) -> bool:
+        """Есть ли файл"""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        """Удалить файл (отсутствие файла - не ошибка)"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Освободить ресурсы"""
+
+
+class LocalStorage(PhotoStorage):
+    """Файлы на локальном диске в каталоге PHOTOS_DIR"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        """Путь к файлу на диске по ключу"""
+        # Старые записи хранят путь целиком (photos/123.jpg)
+        if os.path.isabs(key) or key.startswith(self.root + '/') or key.startswith(self.root + os.sep):
+            return key
+        return os.path.join(self.root, *key.split('/'))
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _open_tmp(path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        return tmp_path, open(tmp_path, 'wb')
+
+    async def put(self, key: str, data):
+        path = self.path(key)
+        if isinstance(data, bytes):
+            await asyncio.to_thread(self._write, path, data)
+            return
+        tmp_path, f = await asyncio.to_thread(self._open_tmp, path)
+        try:
+            with f:
+                async for chunk in data:
+                    await asyncio.to_thread(f.write, chunk)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            await asyncio.to_thread(self._remove, tmp_path)
+            raise
+
+    async def stream(self, key: str, chunk_size: int = CHUNK_SIZE):
+        try:
+            f = await asyncio.to_thread(open, self.path(key), 'rb')
+        except FileNotFoundError:
+            raise StorageError(f"Файл {key} не найден")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+
+    @asynccontextmanager
+    async def open(self, key: str):
+        try:
+            f = await asyncio.to_thread(open, self.path(key), 'rb')
+        except FileNotFoundError:
+            raise StorageError(f"Файл {key} не найден")
+        try:
+            yield f
+        finally:
+            f.close()
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, self.path(key))
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._remove, self.path(key))
+
+
+class S3Storage(PhotoStorage):
+    """S3-совместимое хранилище (запросы подписываются AWS Signature V4)"""
+
+    EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+    def __init__(self, endpoint: str, bucket: str, access_key: str, secret_key: str,
+                 region: str = 'us-east-1', prefix: str = ''):
+        self.endpoint = endpoint.rstrip('/')
+        self.host = urlparse(self.endpoint).netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip('/')
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30)
+        return self._client
+
+    def _object_path(self, key: str) -> str:
+        key = key.lstrip('/')
+        if self.prefix:
+            key = f"{self.prefix}/{key}"
+        return quote(f"/{self.bucket}/{key}", safe='/-_.~')
+
+    def _signing_key(self, date: str) -> bytes:
+        key = ('AWS4' + self.secret_key).encode()
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return key
+
+    def _headers(self, method: str, path: str, payload_hash: str) -> dict:
+        """Заголовки запроса с подписью AWS Signature V4"""
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = now.strftime('%Y%m%d')
+
+        headers = {
+            'host': self.host,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+        }
+        signed_headers = ';'.join(sorted(headers))
+        canonical_headers = ''.join(f"{name}:{headers[name]}\n" for name in sorted(headers))
+        canonical_request = '\n'.join([method, path, '', canonical_headers, signed_headers, payload_hash])
+
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256',
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        signature = hmac.new(self._signing_key(date), string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        headers['authorization'] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        del headers['host']  # httpx выставит его сам
+        return headers
+
+    def _request(self, method: str, key: str, data=None, payload_hash: str = None, size: int = None):
+        path = self._object_path(key)
+        if payload_hash is None:
+            payload_hash = hashlib.sha256(data).hexdigest() if data is not None else self.EMPTY_SHA256
+        headers = self._headers(method, path, payload_hash)
+        if size is not None:
+            # Поток частей без размера httpx отправил бы chunked, а S3 такое не принимает
+            headers['content-length'] = str(size)
+        return self.client.build_request(
+            method,
+            self.endpoint + path,
+            headers=headers,
+            content=data
+        )
+
+    @staticmethod
+    async def _read_chunks(f, chunk_size: int = CHUNK_SIZE):
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    async def _send_put(self, key: str, request):
+        request.headers['content-type'] = 'image/jpeg'
+        response = await self.client.send(request)
+        if response.status_code >= 300:
+            raise StorageError(f"S3 PUT {key}: {response.status_code} {response.text[:200]}")
+
+    async def put(self, key: str, data):
+        if isinstance(data, bytes):
+            await self._send_put(key, self._request('PUT', key, data))
+            return
+        # Для подписи нужны хэш и размер до отправки: части копятся во временном файле
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as f:
+            async for chunk in data:
+                digest.update(chunk)
+                size += len(chunk)
+                await asyncio.to_thread(f.write, chunk)
+            f.seek(0)
+            request = self._request('PUT', key, self._read_chunks(f), payload_hash=digest.hexdigest(), size=size)
+            await self._send_put(key, request)
+
+    async def stream(self, key: str, chunk_size: int = CHUNK_SIZE):
+        response = await self.client.send(self._request('GET', key), stream=True)
+        try:
+            if response.status_code == 404:
+                raise StorageError(f"Файл {key} не найден")
+            if response.status_code >= 300:
+                await response.aread()
+                raise StorageError(f"S3 GET {key}: {response.status_code} {response.text[:200]}")
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def exists(self, key: str) -> bool:
+        response = await self.client.send(self._request('HEAD', key))
+        if response.status_code == 404:
+            return False
+        if response.status_code >= 300:
+            raise StorageError(f"S3 HEAD {key}: {response.status_code}")
+        return True
+
+    async def delete(self, key: str):
+        response = await self.client.send(self._request('DELETE', key))
+        if response.status_code >= 300 and response.status_code != 404:
+            raise StorageError(f"S3 DELETE {key}: {response.status_code} {response.text[:200]}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_storage() -> PhotoStorage:
+    """Создать хранилище согласно настройкам"""
+    if config.PHOTO_STORAGE == 's3':
+        return S3Storage(
+            endpoint=config.S3_ENDPOINT,
+            bucket=config.S3_BUCKET,
+            access_key=config.S3_ACCESS_KEY,
+            secret_key=config.S3_SECRET_KEY,
+            region=config.S3_REGION,
+            prefix=config.S3_PREFIX
+        )
+    return LocalStorage(config.PHOTOS_DIR)
+
+
+backend = create_storage()
+
+
+async def _upload_local():
+    """Скопировать фото всех анкет с локального диска в текущее хранилище"""
+    import database as db
+
+    local = LocalStorage(config.PHOTOS_DIR)
+    session = db.get_session()
+    try:
+        keys = [row[0] for row in session.query(db.User.photo_path).distinct()]
+    finally:
+        session.close()
+
+    import photos
+    copied = 0
+    for key in keys:
+        for file_key in (key, photos.thumbnail_key(key)):
+            if not await local.exists(file_key) or await backend.exists(file_key):
+                continue
+            await backend.put(file_key, local.stream(file_key))
+            copied += 1
+    await backend.close()
+    print(f"✅ Скопировано файлов: {copied}")
+
+
+if __name__ == '__main__':
+    if '--upload-local' in sys.argv:
+        asyncio.run(_upload_local())
+    else:
+        print(__doc__)
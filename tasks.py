@@ -0,0 +1,100 @@
+"""
+Фоновые задачи обработчиков (уведомления другим пользователям и т.п.)
+
+Обработчик сначала отвечает своему пользователю, а побочные действия,
+которые ему ждать незачем, передаёт в spawn(). Супервизор:
+- хранит ссылки на задачи (asyncio сам держит только слабые);
+- ограничивает число одновременно выполняемых задач;
+- логирует и считает в метриках ошибки задач;
+- при остановке бота дожидается незавершённых задач (drain).
+"""
+import asyncio
+import contextvars
+import logging
+import time
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundQueueFull(Exception):
+    """Слишком много незавершённых фоновых задач"""
+
+
+class TaskSupervisor:
+    """Запуск и учёт фоновых задач"""
+
+    def __init__(self, concurrency: int, max_pending: int):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._tasks = set()
+        self._slots = None
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def spawn(self, coro, name: str) -> asyncio.Task:
+        """Запустить корутину в фоне; name - метка для логов и метрик"""
+        if self._closing or len(self._tasks) >= self.max_pending:
+            coro.close()
+            metrics.background_rejected.inc(name)
+            reason = "бот останавливается" if self._closing else f"уже {len(self._tasks)} задач"
+            raise BackgroundQueueFull(f"Фоновая задача {name} отклонена: {reason}")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        # Пустой контекст: SQL и время задачи не приписываются обработчику, который её запустил
+        task = asyncio.create_task(self._run(coro, name), name=f'background:{name}',
+                                   context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, coro, name: str):
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                await coro
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.background_errors.inc(name, type(e).__name__)
+                logger.exception(f"Ошибка фоновой задачи {name}: {e}")
+            finally:
+                metrics.background_seconds.observe(time.perf_counter() - started, name)
+
+    async def drain(self, timeout: float):
+        """Не принимать новые задачи, дождаться текущих (не дольше timeout), остальные отменить"""
+        self._closing = True
+        if not self._tasks:
+            return
+        logger.info(f"Ожидание фоновых задач: {len(self._tasks)}")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"Фоновые задачи не завершились за {timeout} сек и отменены: {len(pending)}")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+supervisor = TaskSupervisor(
+    concurrency=config.BACKGROUND_CONCURRENCY,
+    max_pending=config.BACKGROUND_MAX_PENDING,
+)
+
+
+def spawn(coro, name: str):
+    """
+    Выполнить побочное действие в фоне, не задерживая ответ пользователю
+
+    Если очередь переполнена, действие отбрасывается с записью в лог
+    (ответ пользователю важнее уведомления другому).
+    """
+    try:
+        return supervisor.spawn(coro, name)
+    except BackgroundQueueFull as e:
+        logger.error(str(e))
+        return None
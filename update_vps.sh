@@ -20,13 +20,16 @@ source venv/bin/activate
 # 5. Обновить зависимости (если requirements.txt изменился)
 # pip install -r requirements.txt
 
-# 6. Запустить бота через systemd
+# 6. Применить миграции схемы БД (бот применяет их и сам при запуске)
+python3 -m migrations
+
+# 7. Запустить бота через systemd
 sudo systemctl start dating-bot
 
 # ИЛИ запустить вручную в фоне:
 # nohup python3 bot.py > bot.log 2>&1 &
 
-# 7. Проверить статус бота
+# 8. Проверить статус бота
 sudo systemctl status dating-bot
 
 # ИЛИ проверить логи: